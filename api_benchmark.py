@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+from rich.console import Console
+from rich.table import Table
+from api_standins import Behaviour, playlist_id, spotify_id, start_all, video_id
+
+# Times imports and exports against the local stand-ins in api_standins.py,
+# so a regression can be pinned on our code rather than on the APIs. Runs
+# offline; the clients are pointed at the stand-ins through the *_API_URL
+# settings before any of the app modules are imported.
+
+console = Console()
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def number_list(text):
+    return [int(part) for part in text.split(",") if part.strip()]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline import/export benchmark against local API stand-ins")
+    parser.add_argument("--sizes", type=number_list, default=[100, 1000, 10000], help="playlist sizes in tracks")
+    parser.add_argument("--operations", default="import_spotify,import_youtube,export_spotify,export_youtube")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every API call")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds sent with each 429")
+    parser.add_argument("--page-size", type=int, help="cap on items per page, below the real API limits")
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="client-side requests/second per provider")
+    parser.add_argument("--concurrency", type=int, default=8, help="client-side concurrent requests per provider")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="api_benchmark.json")
+    return parser.parse_args(argv)
+
+def configure(standins, workdir):
+    # Everything below reads its settings at import time
+    os.environ["SPOTIFY_API_URL"] = standins["spotify"].url + "/v1/"
+    os.environ["YOUTUBE_API_URL"] = standins["youtube"].url + "/"
+    os.environ["ODESLI_API_URL"] = standins["odesli"].url + "/v1-alpha.1/links"
+    os.environ["MATCH_CACHE_FILE"] = os.path.join(workdir, "match_cache.db")
+
+def expected_tracks(size):
+    return [
+        (f"https://open.spotify.com/track/{spotify_id(index)}", f"https://music.youtube.com/watch?v={video_id(index)}")
+        for index in range(size)
+    ]
+
+def run_import(get_playlist, platform_name, size, workdir, run):
+    from journal import ImportJournal
+    from library import Library
+    from match_cache import MatchCache
+    # A fresh cache, library and journal each run: only the API path is being timed
+    get_playlist.match_cache = MatchCache(os.path.join(workdir, f"cache-{platform_name}-{size}-{run}.db"))
+    get_playlist.library = library = Library(os.path.join(workdir, f"library-{platform_name}-{size}-{run}.db"))
+    journal = ImportJournal(platform_name, playlist_id(size), directory=os.path.join(workdir, f"journal-{run}"))
+    fetch = get_playlist.get_spotify_playlist if platform_name == "spotify" else get_playlist.get_youtube_playlist
+    try:
+        playlist, track_ids = fetch(playlist_id(size), journal)
+        journal.discard()
+        if playlist is None:
+            return False, "import failed"
+        found = [(track["spotify_id"], track["youtube_music_id"]) for track in library.tracks_by_id(track_ids)]
+    finally:
+        library.close()
+    if found != expected_tracks(size):
+        return False, f"{sum(a != b for a, b in zip(found, expected_tracks(size))) + abs(len(found) - size)} tracks wrong"
+    return True, None
+
+def run_export(create, transport, platform_name, size, standins):
+    now = datetime.datetime.now()
+    if platform_name == "spotify":
+        spotify = transport.spotify_client(auth="benchmark")
+        created = create.create_spotify_playlist(spotify, f"Benchmark {size}", now)
+        errors = create.add_tracks_to_spotify_playlist(spotify, created, [spotify_id(index) for index in range(size)])
+        stored, wanted = standins["spotify"].created[created], [spotify_id(index) for index in range(size)]
+    else:
+        youtube = transport.youtube_client("benchmark")
+        created = create.create_youtube_playlist(youtube, f"Benchmark {size}", now)
+        errors = create.add_videos_to_youtube_playlist(youtube, created, [video_id(index) for index in range(size)])
+        stored, wanted = standins["youtube"].created[created], [video_id(index) for index in range(size)]
+    if errors:
+        return False, f"{len(errors)} items not added"
+    if stored != wanted:
+        return False, "exported playlist does not match"
+    return True, None
+
+def measure(operation, size, run, modules, standins, workdir):
+    get_playlist, create, transport = modules
+    kind, platform_name = operation.split("_", 1)
+    for standin in standins.values():
+        standin.reset()
+    started = time.monotonic()
+    try:
+        if kind == "import":
+            correct, error = run_import(get_playlist, platform_name, size, workdir, run)
+        else:
+            correct, error = run_export(create, transport, platform_name, size, standins)
+    except Exception as e:
+        correct, error = False, f"{type(e).__name__}: {e}"
+    elapsed = time.monotonic() - started
+    stats = {name: standin.stats() for name, standin in standins.items()}
+    latencies = [latency for api in stats.values() for latency in api.pop("latencies")]
+    calls = sum(api["calls"] for api in stats.values())
+    return {
+        "operation": operation,
+        "tracks": size,
+        "run": run,
+        "elapsed": elapsed,
+        "tracks_per_second": size / elapsed if correct else 0.0,
+        "calls": calls,
+        "calls_per_track": calls / size if size else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies) if latencies else None,
+        # 429s and 503s the stand-ins answered with; the run retried through them
+        "throttled": sum(api["throttled"] for api in stats.values()),
+        "errors": sum(api["errors"] for api in stats.values()),
+        "correct": correct,
+        "error": error,
+        "apis": stats,
+    }
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def show_results(results):
+    table = Table(title="API Benchmark", header_style="bold magenta")
+    for column in ("Operation", "Tracks", "Time (s)", "Tracks/s", "Calls/track", "p95 (ms)", "p99 (ms)", "429s", "Correct"):
+        table.add_column(column, justify="right")
+    for record in results:
+        table.add_row(
+            record["operation"],
+            str(record["tracks"]),
+            f"{record['elapsed']:.2f}",
+            f"{record['tracks_per_second']:.0f}",
+            f"{record['calls_per_track']:.3f}",
+            f"{record['latency_p95'] * 1000:.1f}" if record["latency_p95"] is not None else "-",
+            f"{record['latency_p99'] * 1000:.1f}" if record["latency_p99"] is not None else "-",
+            str(record["throttled"]),
+            "[green]yes[/green]" if record["correct"] else f"[red]no[/red] {record['error']}",
+        )
+    console.print(table)
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "retry_after": args.retry_after,
+        "page_size": args.page_size,
+    }
+    standins = start_all(lambda name: Behaviour(seed=args.seed, **settings))
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            configure(standins, workdir)
+            import create
+            import get_playlist
+            import resolver
+            import transport
+            for name in resolver.LIMITERS:
+                resolver.LIMITERS[name] = resolver.ProviderLimiter(name, args.rate_limit, args.rate_limit, args.concurrency)
+            get_playlist.sp = transport.spotify_client(auth="benchmark")
+            get_playlist.YOUTUBE_API_KEY = "benchmark"
+            modules = (get_playlist, create, transport)
+            for operation in [name.strip() for name in args.operations.split(",") if name.strip()]:
+                for size in args.sizes:
+                    for run in range(args.repeat):
+                        console.print(f"[dim]{operation}, {size} tracks, run {run + 1}[/dim]")
+                        results.append(measure(operation, size, run, modules, standins, workdir))
+    finally:
+        for standin in standins.values():
+            standin.stop()
+    report = {
+        "benchmark": "api",
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": dict(settings, rate_limit=args.rate_limit, concurrency=args.concurrency),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    show_results(results)
+    console.print(f"[green]Results written to {args.output}[/green]")
+    return 0 if all(record["correct"] for record in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+import json
+import hashlib
+import math
+import time
+import random
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Local HTTP stand-ins for the Spotify Web API, YouTube Data API v3 and
+# api.song.link, serving a synthetic catalog. Point SPOTIFY_API_URL,
+# YOUTUBE_API_URL and ODESLI_API_URL at them to run imports and exports
+# without network access. Each one can add latency, 5xx errors and 429s.
+
+SPOTIFY_PAGE_LIMIT = 100
+YOUTUBE_PAGE_LIMIT = 50
+
+def spotify_id(index):
+    return f"bench{index:017d}"
+
+def video_id(index):
+    return f"v{index:010d}"
+
+def playlist_id(size):
+    # Valid as both a Spotify and a YouTube playlist ID; the digits give
+    # the number of tracks
+    return f"PLbench{size:015d}"
+
+def track_index(identifier):
+    digits = "".join(ch for ch in identifier if ch.isdigit())
+    return int(digits) if digits else None
+
+def playlist_size(identifier):
+    if not identifier.startswith("PLbench"):
+        return None
+    return track_index(identifier)
+
+class Behaviour:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, page_size=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def roll(self):
+        # Returns the injected status, if any, and how long to stall first
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            draw = self.random.random()
+        if draw < self.throttle_rate:
+            return 429, delay
+        if draw < self.throttle_rate + self.error_rate:
+            return 503, delay
+        return None, delay
+
+class Standin:
+    # One API on its own port. Subclasses map (method, path, query, body) to
+    # a status and a JSON document.
+    name = "api"
+
+    def __init__(self, behaviour=None):
+        self.behaviour = behaviour or Behaviour()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.reset()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.latencies = []
+            self.injected = {429: 0, 503: 0}
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": sum(count for endpoint, count in self.calls.items() if not endpoint.endswith("(batched)")),
+                "batched": sum(count for endpoint, count in self.calls.items() if endpoint.endswith("(batched)")),
+                "endpoints": dict(self.calls),
+                "throttled": self.injected[429],
+                "errors": self.injected[503],
+                "latencies": list(self.latencies),
+            }
+
+    def record(self, endpoint, started):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.latencies.append(time.monotonic() - started)
+
+    def inject(self):
+        status, delay = self.behaviour.roll()
+        if delay:
+            time.sleep(delay)
+        if status is not None:
+            with self.lock:
+                self.injected[status] += 1
+        return status
+
+    def page_size(self, requested, limit):
+        size = min(requested, limit)
+        return min(size, self.behaviour.page_size) if self.behaviour.page_size else size
+
+    def error_body(self, status):
+        return {"error": {"status": status, "message": "injected by the stand-in"}}
+
+    def route(self, method, path, query, body):
+        return 404, {"error": {"status": 404, "message": f"no route for {method} {path}"}}
+
+    def handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; with Nagle on, the
+            # client's delayed ACK would add ~40ms to every call
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle_request(self, method):
+                started = time.monotonic()
+                parts = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status = standin.inject()
+                headers = {"Content-Type": "application/json"}
+                if status is not None:
+                    payload = json.dumps(standin.error_body(status)).encode()
+                    if status == 429:
+                        # Whole seconds, as the real APIs send it
+                        headers["Retry-After"] = str(math.ceil(standin.behaviour.retry_after))
+                else:
+                    status, payload, headers = standin.respond(method, parts.path, query, body, self.headers)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                standin.record(f"{method} {standin.endpoint(parts.path)}", started)
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def do_PUT(self):
+                self.handle_request("PUT")
+
+            def do_DELETE(self):
+                self.handle_request("DELETE")
+
+        return Handler
+
+    def respond(self, method, path, query, body, headers):
+        try:
+            document = json.loads(body) if body else None
+        except ValueError:
+            document = None
+        status, result = self.route(method, path, query, document)
+        return status, json.dumps(result).encode(), {"Content-Type": "application/json"}
+
+    def endpoint(self, path):
+        # Collapse IDs so call counts group by endpoint
+        return "/".join("{id}" if len(part) > 6 and any(ch.isdigit() for ch in part) else part for part in path.split("/"))
+
+class SpotifyStandin(Standin):
+    name = "spotify"
+
+    def __init__(self, behaviour=None):
+        super().__init__(behaviour)
+        self.created = {}
+
+    def track(self, index):
+        return {
+            "track": {
+                "id": spotify_id(index),
+                "name": f"Track {index}",
+                "artists": [{"name": f"Artist {index % 50}"}],
+                "album": {"name": f"Album {index % 200}"},
+                "external_ids": {"isrc": f"BENCH{index:07d}"},
+            }
+        }
+
+    def page(self, size, offset, limit):
+        limit = self.page_size(limit, SPOTIFY_PAGE_LIMIT)
+        return [self.track(index) for index in range(offset, min(size, offset + limit))]
+
+    def route(self, method, path, query, body):
+        parts = [part for part in path.split("/") if part][1:]
+        if method == "GET" and parts == ["me"]:
+            return 200, {"id": "benchmark"}
+        if method == "POST" and len(parts) == 3 and parts[0] == "users" and parts[2] == "playlists":
+            with self.lock:
+                playlist_id = f"created{len(self.created):06d}"
+                self.created[playlist_id] = []
+            return 201, {"id": playlist_id, "name": (body or {}).get("name")}
+        if len(parts) >= 2 and parts[0] == "playlists":
+            playlist_id = parts[1]
+            if method == "POST" and parts[2:] in (["items"], ["tracks"]) and playlist_id in self.created:
+                uris = body if isinstance(body, list) else (body or {}).get("uris", [])
+                with self.lock:
+                    self.created[playlist_id].extend(uri.rsplit(":", 1)[-1] for uri in uris)
+                return 201, {"snapshot_id": f"snapshot-{len(self.created[playlist_id])}"}
+            size = playlist_size(playlist_id)
+            if method == "GET" and size is not None:
+                if not parts[2:]:
+                    return 200, {
+                        "name": f"Benchmark {size}",
+                        "snapshot_id": f"snapshot-{size}",
+                        "tracks": {"total": size, "items": self.page(size, 0, SPOTIFY_PAGE_LIMIT)},
+                    }
+                if parts[2:] in (["items"], ["tracks"]):
+                    offset = int(query.get("offset", 0))
+                    items = self.page(size, offset, int(query.get("limit", 50)))
+                    return 200, {"items": items, "total": size, "next": None}
+        return super().route(method, path, query, body)
+
+class YouTubeStandin(Standin):
+    name = "youtube"
+
+    def __init__(self, behaviour=None):
+        super().__init__(behaviour)
+        self.created = {}
+        # Item IDs of created playlists, kept in step with their videos
+        self.created_items = {}
+
+    def item(self, index):
+        return {
+            "id": f"item{index:010d}",
+            "snippet": {
+                "title": f"Track {index}",
+                "videoOwnerChannelTitle": f"Artist {index % 50}",
+                "resourceId": {"kind": "youtube#video", "videoId": video_id(index)},
+            },
+            "contentDetails": {"videoId": video_id(index)},
+        }
+
+    def route(self, method, path, query, body):
+        resource = path.rstrip("/").rsplit("/", 1)[-1]
+        if resource == "playlists" and method == "GET":
+            size = playlist_size(query.get("id", ""))
+            if size is None:
+                return 200, {"items": []}
+            return 200, {"items": [{"id": query["id"], "etag": f"etag-{size}", "snippet": {"title": f"Benchmark {size}"}}]}
+        if resource == "playlists" and method == "POST":
+            with self.lock:
+                playlist_id = f"PLcreated{len(self.created):06d}"
+                self.created[playlist_id] = []
+                self.created_items[playlist_id] = []
+            return 200, {"id": playlist_id, "snippet": (body or {}).get("snippet", {})}
+        if resource == "playlistItems" and method == "GET":
+            playlist_id = query.get("playlistId", "")
+            if playlist_id in self.created:
+                with self.lock:
+                    videos, items = list(self.created[playlist_id]), list(self.created_items[playlist_id])
+                size, make = len(videos), lambda index: {"id": items[index], "contentDetails": {"videoId": videos[index]}}
+            else:
+                size, make = playlist_size(playlist_id) or 0, self.item
+            offset = int(query.get("pageToken") or 0)
+            limit = self.page_size(int(query.get("maxResults", 5)), YOUTUBE_PAGE_LIMIT)
+            result = {"items": [make(index) for index in range(offset, min(size, offset + limit))]}
+            if offset + limit < size:
+                result["nextPageToken"] = str(offset + limit)
+            # Like the real API, a page's ETag is a digest of what is on it
+            result["etag"] = hashlib.sha1(json.dumps(result, sort_keys=True).encode()).hexdigest()
+            return 200, result
+        if resource == "playlistItems" and method == "POST":
+            snippet = (body or {}).get("snippet", {})
+            videos = self.created.get(snippet.get("playlistId"))
+            if videos is None:
+                return 404, {"error": {"code": 404, "message": "playlist not found"}}
+            with self.lock:
+                position = snippet.get("position", len(videos))
+                if not 0 <= position <= len(videos):
+                    # The real API refuses a position past the end rather than appending
+                    return 400, {"error": {"code": 400, "message": "invalidPlaylistItemPosition", "errors": [{"reason": "invalidPlaylistItemPosition"}]}}
+                item_id = f"item-{sum(map(len, self.created_items.values())):08d}"
+                videos.insert(position, snippet["resourceId"]["videoId"])
+                self.created_items[snippet["playlistId"]].insert(position, item_id)
+            return 200, {"id": item_id, "snippet": snippet}
+        if resource == "playlistItems" and method == "PUT":
+            snippet = (body or {}).get("snippet", {})
+            videos = self.created.get(snippet.get("playlistId"))
+            if videos is None:
+                return 404, {"error": {"code": 404, "message": "playlist not found"}}
+            with self.lock:
+                items = self.created_items[snippet["playlistId"]]
+                if body.get("id") not in items:
+                    return 404, {"error": {"code": 404, "message": "playlist item not found"}}
+                position = snippet.get("position", 0)
+                if not 0 <= position < len(videos):
+                    return 400, {"error": {"code": 400, "message": "invalidPlaylistItemPosition", "errors": [{"reason": "invalidPlaylistItemPosition"}]}}
+                current = items.index(body["id"])
+                videos.insert(position, videos.pop(current))
+                items.insert(position, items.pop(current))
+            return 200, {"id": body["id"], "snippet": snippet}
+        if resource == "search" and method == "GET":
+            index = track_index(query.get("q", "").split(" ")[1] if " " in query.get("q", "") else "")
+            return 200, {"items": [{"id": {"kind": "youtube#video", "videoId": video_id(index)}}] if index is not None else []}
+        return super().route(method, path, query, body)
+
+    def error_body(self, status):
+        return {"error": {"code": status, "message": "injected by the stand-in", "errors": []}}
+
+    def respond(self, method, path, query, body, headers):
+        if path.rstrip("/").endswith("/batch"):
+            return self.batch(body, headers)
+        return super().respond(method, path, query, body, headers)
+
+    def batch(self, body, headers):
+        # multipart/mixed in, multipart/mixed out; each part is retried,
+        # throttled and failed on its own like the real batch endpoint
+        message = BytesParser().parsebytes(
+            b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body
+        )
+        boundary = "batch_standin_boundary"
+        out = []
+        for part in message.get_payload():
+            request = part.get_payload(decode=True) or part.get_payload().encode()
+            head, _, inner_body = request.replace(b"\r\n", b"\n").partition(b"\n\n")
+            method, target = head.split(b"\n", 1)[0].decode().split(" ")[:2]
+            parts = urlsplit(target)
+            query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+            status, _ = self.behaviour.roll()
+            if status is not None:
+                with self.lock:
+                    self.injected[status] += 1
+                result = self.error_body(status)
+            else:
+                status, result = self.route(method, parts.path, query, json.loads(inner_body) if inner_body.strip() else None)
+            with self.lock:
+                endpoint = f"{method} {self.endpoint(parts.path)} (batched)"
+                self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            content_id = part.get("Content-ID", "").strip("<>")
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(result)}\r\n"
+            )
+        payload = ("".join(out) + f"--{boundary}--\r\n").encode()
+        return 200, payload, {"Content-Type": f"multipart/mixed; boundary={boundary}"}
+
+class OdesliStandin(Standin):
+    name = "odesli"
+
+    def route(self, method, path, query, body):
+        if method == "GET" and path.rstrip("/").endswith("/links"):
+            url = query.get("url", "")
+            if "spotify.com/track/" in url or "v=" in url:
+                identifier = url.rsplit("/", 1)[-1] if "spotify.com" in url else url.split("v=")[-1].split("&")[0]
+                index = track_index(identifier)
+                if index is not None:
+                    return 200, {"linksByPlatform": {
+                        "spotify": {"url": f"https://open.spotify.com/track/{spotify_id(index)}"},
+                        "youtubeMusic": {"url": f"https://music.youtube.com/watch?v={video_id(index)}"},
+                    }}
+            return 400, {"statusCode": 400, "code": "could_not_resolve_entity"}
+        return super().route(method, path, query, body)
+
+def start_all(behaviour_for=lambda name: Behaviour()):
+    return {
+        cls.name: cls(behaviour_for(cls.name)).start()
+        for cls in (SpotifyStandin, YouTubeStandin, OdesliStandin)
+    }
@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from rich.console import Console
+from rich.table import Table
+from spotipy.oauth2 import SpotifyOAuth
+import create
+import get_playlist
+import metrics
+from journal import ImportJournal
+from library import open_library
+from match_cache import MatchCache, spotify_track_id, youtube_video_id
+from resolver import QUOTA_COSTS, QUOTAS, QuotaExceeded
+from transport import spotify_client
+
+# Converts the playlists listed in a manifest without any prompts, for
+# scheduled runs. Playlists are converted several at a time; they share
+# the process-wide rate limiters and YouTube quota budget, so the batch
+# runs as fast as the APIs allow rather than one playlist after another.
+# A failed playlist is retried (its import journal makes that a resume)
+# and the outcome is written as a JSON report.
+#
+# Manifest:
+# {
+#     "defaults": {"targets": ["youtube"]},
+#     "playlists": [
+#         "https://open.spotify.com/playlist/...",
+#         {"source": "https://music.youtube.com/playlist?list=...", "targets": ["spotify"], "name": "Gym"}
+#     ]
+# }
+# An entry may also set "remove_extras" and "fix_order" for syncing into
+# a playlist exported earlier.
+
+load_dotenv("credentials.env")
+console = Console()
+PARALLEL = int(os.getenv("BATCH_PARALLEL", "4"))
+RETRIES = int(os.getenv("BATCH_RETRIES", "2"))
+RETRY_DELAY = float(os.getenv("BATCH_RETRY_DELAY", "30"))
+REPORT_FILE = os.getenv("BATCH_REPORT", "batch_report.json")
+YOUTUBE_TOKEN_FILE = os.getenv("YOUTUBE_TOKEN_FILE", "youtube_token.json")
+PLATFORMS = ("spotify", "youtube")
+LINKS = {"spotify": ("spotify_id", spotify_track_id), "youtube": ("youtube_music_id", youtube_video_id)}
+# One saved sign-in covers reading sources and writing exports
+SPOTIFY_SCOPE = " ".join([get_playlist.SCOPE] + create.SCOPES_SPOTIFY)
+
+class BatchError(Exception):
+    pass
+
+def load_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"playlists": manifest}
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for number, entry in enumerate(manifest.get("playlists", []), 1):
+        entry = dict(defaults, **({"source": entry} if isinstance(entry, str) else entry))
+        platform, playlist_id = get_playlist.parse_playlist_url(entry.get("source") or "")
+        if platform is None:
+            raise BatchError(f"entry {number}: {entry.get('source')!r} is not a Spotify or YouTube playlist URL")
+        targets = entry.get("targets", [])
+        targets = [targets] if isinstance(targets, str) else list(targets)
+        unknown = [target for target in targets if target not in PLATFORMS]
+        if unknown:
+            raise BatchError(f"entry {number}: unknown target {unknown[0]!r} (use {' or '.join(PLATFORMS)})")
+        jobs.append({
+            "source": entry["source"],
+            "platform": platform,
+            "playlist_id": playlist_id,
+            "name": entry.get("name"),
+            "targets": targets,
+            "remove_extras": bool(entry.get("remove_extras")),
+            "fix_order": bool(entry.get("fix_order")),
+        })
+    sources = [(job["platform"], job["playlist_id"]) for job in jobs]
+    names = [job["name"] for job in jobs if job["name"]]
+    if len(set(sources)) < len(sources) or len(set(names)) < len(names):
+        raise BatchError("each source playlist and each name may only appear once in the manifest")
+    return jobs
+
+def spotify_auth(interactive=False):
+    manager = SpotifyOAuth(
+        client_id=get_playlist.SPOTIFY_CLIENT_ID,
+        client_secret=get_playlist.SPOTIFY_CLIENT_SECRET,
+        redirect_uri=get_playlist.REDIRECT_URI,
+        scope=SPOTIFY_SCOPE,
+        open_browser=interactive
+    )
+    if interactive:
+        manager.get_access_token(as_dict=False)
+    elif manager.validate_token(manager.cache_handler.get_cached_token()) is None:
+        raise BatchError("no saved Spotify sign-in with read and write access; run 'python batch.py --sign-in' once")
+    return manager
+
+def youtube_credentials(interactive=False):
+    # Only needed for exports to YouTube, so loaded on first use
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    credentials = None
+    if os.path.exists(YOUTUBE_TOKEN_FILE):
+        credentials = Credentials.from_authorized_user_file(YOUTUBE_TOKEN_FILE, create.SCOPES_YT)
+        if not credentials.valid and credentials.refresh_token:
+            credentials.refresh(Request())
+    if credentials is None or not credentials.valid:
+        if not interactive:
+            raise BatchError(f"no saved YouTube sign-in in {YOUTUBE_TOKEN_FILE}; run 'python batch.py --sign-in' once")
+        import google_auth_oauthlib.flow
+        flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(create.CLIENT_SECRETS_FILE, create.SCOPES_YT)
+        credentials = flow.run_local_server(port=0)
+    with open(YOUTUBE_TOKEN_FILE, "w", encoding="utf-8") as f:
+        f.write(credentials.to_json())
+    return credentials
+
+def sign_in(spotify=True, youtube=True, interactive=False):
+    if spotify:
+        client = spotify_client(spotify_auth(interactive))
+        get_playlist.sp = create.signed_in_spotify = client
+    if youtube:
+        create.youtube_credentials = youtube_credentials(interactive)
+
+def unique_name(library, title):
+    name = title
+    number = 2
+    while library.meta(name) is not None:
+        name = f"{title} ({number})"
+        number += 1
+    return name
+
+def import_job(job, library, names_lock, counts):
+    # Imports the source into the library, as an update when it was saved
+    # before; returns the saved name and the number of tracks stored, or
+    # None when the saved copy is already up to date. Local matches are
+    # added up in counts, which belongs to this job alone.
+    platform, playlist_id = job["platform"], job["playlist_id"]
+    name = job["name"] or library.find_source(platform, playlist_id)
+    previous = library.meta(name) if name else None
+    known = None
+    if previous and previous.get("source", {}).get("playlist_id") == playlist_id:
+        known = library.playlist_links(name, LINKS[platform][0])
+    else:
+        previous = None
+    journal = ImportJournal(platform, playlist_id)
+    fetch = get_playlist.fetch_spotify_playlist if platform == "spotify" else get_playlist.fetch_youtube_playlist
+    playlist, track_ids = fetch(playlist_id, journal, previous, known, counts)
+    if playlist is previous:
+        journal.discard()
+        return name, None
+    if previous and "exports" in previous:
+        playlist["exports"] = previous["exports"]
+    with names_lock:
+        name = name or unique_name(library, playlist["name"])
+        library.save_rows(name, playlist, track_ids)
+    journal.discard()
+    return name, len(track_ids)
+
+def export_job(job, name, library, exports):
+    # Fills exports in as each target finishes, so a report of a failed
+    # playlist still shows the targets done before the failure
+    for target in job["targets"]:
+        playlist = library.meta(name)
+        link, to_id = LINKS[target]
+        item_ids = [to_id(track[link]) for track in library.tracks(name) if track.get(link)]
+        playlist_id = (playlist.get("exports") or {}).get(target)
+        created = playlist_id is None
+        if target == "youtube":
+            youtube = create.authenticate_youtube()
+            if created:
+                needed = QUOTA_COSTS["youtube.playlists.insert"] + QUOTA_COSTS["youtube.playlistItems.insert"] * len(item_ids)
+                remaining = QUOTAS["youtube"].remaining()
+                if remaining is not None and needed > remaining:
+                    # Better left for a later run than created half empty
+                    raise QuotaExceeded(f"exporting '{name}' needs {needed} YouTube quota units, {remaining} left")
+                playlist_id = create.create_youtube_playlist(youtube, playlist["name"], datetime.datetime.now())
+        else:
+            spotify = create.authenticate_spotify()
+            if created:
+                playlist_id = create.create_spotify_playlist(spotify, playlist["name"], datetime.datetime.now())
+        if created:
+            # Recorded before the tracks go in, so a retry syncs into it
+            library.set_export(name, target, playlist_id)
+            if target == "youtube":
+                errors = create.add_videos_to_youtube_playlist(youtube, playlist_id, item_ids)
+            else:
+                errors = create.add_tracks_to_spotify_playlist(spotify, playlist_id, item_ids)
+            summary = {"added": len(item_ids) - len(errors), "removed": 0, "moved": 0, "errors": errors}
+        elif target == "youtube":
+            summary = create.sync_youtube_playlist(youtube, playlist_id, item_ids, job["remove_extras"], job["fix_order"])
+        else:
+            summary = create.sync_spotify_playlist(spotify, playlist_id, item_ids, job["remove_extras"], job["fix_order"])
+        exports[target] = {
+            "playlist_id": playlist_id,
+            "created": created,
+            "added": summary["added"],
+            "removed": summary["removed"],
+            "moved": summary["moved"],
+            "failed": [str(item) for item, _ in summary["errors"]],
+            "not_removed": [str(item) for item, _ in summary.get("not_removed", [])],
+        }
+
+def run_job(job, library, names_lock, retries, retry_delay):
+    label = job["name"] or job["source"]
+    result = {
+        "source": job["source"],
+        "platform": job["platform"],
+        "playlist_id": job["playlist_id"],
+        "name": job["name"],
+        "status": "failed",
+        "attempts": 0,
+        "updated": False,
+        "tracks": None,
+        "local_matches": None,
+        "exports": {},
+        "error": None,
+        "elapsed": 0.0,
+    }
+    started = time.monotonic()
+    for attempt in range(retries + 1):
+        result["attempts"] = attempt + 1
+        try:
+            counts = get_playlist.MatchCounts()
+            name, tracks = import_job(job, library, names_lock, counts)
+            result["name"] = label = name
+            if tracks is not None:
+                result["updated"], result["tracks"] = True, tracks
+                result["local_matches"] = {"matched": counts.matched, "unmatched": counts.unmatched}
+            export_job(job, name, library, result["exports"])
+            result["status"], result["error"] = "ok", None
+            break
+        except QuotaExceeded as e:
+            # Retrying cannot help until the quota is reset
+            result["status"], result["error"] = "quota", str(e)
+            break
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            console.print(f"[yellow]{label}: attempt {attempt + 1} failed: {e}[/yellow]")
+            if attempt < retries:
+                time.sleep(retry_delay * 2 ** attempt)
+    result["elapsed"] = time.monotonic() - started
+    style = {"ok": "green", "quota": "yellow"}.get(result["status"], "red")
+    console.print(f"[{style}]{label}: {result['status']}[/{style}]")
+    return result
+
+def write_report(path, report):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    os.replace(tmp_path, path)
+
+def show_results(results):
+    table = Table(title="Batch Results", header_style="bold magenta")
+    table.add_column("Playlist", style="cyan")
+    table.add_column("Status")
+    table.add_column("Tracks", justify="right")
+    table.add_column("Exports")
+    table.add_column("Error", style="red")
+    for result in results:
+        exports = ", ".join(f"{target} +{export['added']}" for target, export in result["exports"].items())
+        table.add_row(
+            result["name"] or result["source"], result["status"],
+            "-" if result["tracks"] is None else str(result["tracks"]), exports, (result["error"] or "")[:60]
+        )
+    console.print(table)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import and export the playlists in a manifest without prompts")
+    parser.add_argument("manifest", nargs="?", help="JSON file listing source playlist URLs and target platforms")
+    parser.add_argument("--report", default=REPORT_FILE, help="where to write the JSON status report")
+    parser.add_argument("--parallel", type=int, default=PARALLEL, help="playlists converted at once")
+    parser.add_argument("--retries", type=int, default=RETRIES, help="extra attempts for a failed playlist")
+    parser.add_argument("--retry-delay", type=float, default=RETRY_DELAY, help="seconds before the first retry, doubled each time")
+    parser.add_argument("--quota", type=int, help="YouTube quota units this run may use (default YOUTUBE_QUOTA_BUDGET, or unlimited)")
+    parser.add_argument("--sign-in", action="store_true", help="sign in to Spotify and YouTube in the browser and save the tokens for batch runs")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    # Exit status: 0 when every playlist was converted, 1 when any failed
+    # or was held back by the quota, 2 when the batch could not start
+    args = parse_args(argv)
+    if args.sign_in:
+        try:
+            sign_in(youtube=bool(create.CLIENT_SECRETS_FILE), interactive=True)
+        except Exception as e:
+            console.print(f"[red]Sign-in failed: {e}[/red]")
+            return 2
+        console.print("[green]Signed in; batch runs will reuse the saved tokens.[/green]")
+        if not args.manifest:
+            return 0
+    if not args.manifest:
+        console.print("[red]Give a manifest file, or --sign-in.[/red]")
+        return 2
+    try:
+        jobs = load_manifest(args.manifest)
+        sign_in(
+            spotify=any(job["platform"] == "spotify" or "spotify" in job["targets"] for job in jobs),
+            youtube=any("youtube" in job["targets"] for job in jobs)
+        )
+    except (OSError, ValueError, BatchError) as e:
+        console.print(f"[red]{e}[/red]")
+        return 2
+    if args.quota is not None:
+        QUOTAS["youtube"].units = args.quota
+    if get_playlist.match_cache is None:
+        get_playlist.match_cache = MatchCache()
+    library = get_playlist.library = open_library()
+    get_playlist.show_progress = False
+    names_lock = threading.Lock()
+
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    started = time.monotonic()
+    metrics.start("batch")
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+            results = list(pool.map(lambda job: run_job(job, library, names_lock, args.retries, args.retry_delay), jobs))
+        statuses = [result["status"] for result in results]
+        metrics.record("batch", {status: statuses.count(status) for status in ("ok", "failed", "quota")})
+    finally:
+        metrics_path = metrics.finish()
+    budget = QUOTAS["youtube"]
+    report = {
+        "manifest": args.manifest,
+        "started": started_at.isoformat(),
+        "elapsed": time.monotonic() - started,
+        "ok": statuses.count("ok"),
+        "failed": statuses.count("failed"),
+        "quota": statuses.count("quota"),
+        "youtube_quota": {"budget": budget.units, "used": budget.used},
+        "metrics": metrics_path,
+        "playlists": results,
+    }
+    write_report(args.report, report)
+    show_results(results)
+    console.print(f"[dim]Report written to {args.report}[/dim]")
+    return 0 if report["ok"] == len(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import os
+import json
+import zlib
+import struct
+import hashlib
+from dotenv import load_dotenv
+from rich.console import Console
+from rich.panel import Panel
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv("credentials.env")
+console = Console()
+
+# Codec ids sent in HELLO offers. The high bit marks the compact playlist
+# encoding (bare track IDs instead of URLs) applied before compression.
+NONE = 0
+ZLIB = 1
+ZSTD = 2
+COMPACT = 0x80
+CODEC_NAMES = {NONE: "none", ZLIB: "zlib", ZSTD: "zstd"}
+
+OFFER = struct.Struct("!BIQ")  # codec, dictionary id, encoded size
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 19
+COMPRESS_LIMIT = 256 << 20
+DICTIONARY_FILE = os.getenv("COMPRESSION_DICTIONARY", "playlist.dict")
+DICTIONARY_SIZE = 16384
+
+SPOTIFY_TRACK_URL = "https://open.spotify.com/track/"
+YOUTUBE_MUSIC_URL = "https://music.youtube.com/watch?v="
+LINK_PREFIXES = {"spotify_id": SPOTIFY_TRACK_URL, "youtube_music_id": YOUTUBE_MUSIC_URL}
+
+# Used when no trained dictionary is present: the keys and layout of a
+# playlist file as get_playlist.py writes it, in both encodings
+BUILTIN_DICTIONARY = (
+    '{"name":"","source":{"platform":"youtube","playlist_id":"","etag":""},"tracks":['
+    '{"name":"","artist":"","album":"Unknown","spotify_id":null,"youtube_music_id":""},'
+    '{"name":"","artist":"","album":"","spotify_id":"","youtube_music_id":""}],'
+    '"exports":{"spotify":"","youtube":""}}'
+    '{\n    "name": "",\n    "source": {\n        "platform": "spotify",\n'
+    '        "playlist_id": "",\n        "snapshot_id": ""\n    },\n    "tracks": [\n'
+    '        {\n            "name": "",\n            "artist": "",\n'
+    '            "album": "Unknown",\n'
+    '            "spotify_id": "https://open.spotify.com/track/",\n'
+    '            "youtube_music_id": "https://music.youtube.com/watch?v="\n        },\n'
+    '        {\n            "name": "",\n            "artist": "",\n            "album": "",\n'
+    '            "spotify_id": "https://open.spotify.com/track/",\n'
+    '            "youtube_music_id": "https://music.youtube.com/watch?v="\n        }\n    ]\n}'
+).encode()
+
+class CompressionError(Exception):
+    pass
+
+def load_dictionary(path=DICTIONARY_FILE):
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return BUILTIN_DICTIONARY
+
+DICTIONARY = load_dictionary()
+# Both sides must hold the same dictionary; offers carry its id so a
+# mismatch falls back to an uncompressed transfer instead of garbage
+DICTIONARY_ID = struct.unpack("!I", hashlib.sha256(DICTIONARY).digest()[:4])[0]
+
+def available():
+    return [ZSTD, ZLIB] if zstandard is not None else [ZLIB]
+
+def compact(raw):
+    # Returns None unless expand() gives back the exact same bytes
+    try:
+        playlist = json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(playlist, dict) or not isinstance(playlist.get("tracks"), list):
+        return None
+    for track in playlist["tracks"]:
+        if not isinstance(track, dict):
+            return None
+        for key, prefix in LINK_PREFIXES.items():
+            value = track.get(key)
+            if isinstance(value, str) and value.startswith(prefix):
+                track[key] = value[len(prefix):]
+    encoded = json.dumps(playlist, separators=(",", ":")).encode()
+    return encoded if expand(encoded) == raw else None
+
+def expand(data):
+    playlist = json.loads(data)
+    for track in playlist["tracks"]:
+        for key, prefix in LINK_PREFIXES.items():
+            value = track.get(key)
+            if isinstance(value, str) and "://" not in value:
+                track[key] = prefix + value
+    return json.dumps(playlist, indent=4).encode()
+
+def compress(codec, data):
+    codec &= ~COMPACT
+    if codec == ZLIB:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zdict=DICTIONARY)
+        return compressor.compress(data) + compressor.flush()
+    if codec == ZSTD:
+        dictionary = zstandard.ZstdCompressionDict(DICTIONARY)
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary, write_checksum=True).compress(data)
+    return bytes(data)
+
+def decompress(codec, data):
+    try:
+        if codec & ~COMPACT == ZLIB:
+            decompressor = zlib.decompressobj(zdict=DICTIONARY)
+            data = decompressor.decompress(data) + decompressor.flush()
+        elif codec & ~COMPACT == ZSTD:
+            data = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(DICTIONARY)).decompress(data)
+        return expand(data) if codec & COMPACT else data
+    except Exception as e:
+        raise CompressionError(f"could not decode {codec_name(codec)} payload: {e}") from e
+
+def codec_name(codec):
+    name = CODEC_NAMES.get(codec & ~COMPACT, str(codec))
+    return f"{name}+compact" if codec & COMPACT else name
+
+def encode(codec, raw):
+    # Best encoding of the file within one codec family, or the file as is
+    # when that does not make it smaller
+    if codec == NONE or not raw or len(raw) > COMPRESS_LIMIT:
+        return NONE, raw
+    compacted = compact(raw)
+    body, flag = (compacted, COMPACT) if compacted is not None else (raw, 0)
+    data = compress(codec, body)
+    return (codec | flag, data) if len(data) < len(raw) else (NONE, raw)
+
+def encodings(raw):
+    # Every encoding this side can produce for the file, smallest first.
+    # raw may be a memory map: a file over COMPRESS_LIMIT, or one that is not
+    # a JSON playlist, gets no offers and is sent from the map uncopied
+    if not raw or len(raw) > COMPRESS_LIMIT or not bytes(raw[:64]).lstrip().startswith(b"{"):
+        return []
+    raw = bytes(raw)
+    # Compacted once for every codec
+    compacted = compact(raw)
+    body, flag = (compacted, COMPACT) if compacted is not None else (raw, 0)
+    encoded = [(codec | flag, compress(codec, body)) for codec in available()]
+    return sorted([item for item in encoded if len(item[1]) < len(raw)], key=lambda item: len(item[1]))
+
+def encode_offers(encoded):
+    return b"".join(OFFER.pack(codec, DICTIONARY_ID, len(data)) for codec, data in encoded)
+
+def batch_offers():
+    # Batches are encoded file by file once the receiver has picked a codec,
+    # so the offers carry no size
+    return [(codec, b"") for codec in available()]
+
+def decode_offers(payload):
+    usable = len(payload) // OFFER.size * OFFER.size
+    return [OFFER.unpack_from(payload, offset) for offset in range(0, usable, OFFER.size)]
+
+def choose(offers):
+    # Offers arrive smallest first; take the first one this side can decode
+    for codec, dictionary_id, size in offers:
+        if codec & ~COMPACT in available() and dictionary_id == DICTIONARY_ID:
+            return codec, size
+    return NONE, None
+
+def decode_file(codec, source_path, output_path):
+    with open(source_path, "rb") as f:
+        data = decompress(codec, f.read())
+    with open(output_path, "wb") as f:
+        f.write(data)
+
+def training_samples(directory="playlists"):
+    # One sample per track plus the playlist header, in both encodings, so
+    # the trainer sees the repeated structure rather than a few huge files
+    samples = []
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            raw = f.read()
+        compacted = compact(raw)
+        if compacted is None:
+            continue
+        playlist = json.loads(compacted)
+        tracks = playlist.pop("tracks")
+        samples.append(json.dumps(playlist, separators=(",", ":")).encode())
+        samples.extend(json.dumps(track, separators=(",", ":")).encode() for track in tracks)
+        samples.extend(json.dumps(track, indent=4).encode() for track in json.loads(raw)["tracks"])
+    return samples
+
+def train_dictionary(directory="playlists", path=DICTIONARY_FILE, size=DICTIONARY_SIZE):
+    if zstandard is None:
+        console.print(Panel("[red]Training a dictionary needs the zstandard package.[/red]", border_style="red"))
+        return False
+    samples = training_samples(directory)
+    try:
+        dictionary = zstandard.train_dictionary(size, samples)
+    except zstandard.ZstdError as e:
+        console.print(Panel(f"[red]Not enough playlist data to train a dictionary:[/red] {e}", border_style="red"))
+        return False
+    with open(path, "wb") as f:
+        f.write(dictionary.as_bytes())
+    console.print(Panel(
+        f"[bold green]Trained a {len(dictionary.as_bytes())} byte dictionary from {len(samples)} samples into {path}.[/bold green]\n"
+        "[yellow]Copy it next to the receiver as well; both sides need the same file.[/yellow]",
+        border_style="green"
+    ))
+    return True
+
+if __name__ == "__main__":
+    train_dictionary()
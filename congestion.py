@@ -0,0 +1,50 @@
+import time
+
+MIN_RTO = 0.02
+MAX_RTO = 10.0
+CLOCK_GRANULARITY = 0.001
+
+class RttEstimator:
+    # Smoothed RTT and retransmission timeout as in RFC 6298
+    def __init__(self, initial_rto):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)))
+
+    def backoff(self):
+        self.rto = min(MAX_RTO, self.rto * 2)
+
+class CongestionWindow:
+    # Slow start then additive increase; halve at most once per round trip on loss
+    def __init__(self, initial, maximum):
+        self.cwnd = float(initial)
+        self.ssthresh = float(maximum)
+        self.maximum = maximum
+        self.last_reduction = 0.0
+
+    def __int__(self):
+        return max(1, int(self.cwnd))
+
+    def on_ack(self):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1
+        else:
+            self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, self.maximum)
+
+    def on_loss(self, rtt):
+        now = time.monotonic()
+        if now - self.last_reduction < rtt:
+            return
+        self.last_reduction = now
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = self.ssthresh
@@ -6,14 +6,18 @@ from rich.table import Table
 from rich.progress import Progress
 from rich.text import Text
 import os
+import bisect
 import readchar
-import json
 import datetime
 from dotenv import load_dotenv
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
-import spotipy
+from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyOAuth
+from googleapiclient.errors import HttpError
+from transport import execute, retry_delay, retryable, spotify_client, throttled, youtube_client
+from resolver import RateLimited, charge_quota, limited, parse_retry_after
+from match_cache import spotify_track_id, youtube_video_id
+from library import choose_playlists, open_library
+import metrics
 
 # Load credentials from .env
 load_dotenv("credentials.env")
@@ -26,8 +30,20 @@ console = Console()
 
 SCOPES_YT = ["https://www.googleapis.com/auth/youtube.force-ssl"]
 SCOPES_SPOTIFY = ["playlist-modify-public", "playlist-modify-private"]
+SPOTIFY_BATCH_SIZE = 100
+YOUTUBE_BATCH_SIZE = 50
+
+# Signed-in state is kept for the whole process, so exporting again from
+# the menu skips the OAuth round trip
+youtube_credentials = None
+signed_in_spotify = None
 
 def authenticate_youtube():
+    global youtube_credentials
+    if youtube_credentials is not None:
+        return youtube_client(credentials=youtube_credentials)
+    # Only needed for the browser sign-in, so loaded on first use
+    import google_auth_oauthlib.flow
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
     flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
         CLIENT_SECRETS_FILE, SCOPES_YT
@@ -36,16 +52,19 @@ def authenticate_youtube():
     auth_text = Text("If not automatically opened, please authorize using ", style="bold white")
     auth_text.append("this link", style="bold blue link " + auth_url)
     console.print(Panel(auth_text, border_style="cyan"))
-    credentials = flow.run_local_server(port=0)
-    return googleapiclient.discovery.build("youtube", "v3", credentials=credentials)
+    youtube_credentials = flow.run_local_server(port=0)
+    return youtube_client(credentials=youtube_credentials)
 
 def authenticate_spotify():
-    return spotipy.Spotify(auth_manager=SpotifyOAuth(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=SPOTIFY_REDIRECT_URI,
-        scope=" ".join(SCOPES_SPOTIFY)
-    ))
+    global signed_in_spotify
+    if signed_in_spotify is None:
+        signed_in_spotify = spotify_client(SpotifyOAuth(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            redirect_uri=SPOTIFY_REDIRECT_URI,
+            scope=" ".join(SCOPES_SPOTIFY)
+        ))
+    return signed_in_spotify
 
 def create_youtube_playlist(youtube, playlist_name, creation_datetime):
     description = f"Created using MusiConvert at {creation_datetime.strftime('%H:%M %d/%m/%Y')}"
@@ -61,25 +80,74 @@ def create_youtube_playlist(youtube, playlist_name, creation_datetime):
             "status": {"privacyStatus": "public"},
         }
     )
-    response = request.execute()
+    response = limited("youtube", execute, request)
     return response["id"]
 
+def youtube_playlist_item_request(youtube, playlist_id, video_id):
+    return youtube.playlistItems().insert(part="snippet", body={"snippet": {
+        "playlistId": playlist_id,
+        "resourceId": {"kind": "youtube#video", "videoId": video_id},
+    }})
+
 def add_video_to_youtube_playlist(youtube, playlist_id, video_id):
-    request = youtube.playlistItems().insert(
-        part="snippet",
-        body={
-            "snippet": {
-                "playlistId": playlist_id,
-                "resourceId": {"kind": "youtube#video", "videoId": video_id},
-            },
-        }
-    )
-    request.execute()
+    limited("youtube", execute, youtube_playlist_item_request(youtube, playlist_id, video_id))
+
+def add_videos_to_youtube_playlist(youtube, playlist_id, video_ids, progress=None, task=None, keep_order=True):
+    # Items are appended without a position: one that fails, or a batch
+    # applied out of order, would leave later positions past the end of the
+    # playlist. The order is put right once everything is in
+    failed = {}
+    completed = set()
+
+    def on_insert(request_id, response, exception):
+        index = int(request_id)
+        if exception is not None:
+            failed[index] = exception
+            return
+        completed.add(index)
+        if progress is not None:
+            progress.advance(task)
+
+    for offset in range(0, len(video_ids), YOUTUBE_BATCH_SIZE):
+        batch = youtube.new_batch_http_request(callback=on_insert)
+        for index in range(offset, min(offset + YOUTUBE_BATCH_SIZE, len(video_ids))):
+            batch.add(youtube_playlist_item_request(youtube, playlist_id, video_ids[index]), request_id=str(index))
+        charge_quota("youtube", "youtube.playlistItems.insert", min(YOUTUBE_BATCH_SIZE, len(video_ids) - offset))
+        try:
+            # Not retried as a whole: items that went through must not be re-sent
+            with metrics.timed_call("youtube"):
+                limited("youtube", batch.execute)
+        except HttpError as e:
+            failed.update((index, e) for index in range(offset, min(offset + YOUTUBE_BATCH_SIZE, len(video_ids))) if index not in completed)
+
+    errors = []
+    throttled_items = [exception for exception in failed.values() if isinstance(exception, HttpError) and throttled(exception)]
+    if throttled_items:
+        # One pause for the whole batch's rate limited items, not one each
+        retry_delay(max(throttled_items, key=lambda e: parse_retry_after(e.resp.get("retry-after"), 0.0)), 0, "youtube")
+    for index, exception in sorted(failed.items()):
+        if not isinstance(exception, HttpError) or not retryable(exception):
+            # A missing or private video fails the same way every time
+            errors.append((video_ids[index], exception))
+        else:
+            try:
+                add_video_to_youtube_playlist(youtube, playlist_id, video_ids[index])
+                completed.add(index)
+            except (HttpError, RateLimited) as e:
+                errors.append((video_ids[index], e))
+        if progress is not None:
+            progress.advance(task)
+    if keep_order and len(completed) > 1:
+        current = get_youtube_playlist_items(youtube, playlist_id)
+        added = [video_ids[index] for index in sorted(completed)]
+        reorder_youtube_playlist(youtube, playlist_id, current, [video_id for _, video_id in current[:-len(added)]] + added)
+    return errors
 
 def create_spotify_playlist(spotify, playlist_name, creation_datetime):
     description = f"Created using MusiConvert at {creation_datetime.strftime('%H:%M %d/%m/%Y')}"
-    user_id = spotify.me()["id"]
-    playlist = spotify.user_playlist_create(
+    user_id = limited("spotify", spotify.me)["id"]
+    playlist = limited(
+        "spotify", spotify.user_playlist_create,
         user=user_id,
         name=playlist_name,
         public=True,
@@ -88,49 +156,277 @@ def create_spotify_playlist(spotify, playlist_name, creation_datetime):
     return playlist["id"]
 
 def add_track_to_spotify_playlist(spotify, playlist_id, track_uri):
-    spotify.playlist_add_items(playlist_id, [track_uri])
-
-def select_json_file(directory="playlists"):
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    files = [f for f in os.listdir(directory) if f.endswith('.json')]
-    if not files:
-        console.print("[red]No playlist JSON files found in the directory.[/red]")
-        return None
+    limited("spotify", add_spotify_chunk, spotify, playlist_id, [track_uri])
 
-    file_info = []
-    for f in files:
-        path = os.path.join(directory, f)
-        ctime = os.path.getctime(path)
-        dt = datetime.datetime.fromtimestamp(ctime)
-        file_info.append((f, dt.strftime("%H:%M:%S"), dt.strftime("%Y-%m-%d")))
-
-    table = Table(title="Available Playlists", show_lines=True)
-    table.add_column("No.", justify="right")
-    table.add_column("Name", style="cyan")
-    table.add_column("Time of Creation", style="green")
-    table.add_column("Date of Creation", style="magenta")
-    for idx, (fname, time_str, date_str) in enumerate(file_info, 1):
-        table.add_row(str(idx), fname, time_str, date_str)
-    console.print(table)
+def add_spotify_chunk(spotify, playlist_id, chunk):
+    # The session has already retried a 429 or 5xx; handing it to the limiter
+    # holds back every Spotify caller before the chunk is sent again
+    try:
+        spotify.playlist_add_items(playlist_id, chunk)
+    except SpotifyException as e:
+        if e.http_status == 429 or (e.http_status or 0) >= 500:
+            raise RateLimited("spotify", parse_retry_after(e.headers.get("Retry-After"), None)) from e
+        raise
 
-    while True:
-        choice = Prompt.ask("Enter the number of the playlist to select")
-        if choice.isdigit() and 1 <= int(choice) <= len(file_info):
-            selected_file = os.path.join(directory, file_info[int(choice) - 1][0])
-            return selected_file
+def add_tracks_to_spotify_playlist(spotify, playlist_id, track_uris, progress=None, task=None):
+    # A chunk is added atomically. Only a 400, which points at a bad URI, is
+    # worth retrying item by item to find it; a throttled or failing API
+    # would just get a hundred more calls
+    errors = []
+    for offset in range(0, len(track_uris), SPOTIFY_BATCH_SIZE):
+        chunk = track_uris[offset:offset + SPOTIFY_BATCH_SIZE]
+        try:
+            limited("spotify", add_spotify_chunk, spotify, playlist_id, chunk)
+        except RateLimited as e:
+            errors.extend((track_uri, e) for track_uri in chunk)
+        except SpotifyException as e:
+            if e.http_status != 400:
+                errors.extend((track_uri, e) for track_uri in chunk)
+            else:
+                for track_uri in chunk:
+                    try:
+                        add_track_to_spotify_playlist(spotify, playlist_id, track_uri)
+                    except (SpotifyException, RateLimited) as e:
+                        errors.append((track_uri, e))
+        if progress is not None:
+            progress.advance(task, len(chunk))
+    return errors
+
+def longest_increasing(sequence, rank):
+    tail_ranks, tail_indexes = [], []
+    parents = [None] * len(sequence)
+    for index, key in enumerate(sequence):
+        position = bisect.bisect_left(tail_ranks, rank[key])
+        parents[index] = tail_indexes[position - 1] if position else None
+        if position == len(tail_ranks):
+            tail_ranks.append(rank[key])
+            tail_indexes.append(index)
         else:
-            console.print("[red]Invalid choice. Try again.[/red]")
+            tail_ranks[position] = rank[key]
+            tail_indexes[position] = index
+    keep = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        keep.add(sequence[index])
+        index = parents[index]
+    return keep
+
+def reorder_moves(current, desired):
+    # Items on the longest already-ordered run stay put; every other item is
+    # moved to just after its predecessor in the desired order
+    rank = {key: index for index, key in enumerate(desired)}
+    keep = longest_increasing([key for key in dict.fromkeys(current) if key in rank], rank)
+    order = list(current)
+    moves = []
+    for index, key in enumerate(desired):
+        if key in keep or key not in order:
+            continue
+        from_index = order.index(key)
+        order.pop(from_index)
+        to_index = 0
+        for previous in reversed(desired[:index]):
+            if previous in order:
+                to_index = order.index(previous) + 1
+                break
+        order.insert(to_index, key)
+        moves.append((key, from_index, to_index))
+    return moves
+
+def get_spotify_playlist_track_ids(spotify, playlist_id):
+    # Local files and unavailable tracks have no ID; they stay in as None so
+    # that indexes match positions in the playlist
+    track_ids = []
+    results = limited("spotify", spotify.playlist_items, playlist_id, fields="items(track(id)),next", limit=SPOTIFY_BATCH_SIZE)
+    while results:
+        track_ids.extend((item.get("track") or {}).get("id") for item in results.get("items", []))
+        results = limited("spotify", spotify.next, results) if results.get("next") else None
+    return track_ids
+
+def sync_spotify_playlist(spotify, playlist_id, track_ids, remove_extras=False, fix_order=False, progress=None, task=None):
+    existing = get_spotify_playlist_track_ids(spotify, playlist_id)
+    desired = list(dict.fromkeys(track_ids))
+    wanted = set(desired)
+    extras = list(dict.fromkeys(track_id for track_id in existing if track_id is not None and track_id not in wanted))
+    if remove_extras:
+        for offset in range(0, len(extras), SPOTIFY_BATCH_SIZE):
+            limited("spotify", spotify.playlist_remove_all_occurrences_of_items, playlist_id, extras[offset:offset + SPOTIFY_BATCH_SIZE])
+        existing = [track_id for track_id in existing if track_id is None or track_id in wanted]
+    present = set(existing)
+    missing = [track_id for track_id in desired if track_id not in present]
+    if progress is not None:
+        progress.update(task, total=len(missing))
+    errors = add_tracks_to_spotify_playlist(spotify, playlist_id, missing, progress, task)
+    failed = {track_id for track_id, _ in errors}
+    moves = []
+    if fix_order:
+        moves = reorder_moves(existing + [track_id for track_id in missing if track_id not in failed], desired)
+        for _, from_index, to_index in moves:
+            limited(
+                "spotify", spotify.playlist_reorder_items, playlist_id,
+                range_start=from_index, insert_before=to_index + 1 if from_index < to_index else to_index
+            )
+    return {
+        "added": len(missing) - len(failed),
+        "removed": len(extras) if remove_extras else 0,
+        "moved": len(moves),
+        "errors": errors
+    }
+
+def get_youtube_playlist_items(youtube, playlist_id):
+    items = []
+    next_page_token = None
+    while True:
+        response = limited("youtube", execute, youtube.playlistItems().list(
+            part="contentDetails", playlistId=playlist_id, maxResults=50, pageToken=next_page_token
+        ))
+        items.extend((item["id"], item["contentDetails"]["videoId"]) for item in response.get("items", []))
+        next_page_token = response.get("nextPageToken")
+        if not next_page_token:
+            return items
+
+def reorder_youtube_playlist(youtube, playlist_id, current, desired):
+    # current is read after the inserts: the move requests need the IDs of
+    # the items just added
+    item_ids = {video_id: item_id for item_id, video_id in reversed(current)}
+    moves = reorder_moves([video_id for _, video_id in current], desired)
+    for video_id, _, to_index in moves:
+        limited("youtube", execute, youtube.playlistItems().update(part="snippet", body={
+            "id": item_ids[video_id],
+            "snippet": {
+                "playlistId": playlist_id,
+                "resourceId": {"kind": "youtube#video", "videoId": video_id},
+                "position": to_index
+            }
+        }))
+    return moves
+
+def sync_youtube_playlist(youtube, playlist_id, video_ids, remove_extras=False, fix_order=False, progress=None, task=None):
+    existing = get_youtube_playlist_items(youtube, playlist_id)
+    desired = list(dict.fromkeys(video_ids))
+    wanted = set(desired)
+    extras = [item_id for item_id, video_id in existing if video_id not in wanted]
+    not_removed = []
+    if remove_extras and extras:
+        failed = {}
+        completed = set()
+
+        def on_delete(request_id, response, exception):
+            if exception is not None:
+                failed[request_id] = exception
+            else:
+                completed.add(request_id)
+
+        for offset in range(0, len(extras), YOUTUBE_BATCH_SIZE):
+            batch = youtube.new_batch_http_request(callback=on_delete)
+            for item_id in extras[offset:offset + YOUTUBE_BATCH_SIZE]:
+                batch.add(youtube.playlistItems().delete(id=item_id), request_id=item_id)
+            charge_quota("youtube", "youtube.playlistItems.delete", len(extras[offset:offset + YOUTUBE_BATCH_SIZE]))
+            try:
+                with metrics.timed_call("youtube"):
+                    limited("youtube", batch.execute)
+            except HttpError as e:
+                failed.update((item_id, e) for item_id in extras[offset:offset + YOUTUBE_BATCH_SIZE] if item_id not in completed)
+        for item_id, exception in failed.items():
+            # Deleting twice is harmless, so anything a retry can fix is retried
+            if isinstance(exception, HttpError) and retryable(exception):
+                try:
+                    limited("youtube", execute, youtube.playlistItems().delete(id=item_id))
+                    continue
+                except (HttpError, RateLimited) as e:
+                    exception = e
+            not_removed.append((item_id, exception))
+        kept = {item_id for item_id, _ in not_removed}
+        existing = [(item_id, video_id) for item_id, video_id in existing if video_id in wanted or item_id in kept]
+    present = {video_id for _, video_id in existing}
+    missing = [video_id for video_id in desired if video_id not in present]
+    if progress is not None:
+        progress.update(task, total=len(missing))
+    errors = add_videos_to_youtube_playlist(youtube, playlist_id, missing, progress, task, keep_order=not fix_order)
+    moves = []
+    if fix_order:
+        moves = reorder_youtube_playlist(youtube, playlist_id, get_youtube_playlist_items(youtube, playlist_id), desired)
+    return {
+        "added": len(missing) - len(errors),
+        "removed": len(extras) - len(not_removed) if remove_extras else 0,
+        "moved": len(moves),
+        "errors": errors,
+        "not_removed": not_removed
+    }
+
+def choose_export_target(playlist_data, platform):
+    recorded = playlist_data.get("exports", {}).get(platform)
+    if recorded:
+        if Prompt.ask(f"[bold magenta]Sync into the playlist exported earlier ({recorded})?[/bold magenta]", choices=["y", "n"], default="y") == "y":
+            return recorded
+        return None
+    target = Prompt.ask(
+        "[bold magenta]Enter an existing playlist URL or ID to sync into, or leave blank to create a new one[/bold magenta]",
+        default=""
+    ).strip()
+    if "list=" in target:
+        return target.split("list=")[-1].split("&")[0]
+    if "playlist/" in target:
+        return target.split("playlist/")[-1].split("?")[0]
+    return target or None
+
+def ask_sync_options():
+    remove_extras = Prompt.ask("[bold magenta]Remove tracks that are not in the saved playlist?[/bold magenta]", choices=["y", "n"], default="n") == "y"
+    fix_order = Prompt.ask("[bold magenta]Reorder tracks to match the saved playlist?[/bold magenta]", choices=["y", "n"], default="n") == "y"
+    return remove_extras, fix_order
+
+def report_sync(summary, playlist_name, platform):
+    console.print(Panel(
+        f"\n[bold green]Playlist '{playlist_name}' synced on {platform}:[/bold green] "
+        f"{summary['added']} added, {summary['removed']} removed, {summary['moved']} moved",
+        border_style="green"
+    ))
+    if summary.get("not_removed"):
+        console.print(Panel(
+            f"[yellow]{len(summary['not_removed'])} extra items could not be removed:[/yellow] {summary['not_removed'][0][1]}",
+            border_style="yellow"
+        ))
+
+def record_export(platform, item_ids, summary):
+    metrics.record("export", {
+        "platform": platform,
+        "tracks": len(item_ids),
+        "added": summary["added"],
+        "removed": summary.get("removed", 0),
+        "moved": summary.get("moved", 0),
+        "failed": len(summary["errors"]),
+        "not_removed": len(summary.get("not_removed", [])),
+    })
+
+def report_failed_items(errors, platform):
+    if not errors:
+        return
+    table = Table(title=f"Items not added to {platform}", header_style="bold red")
+    table.add_column("Item", style="cyan")
+    table.add_column("Error", style="red")
+    for item, error in errors[:10]:
+        table.add_row(item, str(error))
+    if len(errors) > 10:
+        table.add_row(f"...and {len(errors) - 10} more", "")
+    console.print(table)
 
 def export_playlist():
+    metrics.start("export")
+    try:
+        export_saved_playlist()
+    finally:
+        metrics_path = metrics.finish()
+        if metrics_path:
+            console.print(f"[dim]Run metrics written to {metrics_path}[/dim]")
+
+def export_saved_playlist():
     console.clear()
     console.print(Panel("[bold magenta]MusiConvert: Export Playlist[/bold magenta]", border_style="cyan"))
-    selected_json = select_json_file("playlists")
-    if not selected_json:
+    library = open_library()
+    selected = choose_playlists(library)
+    if not selected:
         return
-
-    with open(selected_json, "r", encoding="utf-8") as file:
-        playlist_data = json.load(file)
+    # Only the IDs to add are kept; the tracks are read from the library in chunks
+    playlist_data = library.meta(selected)
 
     platform_table = Table.grid(padding=(0, 4))
     platform_table.add_column(justify="center")
@@ -156,27 +452,52 @@ def export_playlist():
     while True:
         key = readchar.readkey().lower()
         if key == 'y':
-            youtube = authenticate_youtube()
-            playlist_id = create_youtube_playlist(youtube, playlist_data["name"], creation_datetime)
-            with Progress() as progress:
-                task = progress.add_task("[cyan]Adding songs...", total=len(playlist_data["tracks"]))
-                for track in playlist_data["tracks"]:
-                    if "youtube_music_id" in track and track["youtube_music_id"]:
-                        video_id = track["youtube_music_id"].split("?")[-1].split("=")[-1]
-                        add_video_to_youtube_playlist(youtube, playlist_id, video_id)
-                    progress.advance(task)
-            console.print(Panel(f"\n[bold green]Playlist '{playlist_data['name']}' created on YouTube Music![/bold green]", border_style="green"))
+            with metrics.stage("authenticate"):
+                youtube = authenticate_youtube()
+            video_ids = [youtube_video_id(track["youtube_music_id"]) for track in library.tracks(selected) if track.get("youtube_music_id")]
+            playlist_id = choose_export_target(playlist_data, "youtube")
+            if playlist_id:
+                remove_extras, fix_order = ask_sync_options()
+                with metrics.stage("sync"), Progress() as progress:
+                    task = progress.add_task("[cyan]Adding missing songs...", total=None)
+                    summary = sync_youtube_playlist(youtube, playlist_id, video_ids, remove_extras, fix_order, progress, task)
+                record_export("youtube", video_ids, summary)
+                report_failed_items(summary["errors"], "YouTube Music")
+                report_sync(summary, playlist_data["name"], "YouTube Music")
+            else:
+                with metrics.stage("create"):
+                    playlist_id = create_youtube_playlist(youtube, playlist_data["name"], creation_datetime)
+                with metrics.stage("add"), Progress() as progress:
+                    task = progress.add_task("[cyan]Adding songs...", total=len(video_ids))
+                    errors = add_videos_to_youtube_playlist(youtube, playlist_id, video_ids, progress=progress, task=task)
+                record_export("youtube", video_ids, {"added": len(video_ids) - len(errors), "errors": errors})
+                report_failed_items(errors, "YouTube Music")
+                console.print(Panel(f"\n[bold green]Playlist '{playlist_data['name']}' created on YouTube Music![/bold green]", border_style="green"))
+            library.set_export(selected, "youtube", playlist_id)
             break
         elif key == 's':
-            spotify = authenticate_spotify()
-            playlist_id = create_spotify_playlist(spotify, playlist_data["name"], creation_datetime)
-            with Progress() as progress:
-                task = progress.add_task("[green]Adding tracks...", total=len(playlist_data["tracks"]))
-                for track in playlist_data["tracks"]:
-                    if "spotify_id" in track and track["spotify_id"]:
-                        add_track_to_spotify_playlist(spotify, playlist_id, track["spotify_id"])
-                    progress.advance(task)
-            console.print(Panel(f"\n[bold green]Playlist '{playlist_data['name']}' created on Spotify![/bold green]", border_style="green"))
+            with metrics.stage("authenticate"):
+                spotify = authenticate_spotify()
+            track_ids = [spotify_track_id(track["spotify_id"]) for track in library.tracks(selected) if track.get("spotify_id")]
+            playlist_id = choose_export_target(playlist_data, "spotify")
+            if playlist_id:
+                remove_extras, fix_order = ask_sync_options()
+                with metrics.stage("sync"), Progress() as progress:
+                    task = progress.add_task("[green]Adding missing tracks...", total=None)
+                    summary = sync_spotify_playlist(spotify, playlist_id, track_ids, remove_extras, fix_order, progress, task)
+                record_export("spotify", track_ids, summary)
+                report_failed_items(summary["errors"], "Spotify")
+                report_sync(summary, playlist_data["name"], "Spotify")
+            else:
+                with metrics.stage("create"):
+                    playlist_id = create_spotify_playlist(spotify, playlist_data["name"], creation_datetime)
+                with metrics.stage("add"), Progress() as progress:
+                    task = progress.add_task("[green]Adding tracks...", total=len(track_ids))
+                    errors = add_tracks_to_spotify_playlist(spotify, playlist_id, track_ids, progress=progress, task=task)
+                record_export("spotify", track_ids, {"added": len(track_ids) - len(errors), "errors": errors})
+                report_failed_items(errors, "Spotify")
+                console.print(Panel(f"\n[bold green]Playlist '{playlist_data['name']}' created on Spotify![/bold green]", border_style="green"))
+            library.set_export(selected, "spotify", playlist_id)
             break
         elif key == 'q':
             console.print(Panel("[bold yellow]Cancelled export.[/bold yellow]", border_style="yellow"))
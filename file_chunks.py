@@ -0,0 +1,211 @@
+import os
+import mmap
+import bisect
+import hashlib
+import threading
+
+class Bitmap:
+    def __init__(self, size=0):
+        self.size = size
+        self.bits = bytearray((size + 7) // 8)
+        self.count = 0
+        self.low = 0
+
+    def grow(self, size):
+        if size > self.size:
+            self.bits.extend(bytes((size + 7) // 8 - len(self.bits)))
+            self.size = size
+
+    def __contains__(self, index):
+        return 0 <= index < self.size and bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index):
+        # Returns False when the bit was already set
+        if index >= self.size:
+            self.grow(index + 1)
+        mask = 1 << (index & 7)
+        if self.bits[index >> 3] & mask:
+            return False
+        self.bits[index >> 3] |= mask
+        self.count += 1
+        return True
+
+    def discard(self, index):
+        if index in self:
+            self.bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+            self.count -= 1
+            self.low = min(self.low, index)
+
+    def complete(self):
+        return self.count == self.size
+
+    def first_missing(self, start=0):
+        index = start
+        while index < self.size:
+            byte = self.bits[index >> 3]
+            if byte == 0xFF and index & 7 == 0:
+                index += 8
+                continue
+            if not byte & (1 << (index & 7)):
+                return index
+            index += 1
+        return self.size
+
+    def cumulative(self):
+        # Everything below the returned index is present; the watermark only
+        # moves forward, so repeated calls stay cheap on large files
+        self.low = self.first_missing(self.low)
+        return self.low
+
+class SourceFile:
+    # Read-only memory map of the file being sent, so chunks are sliced
+    # from the page cache instead of a copy of the whole file
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.view = memoryview(self.map) if self.map else memoryview(b"")
+
+    def chunk_count(self, chunk_size):
+        return (self.size + chunk_size - 1) // chunk_size
+
+    def chunk(self, index, chunk_size):
+        return self.view[index * chunk_size:(index + 1) * chunk_size]
+
+    def digest(self):
+        return hashlib.sha256(self.view).digest()
+
+    def close(self):
+        self.view.release()
+        if self.map:
+            self.map.close()
+        self.file.close()
+
+class MemorySource(SourceFile):
+    # A payload built in memory, such as a compressed playlist, sent
+    # through the same interface as a mapped file
+    def __init__(self, data):
+        self.size = len(data)
+        self.view = memoryview(data)
+
+    def close(self):
+        self.view.release()
+
+class BatchSource:
+    # Several payloads in one sequence space. Each payload starts on a
+    # chunk boundary so no chunk spans two files.
+    def __init__(self, payloads):
+        self.payloads = [memoryview(payload) for payload in payloads]
+        self.size = sum(len(payload) for payload in payloads)
+        self.starts = []
+
+    def chunk_count(self, chunk_size):
+        self.starts = []
+        total = 0
+        for payload in self.payloads:
+            self.starts.append(total)
+            total += (len(payload) + chunk_size - 1) // chunk_size
+        return total
+
+    def chunk(self, index, chunk_size):
+        if not self.starts:
+            self.chunk_count(chunk_size)
+        file_index = bisect.bisect_right(self.starts, index) - 1
+        local = index - self.starts[file_index]
+        return self.payloads[file_index][local * chunk_size:(local + 1) * chunk_size]
+
+    def digest(self):
+        digest = hashlib.sha256()
+        for payload in self.payloads:
+            digest.update(payload)
+        return digest.digest()
+
+    def close(self):
+        for payload in self.payloads:
+            payload.release()
+
+class ChunkWriter:
+    # Writes chunks at their offset as they arrive; the file is preallocated
+    # when the sender announced its size, otherwise trimmed on close
+    def __init__(self, path, chunk_size, file_size=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.file_size = file_size
+        self.file = open(path, "wb+")
+        self.lock = threading.Lock()
+        self.end = 0
+        total = (file_size + chunk_size - 1) // chunk_size if file_size is not None else 0
+        self.received = Bitmap(total)
+        if file_size:
+            self.file.truncate(file_size)
+
+    def write(self, index, data):
+        with self.lock:
+            if index in self.received:
+                return False
+            offset = index * self.chunk_size
+            self.file.seek(offset)
+            self.file.write(data)
+            self.received.add(index)
+            self.end = max(self.end, offset + len(data))
+            return True
+
+    def complete(self):
+        return self.file_size is not None and self.received.complete()
+
+    def hash_into(self, digest):
+        with self.lock:
+            self.file.flush()
+            self.file.seek(0)
+            for block in iter(lambda: self.file.read(1 << 20), b""):
+                digest.update(block)
+
+    def digest(self):
+        digest = hashlib.sha256()
+        self.hash_into(digest)
+        return digest.digest()
+
+    def close(self):
+        with self.lock:
+            self.file.truncate(self.file_size if self.file_size is not None else self.end)
+            self.file.close()
+
+class BatchWriter:
+    # Receiving side of BatchSource: one ChunkWriter per file behind a single
+    # bitmap over the shared sequence space
+    def __init__(self, paths, chunk_size, sizes):
+        self.paths = paths
+        self.writers = [ChunkWriter(path, chunk_size, size) for path, size in zip(paths, sizes)]
+        self.starts = []
+        total = 0
+        for writer in self.writers:
+            self.starts.append(total)
+            total += writer.received.size
+        self.lock = threading.Lock()
+        self.received = Bitmap(total)
+
+    def write(self, index, data):
+        file_index = bisect.bisect_right(self.starts, index) - 1
+        if not self.writers[file_index].write(index - self.starts[file_index], data):
+            return False
+        with self.lock:
+            self.received.add(index)
+        return True
+
+    def complete(self):
+        return self.received.complete()
+
+    def digest(self):
+        digest = hashlib.sha256()
+        for writer in self.writers:
+            writer.hash_into(digest)
+        return digest.digest()
+
+    def close(self):
+        # The per-file parts are only staging; the session moves finished
+        # files into place itself
+        for writer in self.writers:
+            writer.close()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,212 @@
+import os
+import base64
+import socket
+import sys
+import struct
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# Wire format v2: a 12-byte header sent in the clear and authenticated as
+# associated data, followed by the AES-GCM ciphertext and 16-byte tag.
+#   magic "MC" | version | packet type | session id (u32) | sequence (u32)
+# Every packet type has its own nonce space (type, session, seq), and each
+# session derives a fresh key from the shared key and the HELLO salt. What a
+# receiver sends back is sealed under a key of its own, derived from the
+# session key and a salt the receiver picks: receivers sharing a fan-out
+# session would otherwise seal different ACKs under the same nonces. So a
+# nonce is never reused with different plaintext.
+MAGIC = b"MC"
+VERSION = 2
+HEADER = struct.Struct("!2sBBII")
+TAG_SIZE = 16
+SALT_SIZE = 16
+SESSION_INFO = b"musiconvert-transfer-v2"
+REPLY_INFO = b"musiconvert-transfer-v2-reply"
+OVERHEAD = HEADER.size + TAG_SIZE
+IP_UDP_OVERHEAD = 28
+DEFAULT_MTU = 1500
+MAX_MTU = 65535
+# Python only exposes IP_MTU on some builds; 14 is its value in Linux's
+# <linux/in.h> and means something else, or nothing, on other platforms
+IP_MTU = getattr(socket, "IP_MTU", 14 if sys.platform.startswith("linux") else None)
+# The smallest MTU every IPv4 host must accept, and the largest UDP payload
+MIN_CHUNK_SIZE = 576 - IP_UDP_OVERHEAD - OVERHEAD
+MAX_CHUNK_SIZE = MAX_MTU - IP_UDP_OVERHEAD - OVERHEAD
+
+HELLO = 1
+HELLO_ACK = 2
+DATA = 3
+ACK = 4
+END = 5
+END_ACK = 6
+NACK = 7
+MANIFEST = 8
+WANT = 9
+
+HELLO_BODY = struct.Struct("!IQB")  # chunk size, file size, flags
+FLAG_BATCH = 1
+MANIFEST_PART = struct.Struct("!H")  # total number of manifest parts
+SACK_BASE = struct.Struct("!I")
+SACK_BYTES = 1024
+NACK_LIMIT = 256
+
+class FramingError(Exception):
+    pass
+
+def is_v2(packet):
+    return len(packet) >= OVERHEAD and packet[:2] == MAGIC and packet[2] == VERSION
+
+def chunk_size_for_mtu(mtu=DEFAULT_MTU):
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, mtu - IP_UDP_OVERHEAD - OVERHEAD))
+
+def path_mtu(address, port):
+    # Linux reports the kernel's path MTU estimate on a connected socket;
+    # elsewhere (macOS, Windows) there is no such option, so assume Ethernet
+    if IP_MTU is None:
+        return DEFAULT_MTU
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect((address, port))
+        return min(probe.getsockopt(socket.IPPROTO_IP, IP_MTU), MAX_MTU)
+    except OSError:
+        return DEFAULT_MTU
+    finally:
+        probe.close()
+
+def master_key(fernet_key):
+    return base64.urlsafe_b64decode(fernet_key)
+
+def new_salt():
+    return os.urandom(SALT_SIZE)
+
+def new_session_id():
+    return struct.unpack("!I", os.urandom(4))[0]
+
+def parse_header(packet):
+    magic, version, ptype, session_id, seq = HEADER.unpack_from(packet)
+    return ptype, session_id, seq
+
+class Framer:
+    def __init__(self, key, salt, session_id, info=SESSION_INFO):
+        self.key = HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=salt, info=info
+        ).derive(key)
+        self.aead = AESGCM(self.key)
+        self.salt = salt
+        self.session_id = session_id
+
+    def reply_framer(self, salt):
+        # Seals and opens what one receiver sends back in this session
+        return Framer(self.key, salt, self.session_id, REPLY_INFO)
+
+    def nonce(self, ptype, seq):
+        return struct.pack("!B3xII", ptype, self.session_id, seq)
+
+    def packet_buffer(self, payload_size):
+        return bytearray(HEADER.size + payload_size + TAG_SIZE)
+
+    def seal_into(self, buffer, ptype, seq, payload):
+        # Encrypts straight from a memoryview of the source into a reusable
+        # buffer; the extra TAG_SIZE bytes cover update_into's block slack
+        view = memoryview(buffer)
+        HEADER.pack_into(view, 0, MAGIC, VERSION, ptype, self.session_id, seq)
+        encryptor = Cipher(algorithms.AES(self.key), modes.GCM(self.nonce(ptype, seq))).encryptor()
+        encryptor.authenticate_additional_data(view[:HEADER.size])
+        written = encryptor.update_into(payload, view[HEADER.size:])
+        encryptor.finalize()
+        end = HEADER.size + written
+        view[end:end + TAG_SIZE] = encryptor.tag
+        return view[:end + TAG_SIZE]
+
+    def seal(self, ptype, seq, payload=b""):
+        return bytes(self.seal_into(self.packet_buffer(len(payload)), ptype, seq, payload))
+
+    def open(self, packet):
+        if not is_v2(packet):
+            raise FramingError("not a v2 packet")
+        ptype, session_id, seq = parse_header(packet)
+        if session_id != self.session_id:
+            raise FramingError(f"packet for session {session_id}")
+        try:
+            payload = self.aead.decrypt(self.nonce(ptype, seq), packet[HEADER.size:], packet[:HEADER.size])
+        except Exception as e:
+            raise FramingError(f"authentication failed for packet {seq}") from e
+        return ptype, seq, payload
+
+def encode_sack(received):
+    # Cumulative base, then the receive bitmap from the byte holding the base
+    # onwards, so the sender can read off every chunk received out of order
+    base = received.cumulative()
+    start = base >> 3
+    bits = bytes(received.bits[start:start + SACK_BYTES]).rstrip(b"\x00")
+    return SACK_BASE.pack(base) + bits
+
+def decode_sack(payload):
+    base = SACK_BASE.unpack_from(payload)[0]
+    return base, (base >> 3) << 3, payload[SACK_BASE.size:]
+
+def sack_contains(sack, seq):
+    base, start, bits = sack
+    if seq < base:
+        return True
+    offset = seq - start
+    return offset < len(bits) * 8 and bool(bits[offset >> 3] & (1 << (offset & 7)))
+
+def encode_nack(holes):
+    return struct.pack(f"!{len(holes)}I", *holes)
+
+def decode_nack(payload):
+    return struct.unpack(f"!{len(payload) // 4}I", payload[:len(payload) // 4 * 4])
+
+def hello_packet(key, salt, session_id, chunk_size, file_size, offers=b"", flags=0):
+    # The salt travels in the clear after the header so the receiver can
+    # derive the session key; it is covered by the tag as associated data.
+    # Compression offers, if any, follow the fixed part of the body.
+    framer = Framer(key, salt, session_id)
+    header = HEADER.pack(MAGIC, VERSION, HELLO, session_id, 0)
+    body = framer.aead.encrypt(framer.nonce(HELLO, 0), HELLO_BODY.pack(chunk_size, file_size, flags) + offers, header + salt)
+    return framer, header + salt + body
+
+def open_hello(key, packet):
+    if not is_v2(packet) or len(packet) < OVERHEAD + SALT_SIZE:
+        raise FramingError("malformed HELLO")
+    ptype, session_id, seq = parse_header(packet)
+    if ptype != HELLO:
+        raise FramingError("expected HELLO")
+    salt = packet[HEADER.size:HEADER.size + SALT_SIZE]
+    framer = Framer(key, salt, session_id)
+    try:
+        body = framer.aead.decrypt(
+            framer.nonce(HELLO, 0), packet[HEADER.size + SALT_SIZE:], packet[:HEADER.size + SALT_SIZE]
+        )
+    except Exception as e:
+        raise FramingError("HELLO failed authentication") from e
+    if len(body) < HELLO_BODY.size:
+        raise FramingError("malformed HELLO")
+    chunk_size, file_size, flags = HELLO_BODY.unpack_from(body)
+    return framer, chunk_size, file_size, flags, body[HELLO_BODY.size:]
+
+def hello_ack_packet(reply_framer, codec):
+    # Carries the receiver's reply salt in the clear, as HELLO carries the
+    # session salt, and is sealed under the reply key it derives
+    header = HEADER.pack(MAGIC, VERSION, HELLO_ACK, reply_framer.session_id, 0)
+    body = reply_framer.aead.encrypt(reply_framer.nonce(HELLO_ACK, 0), bytes([codec]), header + reply_framer.salt)
+    return header + reply_framer.salt + body
+
+def open_hello_ack(framer, packet):
+    # Returns the receiver's reply framer and the codec it picked
+    if not is_v2(packet) or len(packet) < OVERHEAD + SALT_SIZE:
+        raise FramingError("malformed HELLO_ACK")
+    ptype, session_id, seq = parse_header(packet)
+    if ptype != HELLO_ACK or session_id != framer.session_id:
+        raise FramingError("expected HELLO_ACK")
+    reply_framer = framer.reply_framer(packet[HEADER.size:HEADER.size + SALT_SIZE])
+    try:
+        body = reply_framer.aead.decrypt(
+            reply_framer.nonce(HELLO_ACK, 0), packet[HEADER.size + SALT_SIZE:], packet[:HEADER.size + SALT_SIZE]
+        )
+    except Exception as e:
+        raise FramingError("HELLO_ACK failed authentication") from e
+    return reply_framer, body[0] if body else None
@@ -1,8 +1,6 @@
 import os
-import json
-import certifi
-import requests
-import spotipy
+import itertools
+import threading
 from dotenv import load_dotenv
 from rich import print
 from rich.console import Console
@@ -11,7 +9,13 @@ from rich.progress import Progress
 from rich.panel import Panel
 from rich.table import Table
 from spotipy.oauth2 import SpotifyOAuth
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from resolver import QuotaExceeded, RateLimited, limited, parse_retry_after, resolve_stream
+from match_cache import MatchCache, cache_keys, spotify_track_id, youtube_video_id
+from transport import execute, get, spotify_client, youtube_client
+from journal import ImportJournal, resolve_journaled
+from library import choose_playlists, open_library
+import metrics
 
 # Load credentials from .env
 load_dotenv("credentials.env")
@@ -21,158 +25,438 @@ REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI")
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 
 console = Console()
+match_cache = None
+library = None
+# Off for batch runs, where several imports share one terminal
+show_progress = True
 
 SCOPE = "playlist-read-private"
+SPOTIFY_PAGE_SIZE = 100
+PAGE_PREFETCH = 2
+SPOTIFY_ITEM_FIELDS = "track(id,name,artists(name),album(name),external_ids(isrc))"
 
-try:
-    os.environ['PYTHONHTTPSVERIFY'] = '1'
-    sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=REDIRECT_URI,
-        scope=SCOPE
-    ))
-    console.print(Panel("[bold green]Spotify authentication successful[/bold green]", border_style="green"))
-except Exception as e:
-    console.print(Panel(f"[bold red]Spotify authentication failed:[/bold red] {e}", border_style="red"))
-    exit()
+ODESLI_API_URL = os.getenv("ODESLI_API_URL", "https://api.song.link/v1-alpha.1/links")
+
+sp = None
+
+def authenticate_spotify():
+    # Signs in once per process; the menu reuses the client for later imports
+    global sp
+    if sp is not None:
+        return True
+    try:
+        os.environ['PYTHONHTTPSVERIFY'] = '1'
+        sp = spotify_client(SpotifyOAuth(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            redirect_uri=REDIRECT_URI,
+            scope=SCOPE
+        ))
+        console.print(Panel("[bold green]Spotify authentication successful[/bold green]", border_style="green"))
+        return True
+    except Exception as e:
+        console.print(Panel(f"[bold red]Spotify authentication failed:[/bold red] {e}", border_style="red"))
+        return False
+
+def execute_youtube(request):
+    try:
+        return execute(request)
+    except HttpError as e:
+        if e.resp.status == 403 and b"quotaExceeded" in (e.content or b""):
+            raise QuotaExceeded("youtube daily quota used up")
+        raise
 
 def search_youtube(song_name, artist):
     try:
-        youtube = build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
+        youtube = youtube_client(YOUTUBE_API_KEY)
         query = f"{song_name} {artist} audio"
-        search_response = youtube.search().list(
+        search_response = execute_youtube(youtube.search().list(
             q=query, part="snippet", maxResults=1, type="video"
-        ).execute()
+        ))
         if search_response.get("items"):
             video_id = search_response["items"][0]["id"].get("videoId")
             return f"https://music.youtube.com/watch?v={video_id}" if video_id else None
         return None
+    except (RateLimited, QuotaExceeded):
+        raise
     except Exception as e:
         console.print(Panel(f"[red]YouTube search error:[/red] {e}", border_style="red"))
         return None
 
 def get_matching_song(youtube_url):
     try:
-        api_url = "https://api.song.link/v1-alpha.1/links"
         params = {"url": youtube_url, "userCountry": "US"}
-        response = requests.get(api_url, params=params, verify=certifi.where())
+        response = get(ODESLI_API_URL, provider="odesli", params=params)
         if response.status_code == 200:
-            data = response.json()
-            return {"spotify_id": data.get("linksByPlatform", {}).get("spotify", {}).get("url")}
+            links = response.json().get("linksByPlatform", {})
+            return {
+                "spotify_id": links.get("spotify", {}).get("url"),
+                "youtube_music_id": links.get("youtubeMusic", {}).get("url")
+            }
+        if response.status_code == 429:
+            raise RateLimited("odesli", parse_retry_after(response.headers.get("Retry-After")))
         console.print(Panel(f"[yellow]Odesli API error:[/yellow] Status code {response.status_code}", border_style="yellow"))
-        return {"spotify_id": None}
+        return None
+    except RateLimited:
+        raise
     except Exception as e:
         console.print(Panel(f"[red]Error fetching cross-platform links:[/red] {e}", border_style="red"))
-        return {"spotify_id": None}
+        return None
 
-def get_spotify_playlist(playlist_id):
+def match_or_none(provider, fn, *args):
     try:
-        playlist = sp.playlist(playlist_id)
-        playlist_name = playlist.get("name", "Unnamed Playlist")
-        tracks = []
-        results = sp.playlist_items(playlist_id, limit=50)
-        while results:
-            if "items" not in results:
-                break
-            tracks.extend(results["items"])
-            results = sp.next(results) if results.get("next") else None
-
-        playlist_data = {"name": playlist_name, "tracks": []}
-        with Progress() as progress:
-            task = progress.add_task("[green]Processing tracks...", total=len(tracks))
-            for item in tracks:
-                track = item.get("track")
-                if not track:
-                    progress.advance(task)
-                    continue
-                track_id = track.get("id")
-                spotify_url = f"https://open.spotify.com/track/{track_id}" if track_id else None
-                matched_links = get_matching_song(spotify_url) if spotify_url else {"youtube_music_id": None}
-                youtube_music_id = matched_links.get("youtube_music_id") or search_youtube(
-                    track.get("name", ""), track.get("artists", [{}])[0].get("name", "")
-                )
-                playlist_data["tracks"].append({
-                    "name": track.get("name", "Unknown"),
-                    "artist": track.get("artists", [{}])[0].get("name", "Unknown"),
-                    "album": track.get("album", {}).get("name", "Unknown"),
-                    "spotify_id": spotify_url,
-                    "youtube_music_id": youtube_music_id
-                })
-                progress.advance(task)
-        return playlist_data
+        return limited(provider, fn, *args)
+    except RateLimited as e:
+        console.print(Panel(f"[yellow]Giving up after repeated rate limiting:[/yellow] {e}", border_style="yellow"))
+        return None
+
+class MatchCounts:
+    # Local match outcomes of one import; its resolve workers share it
+    def __init__(self):
+        self.matched = 0
+        self.unmatched = 0
+        self.lock = threading.Lock()
+
+    def add(self, link):
+        with self.lock:
+            if link:
+                self.matched += 1
+            else:
+                self.unmatched += 1
+
+def local_match(want, isrc=None, name=None, artist=None, counts=None):
+    # Saved playlists often hold the same recording under another name;
+    # only a confident match here saves the remote search
+    if library is None:
+        return None
+    link = library.match(want, isrc, name, artist)
+    if counts is not None:
+        counts.add(link)
+    return link
+
+def resolve_spotify_track(item, counts=None):
+    track = item.get("track")
+    if not track:
+        return None
+    track_id = track.get("id")
+    spotify_url = f"https://open.spotify.com/track/{track_id}" if track_id else None
+    isrc = track.get("external_ids", {}).get("isrc")
+    name = track.get("name", "Unknown")
+    artist = track.get("artists", [{}])[0].get("name", "Unknown")
+    keys = cache_keys(spotify_id=track_id, isrc=isrc)
+    cached = match_cache.lookup(keys) if keys else None
+    if cached is not None:
+        # A cached miss only speaks for Odesli; the library may have it since
+        youtube_music_id = cached["youtube_music_id"] or local_match("youtube_music_id", isrc, name, artist, counts)
+    else:
+        matched_links = match_or_none("odesli", get_matching_song, spotify_url) if spotify_url else None
+        youtube_music_id = (
+            (matched_links or {}).get("youtube_music_id")
+            or local_match("youtube_music_id", isrc, name, artist, counts)
+            or match_or_none("youtube", search_youtube, track.get("name", ""), track.get("artists", [{}])[0].get("name", ""))
+        )
+        # A link is kept whoever found it, a search costing 100 quota units;
+        # a miss only when Odesli answered, not when it failed
+        if keys and (youtube_music_id or matched_links is not None):
+            match_cache.store(
+                keys + cache_keys(youtube_id=youtube_video_id(youtube_music_id)),
+                {"spotify_id": spotify_url, "youtube_music_id": youtube_music_id}
+            )
+    resolved = {
+        "name": name,
+        "artist": artist,
+        "album": track.get("album", {}).get("name", "Unknown"),
+        "spotify_id": spotify_url,
+        "youtube_music_id": youtube_music_id
+    }
+    if isrc:
+        # Kept so later imports can match this recording by ISRC
+        resolved["isrc"] = isrc
+    return resolved
+
+def resolve_youtube_item(item, counts=None):
+    snippet = item["snippet"]
+    video_id = snippet["resourceId"]["videoId"]
+    youtube_url = f"https://music.youtube.com/watch?v={video_id}"
+    keys = cache_keys(youtube_id=video_id)
+    cached = match_cache.lookup(keys)
+    if cached is not None:
+        spotify_id = cached["spotify_id"] or local_match(
+            "spotify_id", name=snippet["title"], artist=snippet.get("videoOwnerChannelTitle"), counts=counts
+        )
+    else:
+        matched_links = match_or_none("odesli", get_matching_song, youtube_url)
+        spotify_id = (matched_links or {}).get("spotify_id") or local_match(
+            "spotify_id", name=snippet["title"], artist=snippet.get("videoOwnerChannelTitle"), counts=counts
+        )
+        if spotify_id or matched_links is not None:
+            match_cache.store(
+                keys + cache_keys(spotify_id=spotify_track_id(spotify_id)),
+                {"spotify_id": spotify_id, "youtube_music_id": youtube_url}
+            )
+    return {
+        "name": snippet["title"],
+        "artist": snippet.get("videoOwnerChannelTitle", "Unknown"),
+        "album": "Unknown",
+        "spotify_id": spotify_id,
+        "youtube_music_id": youtube_url
+    }
+
+def parse_playlist_url(playlist_url):
+    # (platform, playlist ID), or (None, None) for an unknown URL
+    if "spotify" in playlist_url:
+        return "spotify", playlist_url.split("playlist/")[-1].split("?")[0]
+    if "youtube" in playlist_url or "list=" in playlist_url:
+        return "youtube", playlist_url.split("list=")[-1].split("&")[0]
+    return None, None
+
+def report_resume(journal):
+    resumed = len(journal.load())
+    if resumed:
+        console.print(Panel(f"[yellow]Resuming import: {resumed} tracks found in the journal[/yellow]", border_style="yellow"))
+
+def report_sync(previous, known, seen):
+    added = len(seen - known.keys())
+    console.print(Panel(
+        f"[cyan]Updated '{previous['name']}':[/cyan] {added} new, {len(known.keys() - seen)} removed, "
+        f"{len(seen) - added} unchanged",
+        border_style="cyan"
+    ))
+
+def store_stream(items, resolve, source_id, journal, known, progress, task, counts=None):
+    # Items are resolved as they are fetched and stored as they are
+    # resolved, so only the resolver's window is held at once. Tracks the
+    # saved playlist already has are read back from the library instead.
+    seen = set()
+
+    def resolve_known(item):
+        track_id = known.get(source_id(item))
+        found = library.tracks_by_id([track_id]) if track_id else []
+        return found[0] if found else resolve(item, counts)
+
+    def fetched():
+        for item in items:
+            if source_id(item):
+                seen.add(source_id(item))
+            yield item
+
+    resolved = resolve_journaled(fetched(), resolve_known, source_id, journal, progress, task)
+    return library.add_tracks(track for track in resolved if track), seen
+
+def spotify_items(playlist_id, first_page):
+    # Later pages are fetched a few ahead of the tracks being resolved
+    items = first_page.get("items", [])
+    yield from items
+    offsets = range(len(items), first_page.get("total", 0), SPOTIFY_PAGE_SIZE) if items else []
+    pages = resolve_stream(offsets, lambda offset: limited(
+        "spotify", sp.playlist_items, playlist_id,
+        fields=f"items({SPOTIFY_ITEM_FIELDS})", limit=SPOTIFY_PAGE_SIZE, offset=offset
+    ), max_workers=PAGE_PREFETCH, window=PAGE_PREFETCH)
+    for page in pages:
+        yield from page.get("items", [])
+
+def youtube_pages(youtube, playlist_id):
+    next_page_token = None
+    while True:
+        response = limited("youtube", execute_youtube, youtube.playlistItems().list(
+            part="snippet", playlistId=playlist_id, maxResults=50, pageToken=next_page_token
+        ))
+        yield response
+        next_page_token = response.get("nextPageToken")
+        if not next_page_token:
+            return
+
+def youtube_items(pages, etags):
+    for page in pages:
+        etags.append(page.get("etag"))
+        yield from page.get("items", [])
+
+def read_unchanged_pages(pages, etags):
+    # Reads pages while each ETag matches the saved one. The ETag of a
+    # playlistItems.list page covers the items on it and their positions, so
+    # unlike the playlist's own ETag it changes when a video is swapped or
+    # moved. Returns the pages read, and whether the list is unchanged.
+    read = []
+    for page in pages:
+        read.append(page)
+        if len(read) > len(etags) or not page.get("etag") or page["etag"] != etags[len(read) - 1]:
+            return read, False
+    return read, len(read) == len(etags)
+
+def fetch_spotify_playlist(playlist_id, journal, previous=None, known=None, counts=None):
+    # Returns the playlist's keys and its stored track rows, or the previous
+    # playlist unchanged when it is up to date. known maps the previous
+    # version's source IDs to its track rows; counts, a MatchCounts, adds
+    # up how often the library stood in for a remote search.
+    if previous:
+        snapshot = limited("spotify", sp.playlist, playlist_id, fields="snapshot_id")
+        if snapshot.get("snapshot_id") == previous["source"].get("snapshot_id"):
+            return previous, None
+    # The playlist object embeds the first page, so name, total and the
+    # first SPOTIFY_PAGE_SIZE items arrive in a single round trip
+    with metrics.stage("fetch"):
+        playlist = limited(
+            "spotify", sp.playlist, playlist_id,
+            fields=f"name,snapshot_id,tracks(total,items({SPOTIFY_ITEM_FIELDS}))"
+        )
+    first_page = playlist.get("tracks", {})
+    playlist_data = {
+        "name": playlist.get("name", "Unnamed Playlist"),
+        "source": {"platform": "spotify", "playlist_id": playlist_id, "snapshot_id": playlist.get("snapshot_id")},
+        "tracks": None
+    }
+    source_id = lambda item: (item.get("track") or {}).get("id")
+    known = known or {}
+    with metrics.stage("resolve"), Progress(disable=not show_progress) as progress:
+        task = progress.add_task("[green]Processing tracks...", total=first_page.get("total"))
+        track_ids, seen = store_stream(
+            spotify_items(playlist_id, first_page), resolve_spotify_track, source_id, journal, known, progress, task, counts
+        )
+    if previous:
+        report_sync(previous, known, seen)
+    return playlist_data, track_ids
+
+def get_spotify_playlist(playlist_id, journal, previous=None, known=None, counts=None):
+    try:
+        return fetch_spotify_playlist(playlist_id, journal, previous, known, counts)
     except Exception as e:
         console.print(Panel(f"[red]Error fetching Spotify playlist data:[/red] {e}", border_style="red"))
-        return None
+        return None, None
 
-def get_youtube_playlist(playlist_id):
+def fetch_youtube_playlist(playlist_id, journal, previous=None, known=None, counts=None):
+    youtube = youtube_client(YOUTUBE_API_KEY)
+    with metrics.stage("fetch"):
+        found = limited("youtube", execute_youtube, youtube.playlists().list(
+            part="snippet,contentDetails", id=playlist_id
+        )).get("items", [])
+        if not found:
+            raise LookupError(f"playlist {playlist_id} was not found; it may have been deleted or made private")
+        details = found[0]
+        pages = youtube_pages(youtube, playlist_id)
+        read = []
+        # The playlist's ETag catches a new title; its item pages catch the rest
+        if previous and previous["source"].get("item_etags") and details.get("etag") == previous["source"].get("etag"):
+            read, unchanged = read_unchanged_pages(pages, previous["source"]["item_etags"])
+            if unchanged:
+                return previous, None
+    etags = []
+    playlist_data = {
+        "name": details.get("snippet", {}).get("title", "YouTube Playlist"),
+        "source": {"platform": "youtube", "playlist_id": playlist_id, "etag": details.get("etag"), "item_etags": etags},
+        "tracks": None
+    }
+    source_id = lambda item: item["snippet"]["resourceId"]["videoId"]
+    known = known or {}
+    with metrics.stage("resolve"), Progress(disable=not show_progress) as progress:
+        task = progress.add_task("[cyan]Fetching YouTube tracks...", total=details.get("contentDetails", {}).get("itemCount"))
+        track_ids, seen = store_stream(
+            youtube_items(itertools.chain(read, pages), etags), resolve_youtube_item, source_id, journal, known, progress, task, counts
+        )
+    if previous:
+        report_sync(previous, known, seen)
+    return playlist_data, track_ids
+
+def get_youtube_playlist(playlist_id, journal, previous=None, known=None, counts=None):
     try:
-        youtube = build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
-        playlist_data = {"name": "YouTube Playlist", "tracks": []}
-        next_page_token = None
-        with Progress() as progress:
-            task = progress.add_task("[cyan]Fetching YouTube tracks...", total=50)
-            while True:
-                response = youtube.playlistItems().list(
-                    part="snippet", playlistId=playlist_id, maxResults=50, pageToken=next_page_token
-                ).execute()
-                for item in response.get("items", []):
-                    snippet = item["snippet"]
-                    title = snippet["title"]
-                    artist = snippet.get("videoOwnerChannelTitle", "Unknown")
-                    youtube_url = f"https://music.youtube.com/watch?v={snippet['resourceId']['videoId']}"
-                    matched_links = get_matching_song(youtube_url)
-                    playlist_data["tracks"].append({
-                        "name": title,
-                        "artist": artist,
-                        "album": "Unknown",
-                        "spotify_id": matched_links.get("spotify_id"),
-                        "youtube_music_id": youtube_url
-                    })
-                    progress.advance(task)
-                next_page_token = response.get("nextPageToken")
-                if not next_page_token:
-                    break
-        return playlist_data
+        return fetch_youtube_playlist(playlist_id, journal, previous, known, counts)
     except Exception as e:
         console.print(Panel(f"[red]Error fetching YouTube playlist data:[/red] {e}", border_style="red"))
-        return None
+        return None, None
 
-console.print(Panel("[bold magenta]MusiConvert - Import Playlist[/bold magenta]", border_style="cyan"))
-playlist_url = Prompt.ask("[bold green]Enter Playlist URL or ID[/bold green]").strip()
-
-if "spotify" in playlist_url:
-    playlist_id = playlist_url.split("playlist/")[-1].split("?")[0]
-    playlist_info = get_spotify_playlist(playlist_id)
-elif "youtube" in playlist_url or "list=" in playlist_url:
-    playlist_id = playlist_url.split("list=")[-1].split("&")[0]
-    playlist_info = get_youtube_playlist(playlist_id)
-else:
-    console.print(Panel("[red]Invalid playlist URL. Must be from Spotify or YouTube Music.[/red]", border_style="red"))
-    exit()
-
-if playlist_info:
-    table = Table(title=f"Playlist: {playlist_info['name']}", header_style="bold magenta")
-    table.add_column("Track", style="cyan", no_wrap=True)
-    table.add_column("Artist", style="green")
-    table.add_column("Album", style="yellow")
-    for track in playlist_info["tracks"][:10]:
-        table.add_row(track["name"], track["artist"], track["album"])
-    if len(playlist_info["tracks"]) > 10:
-        table.add_row(f"...and {len(playlist_info['tracks']) - 10} more", "", "")
-    console.print(table)
-    console.print(Panel("[green]Playlist fetched successfully![/green]", border_style="green"))
-
-    save_dir = "playlists"
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
-    save_name = Prompt.ask("[bold magenta]Enter a name for the playlist file (without .json)[/bold magenta]").strip()
-    save_path = os.path.join(save_dir, save_name + ".json")
+def main():
+    metrics.start("import")
     try:
-        with open(save_path, "w", encoding="utf-8") as file:
-            json.dump(playlist_info, file, indent=4)
-        console.print(Panel(f"[bold green]Playlist data saved at:[/bold green] {save_path}", border_style="green"))
-    except Exception as e:
-        console.print(Panel(f"[red]Error saving playlist file:[/red] {e}", border_style="red"))
-else:
-    console.print(Panel("[red]Failed to fetch playlist data.[/red]", border_style="red"))
+        import_playlist()
+    finally:
+        metrics_path = metrics.finish()
+        if metrics_path:
+            console.print(f"[dim]Run metrics written to {metrics_path}[/dim]")
+
+def import_playlist():
+    global match_cache, library
+    if not authenticate_spotify():
+        return
+    if match_cache is None:
+        match_cache = MatchCache()
+    library = open_library()
+    counts = MatchCounts()
+    console.print(Panel("[bold magenta]MusiConvert - Import Playlist[/bold magenta]", border_style="cyan"))
+    mode = Prompt.ask("[bold green]Import a new playlist or update a saved one?[/bold green]", choices=["new", "update"], default="new")
+
+    previous = None
+    known = None
+    save_name = None
+    if mode == "update":
+        save_name = choose_playlists(library)
+        if not save_name:
+            return
+        previous = library.meta(save_name)
+        if "source" not in previous:
+            console.print(Panel("[red]This playlist was saved without its source playlist ID. Import it again as a new playlist.[/red]", border_style="red"))
+            return
+        platform, playlist_id = previous["source"]["platform"], previous["source"]["playlist_id"]
+        known = library.playlist_links(save_name, "spotify_id" if platform == "spotify" else "youtube_music_id")
+    else:
+        playlist_url = Prompt.ask("[bold green]Enter Playlist URL or ID[/bold green]").strip()
+        platform, playlist_id = parse_playlist_url(playlist_url)
+        if platform is None:
+            console.print(Panel("[red]Invalid playlist URL. Must be from Spotify or YouTube Music.[/red]", border_style="red"))
+            return
+
+    journal = ImportJournal(platform, playlist_id)
+    report_resume(journal)
+    metrics.record("playlist", {"platform": platform, "playlist_id": playlist_id, "mode": mode})
+    if platform == "spotify":
+        playlist_info, track_ids = get_spotify_playlist(playlist_id, journal, previous, known, counts)
+    else:
+        playlist_info, track_ids = get_youtube_playlist(playlist_id, journal, previous, known, counts)
+
+    saving = False
+    try:
+        if playlist_info is not None and playlist_info is previous:
+            journal.discard()
+            console.print(Panel(f"[bold green]'{previous['name']}' is already up to date.[/bold green]", border_style="green"))
+        elif playlist_info:
+            if previous and "exports" in previous:
+                playlist_info["exports"] = previous["exports"]
+            table = Table(title=f"Playlist: {playlist_info['name']}", header_style="bold magenta")
+            table.add_column("Track", style="cyan", no_wrap=True)
+            table.add_column("Artist", style="green")
+            table.add_column("Album", style="yellow")
+            for track in library.tracks_by_id(track_ids[:10]):
+                table.add_row(track["name"], track["artist"], track["album"])
+            if len(track_ids) > 10:
+                table.add_row(f"...and {len(track_ids) - 10} more", "", "")
+            console.print(table)
+            console.print(Panel("[green]Playlist fetched successfully![/green]", border_style="green"))
+            cache_stats = match_cache.stats()
+            metrics.record("match_cache", cache_stats)
+            metrics.record("local_match", {"matched": counts.matched, "unmatched": counts.unmatched})
+            metrics.count("tracks", len(track_ids))
+            console.print(
+                f"[dim]Match cache: {cache_stats['hits']} hits, {cache_stats['negative_hits']} negative hits, "
+                f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)[/dim]"
+            )
+            if counts.matched or counts.unmatched:
+                console.print(f"[dim]Local matches: {counts.matched} found in saved playlists, {counts.unmatched} not found[/dim]")
+
+            if save_name is None:
+                save_name = Prompt.ask("[bold magenta]Enter a name to save the playlist under[/bold magenta]").strip()
+            try:
+                # From here on save_rows cleans up after itself
+                saving = True
+                with metrics.stage("save"):
+                    library.save_rows(save_name, playlist_info, track_ids)
+                journal.discard()
+                console.print(Panel(f"[bold green]Playlist saved to the library as:[/bold green] {save_name}", border_style="green"))
+            except Exception as e:
+                console.print(Panel(f"[red]Error saving playlist:[/red] {e}", border_style="red"))
+        else:
+            console.print(Panel("[red]Failed to fetch playlist data.[/red]", border_style="red"))
+    finally:
+        if track_ids and not saving:
+            # Cancelled or failed before saving: the stored tracks go again
+            library.discard(track_ids)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import json
+import threading
+from resolver import resolve_stream
+
+JOURNAL_DIR = os.path.join("playlists", ".journal")
+
+def is_complete(track):
+    # Tracks with a missing link are re-resolved on resume: the match cache
+    # answers genuine misses cheaply, while lookups that failed get retried
+    return track is None or bool(track.get("spotify_id") and track.get("youtube_music_id"))
+
+class ImportJournal:
+    def __init__(self, source, playlist_id, directory=JOURNAL_DIR):
+        self.path = os.path.join(directory, f"{source}-{playlist_id}.ndjson")
+        self.lock = threading.Lock()
+        self.file = None
+        # Batch runs create journals from several threads at once
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half written
+                    continue
+                entries[entry["index"]] = entry
+        return entries
+
+    def record(self, index, source_id, track):
+        line = json.dumps({"index": index, "source_id": source_id, "track": track})
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def resolve_journaled(items, resolve, source_id, journal, progress=None, task=None):
+    # Yields the resolved tracks in order as items (any iterable) come in;
+    # tracks the journal already holds from an interrupted run are passed
+    # through without resolving them again
+    done = journal.load()
+
+    def entries():
+        for index, item in enumerate(items):
+            entry = done.pop(index, None)
+            if entry and entry["source_id"] == source_id(item) and is_complete(entry["track"]):
+                yield index, item, entry
+            else:
+                yield index, item, None
+
+    def run(entry):
+        index, item, journaled = entry
+        if journaled is not None:
+            return journaled["track"]
+        track = resolve(item)
+        journal.record(index, source_id(item), track)
+        return track
+
+    try:
+        yield from resolve_stream(entries(), run, progress, task)
+    finally:
+        journal.close()
@@ -0,0 +1,596 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import textwrap
+import argparse
+import datetime
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+from rich.console import Console
+from rich.prompt import Prompt
+from rich.table import Table
+from match_cache import spotify_track_id, youtube_video_id
+from matching import describe, index_tokens, similarity
+
+# Saved playlists live in one SQLite file. A track is stored once however
+# many playlists hold it, indexed by Spotify ID, YouTube ID, ISRC and name,
+# and by title/artist tokens so imports can match against it before
+# searching remotely. A playlist is an ordered list of track rows plus its
+# other top-level keys.
+# Playlists still travel between peers as JSON in the old playlists/ layout,
+# and export to exactly the file they were imported from.
+
+load_dotenv("credentials.env")
+console = Console()
+LIBRARY_FILE = os.getenv("LIBRARY_FILE", "library.db")
+LEGACY_DIR = "playlists"
+PAGE_SIZE = int(os.getenv("LIBRARY_PAGE_SIZE", "20"))
+MATCH_THRESHOLD = float(os.getenv("LOCAL_MATCH_THRESHOLD", "0.9"))
+MATCH_CANDIDATES = 50
+# Tracks per transaction when storing and per query when reading back
+TRACK_CHUNK = 500
+SCHEMA_VERSION = 3
+LINK_COLUMNS = {"spotify_id": "spotify_id", "youtube_music_id": "youtube_id"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    title TEXT,
+    track_count INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS playlists_updated ON playlists (updated_at);
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    fingerprint BLOB NOT NULL UNIQUE,
+    name TEXT,
+    artist TEXT,
+    spotify_id TEXT,
+    youtube_id TEXT,
+    isrc TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_spotify ON tracks (spotify_id);
+CREATE INDEX IF NOT EXISTS tracks_youtube ON tracks (youtube_id);
+CREATE INDEX IF NOT EXISTS tracks_isrc ON tracks (isrc);
+CREATE INDEX IF NOT EXISTS tracks_name ON tracks (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist_id INTEGER NOT NULL REFERENCES playlists (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    track_id INTEGER NOT NULL REFERENCES tracks (id),
+    PRIMARY KEY (playlist_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS playlist_tracks_track ON playlist_tracks (track_id);
+CREATE TABLE IF NOT EXISTS match_tokens (
+    token TEXT NOT NULL,
+    track_id INTEGER NOT NULL REFERENCES tracks (id) ON DELETE CASCADE,
+    PRIMARY KEY (token, track_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS match_tokens_track ON match_tokens (track_id);
+"""
+
+class LibraryError(Exception):
+    pass
+
+def track_row(track):
+    # The track is kept as its own JSON text, so keys the columns below do
+    # not cover survive a round trip; identical text means the same row
+    data = json.dumps(track, ensure_ascii=False, separators=(",", ":"))
+    return (
+        hashlib.sha1(data.encode()).digest(),
+        track.get("name"),
+        track.get("artist"),
+        spotify_track_id(track.get("spotify_id")),
+        youtube_video_id(track.get("youtube_music_id")),
+        (track.get("isrc") or "").upper() or None,
+        data,
+    )
+
+def like_pattern(search):
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+class Library:
+    def __init__(self, path=LIBRARY_FILE):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # The receiver daemon and the menu may have the library open at once
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version < 3 and "content_hash" not in [column[1] for column in self.db.execute("PRAGMA table_info(playlists)")]:
+            self.db.execute("ALTER TABLE playlists ADD COLUMN content_hash TEXT")
+        if version < SCHEMA_VERSION:
+            # Libraries from before the match index get their tracks indexed once
+            self.db.executemany("INSERT OR IGNORE INTO match_tokens VALUES (?, ?)", [
+                (token, track_id)
+                for track_id, name, artist in self.db.execute("SELECT id, name, artist FROM tracks").fetchall()
+                for token in index_tokens(name, artist)
+            ])
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.commit()
+        # Rows add_tracks stored for an import that has not been saved or
+        # discarded yet; prune leaves them alone
+        self.held = Counter()
+
+    def save(self, name, playlist, saved_at=None):
+        if not isinstance(playlist, dict) or not isinstance(playlist.get("tracks"), list):
+            raise LibraryError(f"'{name}' is not a playlist")
+        rows = [track_row(track) for track in playlist["tracks"]]
+        with self.lock, self.db:
+            return self.link(name, playlist, self.row_ids(rows), saved_at or time.time())
+
+    def add_tracks(self, tracks):
+        # Stores tracks from any iterable as they arrive, TRACK_CHUNK per
+        # transaction, and returns their row ids in order for save_rows.
+        # The caller passes them to save_rows or discard; an import that
+        # fails on the way takes its rows back out itself.
+        ids = []
+        rows = []
+        try:
+            for track in tracks:
+                rows.append(track_row(track))
+                if len(rows) == TRACK_CHUNK:
+                    ids.extend(self.hold(rows))
+                    rows = []
+            if rows:
+                ids.extend(self.hold(rows))
+        except BaseException:
+            self.discard(ids)
+            raise
+        return ids
+
+    def hold(self, rows):
+        with self.lock, self.db:
+            ids = self.row_ids(rows)
+            self.held.update(ids)
+        return ids
+
+    def save_rows(self, name, playlist, track_ids, saved_at=None):
+        # Saves a playlist whose tracks were stored with add_tracks; only
+        # its other keys are taken from playlist
+        try:
+            with self.lock, self.db:
+                self.held -= Counter(track_ids)
+                return self.link(name, playlist, track_ids, saved_at or time.time())
+        except sqlite3.IntegrityError:
+            # Another process pruned a stored track before it got a playlist;
+            # the rest are not wanted either
+            with self.lock, self.db:
+                self.prune(track_ids)
+            raise LibraryError(f"tracks of '{name}' were removed before it was saved; import it again")
+
+    def discard(self, track_ids):
+        # Drops the rows of an import that will not be saved, unless a
+        # playlist or another import uses them too
+        with self.lock, self.db:
+            self.held -= Counter(track_ids)
+            self.prune(track_ids)
+
+    def row_ids(self, rows):
+        # Another process may store the same track between our statements,
+        # so an existing fingerprint is looked up rather than inserted twice
+        ids = []
+        for row in rows:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO tracks (fingerprint, name, artist, spotify_id, youtube_id, isrc, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", row
+            )
+            if not cursor.rowcount:
+                ids.append(self.db.execute("SELECT id FROM tracks WHERE fingerprint = ?", (row[0],)).fetchone()[0])
+                continue
+            self.db.executemany(
+                "INSERT INTO match_tokens VALUES (?, ?)", [(token, cursor.lastrowid) for token in index_tokens(row[1], row[2])]
+            )
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def link(self, name, playlist, track_ids, now):
+        # The tracks key is kept as a placeholder so the export puts the
+        # list back in the same place
+        meta = json.dumps(dict(playlist, tracks=None), ensure_ascii=False)
+        existing = self.db.execute("SELECT id FROM playlists WHERE name = ?", (name,)).fetchone()
+        previous = []
+        if existing:
+            playlist_id = existing[0]
+            previous = [track_id for (track_id,) in self.db.execute(
+                "SELECT DISTINCT track_id FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,)
+            )]
+            self.db.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,))
+            self.db.execute(
+                "UPDATE playlists SET title = ?, track_count = ?, meta = ?, updated_at = ?, content_hash = NULL WHERE id = ?",
+                (playlist.get("name"), len(track_ids), meta, now, playlist_id)
+            )
+        else:
+            playlist_id = self.db.execute(
+                "INSERT INTO playlists (name, title, track_count, meta, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, playlist.get("name"), len(track_ids), meta, now, now)
+            ).lastrowid
+        self.db.executemany(
+            "INSERT INTO playlist_tracks VALUES (?, ?, ?)",
+            [(playlist_id, position, track_id) for position, track_id in enumerate(track_ids)]
+        )
+        self.prune(previous)
+        return playlist_id
+
+    def prune(self, track_ids):
+        # Only the rows the replaced or deleted playlist pointed at can have
+        # become unused
+        self.db.executemany(
+            "DELETE FROM tracks WHERE id = ? AND NOT EXISTS (SELECT 1 FROM playlist_tracks WHERE track_id = ?)",
+            [(track_id, track_id) for track_id in set(track_ids) if track_id not in self.held]
+        )
+
+    def load(self, name):
+        playlist = self.meta(name)
+        if playlist is not None:
+            playlist["tracks"] = list(self.tracks(name))
+        return playlist
+
+    def meta(self, name):
+        # The playlist without its tracks; "tracks" is None
+        with self.lock:
+            row = self.db.execute("SELECT meta FROM playlists WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def tracks(self, name):
+        # Yields the playlist's tracks in order, TRACK_CHUNK per query, so a
+        # large playlist is never held whole
+        with self.lock:
+            row = self.db.execute("SELECT id FROM playlists WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return
+        position = -1
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT playlist_tracks.position, tracks.data FROM playlist_tracks "
+                    "JOIN tracks ON tracks.id = playlist_tracks.track_id "
+                    "WHERE playlist_tracks.playlist_id = ? AND playlist_tracks.position > ? "
+                    "ORDER BY playlist_tracks.position LIMIT ?", (row[0], position, TRACK_CHUNK)
+                ).fetchall()
+            for position, data in rows:
+                yield json.loads(data)
+            if len(rows) < TRACK_CHUNK:
+                return
+
+    def find_source(self, platform, playlist_id):
+        # Name of the saved playlist imported from this source, if any
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT name, meta FROM playlists WHERE meta LIKE ? ESCAPE '\\' ORDER BY updated_at DESC",
+                (like_pattern(playlist_id),)
+            ).fetchall()
+        for name, meta in rows:
+            source = json.loads(meta).get("source") or {}
+            if source.get("platform") == platform and source.get("playlist_id") == playlist_id:
+                return name
+        return None
+
+    def tracks_by_id(self, track_ids):
+        track_ids = list(track_ids)
+        with self.lock:
+            found = dict(self.db.execute(
+                f"SELECT id, data FROM tracks WHERE id IN ({', '.join('?' * len(track_ids))})", track_ids
+            ).fetchall()) if track_ids else {}
+        return [json.loads(found[track_id]) for track_id in track_ids if track_id in found]
+
+    def playlist_links(self, name, want):
+        # Maps the playlist's Spotify track or YouTube video IDs to track rows
+        column = LINK_COLUMNS[want]
+        with self.lock:
+            return dict(self.db.execute(
+                f"SELECT tracks.{column}, tracks.id FROM playlists "
+                f"JOIN playlist_tracks ON playlist_tracks.playlist_id = playlists.id "
+                f"JOIN tracks ON tracks.id = playlist_tracks.track_id "
+                f"WHERE playlists.name = ? AND tracks.{column} IS NOT NULL", (name,)
+            ).fetchall())
+
+    def set_export(self, name, platform, playlist_id):
+        # Only the playlist's own keys change, so its tracks are left alone
+        with self.lock, self.db:
+            row = self.db.execute("SELECT meta FROM playlists WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise LibraryError(f"no playlist named '{name}'")
+            meta = json.loads(row[0])
+            meta.setdefault("exports", {})[platform] = playlist_id
+            self.db.execute(
+                "UPDATE playlists SET meta = ?, content_hash = NULL WHERE name = ?", (json.dumps(meta, ensure_ascii=False), name)
+            )
+
+    def delete(self, name):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT id FROM playlists WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return False
+            previous = [track_id for (track_id,) in self.db.execute(
+                "SELECT DISTINCT track_id FROM playlist_tracks WHERE playlist_id = ?", (row[0],)
+            )]
+            self.db.execute("DELETE FROM playlists WHERE id = ?", (row[0],))
+            self.prune(previous)
+        return True
+
+    def count(self, search=""):
+        with self.lock:
+            if not search:
+                return self.db.execute("SELECT COUNT(*) FROM playlists").fetchone()[0]
+            pattern = like_pattern(search)
+            return self.db.execute(
+                "SELECT COUNT(*) FROM playlists WHERE name LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\'", (pattern, pattern)
+            ).fetchone()[0]
+
+    def page(self, search="", offset=0, limit=PAGE_SIZE):
+        # Newest first; each row is (name, title, track count, created, updated)
+        query = "SELECT name, title, track_count, created_at, updated_at FROM playlists"
+        params = []
+        if search:
+            query += " WHERE name LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\'"
+            params = [like_pattern(search)] * 2
+        query += " ORDER BY updated_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self.lock:
+            return self.db.execute(query, params).fetchall()
+
+    def names(self, search=""):
+        return [row[0] for row in self.page(search, limit=None)]
+
+    def match(self, want, isrc=None, name=None, artist=None, threshold=MATCH_THRESHOLD):
+        # Looks through every saved track for the link `want` ("spotify_id"
+        # or "youtube_music_id") of a track known by ISRC or by title and
+        # artist. Returns the link only for an ISRC hit or a match scoring
+        # at least threshold, so a miss can still go to remote search.
+        column = LINK_COLUMNS[want]
+        link = None
+        if isrc:
+            with self.lock:
+                row = self.db.execute(
+                    f"SELECT data FROM tracks WHERE isrc = ? AND {column} IS NOT NULL LIMIT 1", (isrc.upper(),)
+                ).fetchone()
+            if row:
+                link = json.loads(row[0]).get(want)
+        query = describe(name, artist)
+        words = sorted(query[0] | query[1])
+        if link is None and words:
+            with self.lock:
+                candidates = self.db.execute(
+                    f"SELECT tracks.name, tracks.artist, tracks.data FROM tracks JOIN ("
+                    f"SELECT track_id, COUNT(*) AS shared FROM match_tokens WHERE token IN ({', '.join('?' * len(words))}) "
+                    f"GROUP BY track_id) AS hits ON hits.track_id = tracks.id "
+                    f"WHERE tracks.{column} IS NOT NULL ORDER BY hits.shared DESC LIMIT ?", words + [MATCH_CANDIDATES]
+                ).fetchall()
+            best = 0.0
+            for candidate_name, candidate_artist, data in candidates:
+                score = similarity(query, describe(candidate_name, candidate_artist))
+                if score >= threshold and score > best:
+                    best, link = score, json.loads(data).get(want)
+        return link
+
+    def import_file(self, path, name=None, received=False):
+        with open(path, "r", encoding="utf-8") as f:
+            playlist = json.load(f)
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        if received and isinstance(playlist, dict):
+            # A received playlist's export targets are the sender's
+            # playlists; the ones recorded here for the name are kept
+            playlist.pop("exports", None)
+            exports = (self.meta(name) or {}).get("exports")
+            if exports:
+                playlist["exports"] = exports
+        self.save(name, playlist, os.path.getmtime(path))
+        return name
+
+    def free_name(self, name):
+        # name itself, or the first of "name (2)", "name (3)"... not taken
+        candidate, number = name, 1
+        with self.lock:
+            while self.db.execute("SELECT 1 FROM playlists WHERE name = ?", (candidate,)).fetchone():
+                number += 1
+                candidate = f"{name} ({number})"
+        return candidate
+
+    def import_directory(self, directory):
+        # Playlists in subfolders (the receiver daemon keeps one per peer)
+        # are named folder/file; the import journal is skipped
+        imported, failed = [], []
+        for root, folders, files in os.walk(directory):
+            folders[:] = sorted(folder for folder in folders if not folder.startswith("."))
+            for file_name in sorted(files):
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(root, file_name)
+                name = os.path.splitext(os.path.relpath(path, directory))[0].replace(os.sep, "/")
+                try:
+                    imported.append(self.import_file(path, name))
+                except (OSError, ValueError, LibraryError) as e:
+                    failed.append((path, e))
+        return imported, failed
+
+    def export_text(self, name):
+        # Yields the same text as json.dump(playlist, f, indent=4) would
+        # write, with the tracks streamed into the placeholder's place
+        playlist = self.meta(name)
+        if playlist is None:
+            raise LibraryError(f"no playlist named '{name}'")
+        head, tail = json.dumps(playlist, indent=4).split('\n    "tracks": null', 1)
+        yield head + '\n    "tracks": ['
+        separator = "\n"
+        for track in self.tracks(name):
+            yield separator + textwrap.indent(json.dumps(track, indent=4), " " * 8)
+            separator = ",\n"
+        yield "]" if separator == "\n" else "\n    ]"
+        yield tail
+
+    def export_file(self, name, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(self.export_text(name))
+        os.replace(tmp_path, path)
+        return path
+
+    def export_bytes(self, name):
+        return "".join(self.export_text(name)).encode("utf-8")
+
+    def content_hashes(self):
+        # Maps the SHA-256 of each playlist's exported file, as a batch
+        # manifest lists it, to the playlist's name. Hashes are worked out
+        # once and kept until the playlist changes.
+        with self.lock:
+            missing = [name for (name,) in self.db.execute("SELECT name FROM playlists WHERE content_hash IS NULL")]
+        for name in missing:
+            digest = hashlib.sha256()
+            try:
+                for text in self.export_text(name):
+                    digest.update(text.encode("utf-8"))
+            except LibraryError:
+                continue
+            with self.lock, self.db:
+                self.db.execute("UPDATE playlists SET content_hash = ? WHERE name = ?", (digest.hexdigest(), name))
+        with self.lock:
+            return dict(self.db.execute(
+                "SELECT content_hash, name FROM playlists WHERE content_hash IS NOT NULL ORDER BY updated_at"
+            ).fetchall())
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+shared = None
+
+def open_library(path=LIBRARY_FILE):
+    # One connection per process. A library created next to an existing
+    # playlists/ folder starts out with the files in it.
+    global shared
+    if shared is None:
+        fresh = not os.path.exists(path)
+        shared = Library(path)
+        if fresh and os.path.isdir(LEGACY_DIR):
+            imported, failed = shared.import_directory(LEGACY_DIR)
+            if imported:
+                console.print(f"[dim]Imported {len(imported)} playlists from {LEGACY_DIR}/ into the library[/dim]")
+            for file_path, error in failed:
+                console.print(f"[yellow]Skipped {file_path}: {error}[/yellow]")
+    return shared
+
+def show_page(rows, offset, caption):
+    table = Table(title="Available Playlists", caption=caption, show_lines=True)
+    table.add_column("No.", justify="right")
+    table.add_column("Name", style="cyan")
+    table.add_column("Title", style="white")
+    table.add_column("Tracks", justify="right")
+    table.add_column("Time of Creation", style="green")
+    table.add_column("Date of Creation", style="magenta")
+    for index, (name, title, track_count, created_at, _) in enumerate(rows, offset + 1):
+        created = datetime.datetime.fromtimestamp(created_at)
+        table.add_row(str(index), name, title or "", str(track_count), created.strftime("%H:%M:%S"), created.strftime("%Y-%m-%d"))
+    console.print(table)
+
+def choose_playlists(library, multiple=False):
+    # Returns one name, a list of names when multiple is set, or None
+    search = ""
+    page = 0
+    while True:
+        total = library.count(search)
+        if not total and not search:
+            console.print("[red]No saved playlists in the library.[/red]")
+            return None
+        pages = max(1, -(-total // PAGE_SIZE))
+        page = min(page, pages - 1)
+        offset = page * PAGE_SIZE
+        rows = library.page(search, offset, PAGE_SIZE)
+        caption = f"Page {page + 1} of {pages}, {total} playlists"
+        if search:
+            caption += f" matching '{search}'"
+        show_page(rows, offset, caption)
+        if multiple:
+            question = "Enter the numbers of the playlists to send (separated by commas, or 'all')"
+        else:
+            question = "Enter the number of the playlist to select"
+        choice = Prompt.ask(f"{question}; n/p to change page, /text to search, q to cancel").strip()
+        lowered = choice.lower()
+        if lowered == "q":
+            return None
+        if lowered in ("n", "p"):
+            page = max(0, page + (1 if lowered == "n" else -1))
+            continue
+        if choice.startswith("/"):
+            search = choice[1:].strip()
+            page = 0
+            continue
+        if multiple and lowered == "all" and total:
+            return library.names(search)
+        numbers = [part.strip() for part in choice.split(",") if part.strip()]
+        if numbers and (multiple or len(numbers) == 1) and all(
+            n.isdigit() and offset < int(n) <= offset + len(rows) for n in numbers
+        ):
+            names = [rows[int(n) - offset - 1][0] for n in dict.fromkeys(numbers)]
+            return names if multiple else names[0]
+        console.print("[red]Invalid choice. Try again.[/red]")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local playlist library")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="list saved playlists, newest first")
+    listing.add_argument("search", nargs="?", default="", help="only names or titles containing this")
+    importing = commands.add_parser("import", help="add playlist JSON files, or every file in a folder")
+    importing.add_argument("paths", nargs="+")
+    importing.add_argument("--name", help="save a single file under this name instead of its file name")
+    exporting = commands.add_parser("export", help="write a saved playlist as JSON")
+    exporting.add_argument("name")
+    exporting.add_argument("path", nargs="?", help=f"defaults to {LEGACY_DIR}/<name>.json")
+    deleting = commands.add_parser("delete", help="remove a saved playlist")
+    deleting.add_argument("name")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    library = open_library()
+    if args.command == "list":
+        rows = library.page(args.search, limit=None)
+        show_page(rows, 0, f"{len(rows)} playlists")
+    elif args.command == "import":
+        if args.name and (len(args.paths) > 1 or os.path.isdir(args.paths[0])):
+            console.print("[red]--name only applies to a single file.[/red]")
+            return 1
+        failed = []
+        for path in args.paths:
+            if os.path.isdir(path):
+                imported, errors = library.import_directory(path)
+                failed += errors
+                console.print(f"[green]Imported {len(imported)} playlists from {path}[/green]")
+                continue
+            try:
+                console.print(f"[green]Imported {path} as '{library.import_file(path, args.name)}'[/green]")
+            except (OSError, ValueError, LibraryError) as e:
+                failed.append((path, e))
+        for path, error in failed:
+            console.print(f"[yellow]Skipped {path}: {error}[/yellow]")
+        return 1 if failed else 0
+    elif args.command == "export":
+        try:
+            path = library.export_file(args.name, args.path or os.path.join(LEGACY_DIR, args.name + ".json"))
+        except LibraryError as e:
+            console.print(f"[red]{e}[/red]")
+            return 1
+        console.print(f"[green]Exported '{args.name}' to {path}[/green]")
+    elif not library.delete(args.name):
+        console.print(f"[red]No playlist named '{args.name}'.[/red]")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
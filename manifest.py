@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+from functools import partial
+from compression import COMPACT, available, decompress, encode
+
+# A batch manifest lists every file the sender offers; the receiver answers
+# with the indices it still needs and fills in the rest from files it
+# already holds, or playlists in its library, with the same content hash.
+
+class ManifestError(Exception):
+    pass
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def build_manifest(paths, codec):
+    # Returns the manifest entries and the payload to send for each file
+    entries = []
+    payloads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        file_codec, payload = encode(codec, raw)
+        entries.append({
+            "name": os.path.basename(path),
+            "size": len(raw),
+            "sha256": hashlib.sha256(raw).hexdigest(),
+            "codec": file_codec,
+            "encoded": len(payload),
+        })
+        payloads.append(payload)
+    return entries, payloads
+
+def dump_manifest(entries):
+    return json.dumps({"files": entries}, separators=(",", ":")).encode()
+
+def load_manifest(data):
+    try:
+        entries = json.loads(data)["files"]
+        for entry in entries:
+            entry["name"] = safe_name(entry["name"])
+            if entry["codec"] & ~COMPACT and entry["codec"] & ~COMPACT not in available():
+                raise ManifestError(f"{entry['name']} uses a codec this side cannot decode")
+            entry["size"], entry["encoded"] = int(entry["size"]), int(entry["encoded"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ManifestError(f"malformed manifest: {e}") from e
+    return entries
+
+def safe_name(name):
+    # Entries name files inside the receiving directory and nothing else
+    base = os.path.basename(str(name).replace("\\", "/"))
+    if base in ("", ".", "..") or base.startswith("."):
+        raise ManifestError(f"refusing file name {name!r}")
+    return base
+
+def local_hashes(directory):
+    held = {}
+    if not os.path.isdir(directory):
+        return held
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(".json") and os.path.isfile(path):
+            held.setdefault(file_hash(path), path)
+    return held
+
+def plan_receive(entries, directory, library=None):
+    # Returns the indices to transfer and the copies that fill in the rest:
+    # local copies come from files already here or are exported from the
+    # library, batch copies from a duplicate earlier in the same batch once
+    # it has arrived
+    held = local_hashes(directory)
+    if library is not None:
+        for digest, name in library.content_hashes().items():
+            held.setdefault(digest, partial(library.export_bytes, name))
+    wanted = []
+    local_copies = []
+    batch_copies = []
+    first = {}
+    for index, entry in enumerate(entries):
+        target = os.path.join(directory, entry["name"])
+        digest = entry["sha256"]
+        if digest in held:
+            if callable(held[digest]) or os.path.abspath(held[digest]) != os.path.abspath(target):
+                local_copies.append((held[digest], target))
+        elif digest in first:
+            batch_copies.append((first[digest], target))
+        else:
+            first[digest] = target
+            wanted.append(index)
+    return wanted, local_copies, batch_copies
+
+def replace_with(data, target):
+    tmp_path = target + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, target)
+
+def apply_batch(entries, wanted, parts, local_copies, batch_copies, directory):
+    # Nothing in the directory changes until every received file has been
+    # decoded and matched against its manifest hash. Local sources are read
+    # up front because a file in this batch may replace one of them.
+    staged = []
+    for source, target in local_copies:
+        if callable(source):
+            staged.append((source(), target))
+            continue
+        with open(source, "rb") as f:
+            staged.append((f.read(), target))
+    received = {}
+    for index, part in zip(wanted, parts):
+        entry = entries[index]
+        with open(part, "rb") as f:
+            data = decompress(entry["codec"], f.read())
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise ManifestError(f"{entry['name']} does not match its manifest hash")
+        target = os.path.join(directory, entry["name"])
+        received[target] = data
+        staged.append((data, target))
+    for source, target in batch_copies:
+        staged.append((received[source], target))
+    for data, target in staged:
+        replace_with(data, target)
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv("credentials.env")
+
+CACHE_FILE = os.getenv("MATCH_CACHE_FILE", "match_cache.db")
+TTL = float(os.getenv("MATCH_CACHE_TTL_DAYS", "30")) * 86400
+NEGATIVE_TTL = float(os.getenv("MATCH_CACHE_NEGATIVE_TTL_DAYS", "1")) * 86400
+MAX_ENTRIES = int(os.getenv("MATCH_CACHE_MAX_ENTRIES", "100000"))
+
+def spotify_track_id(url):
+    if not url:
+        return None
+    return url.rstrip("/").split("/")[-1].split("?")[0]
+
+def youtube_video_id(url):
+    if not url:
+        return None
+    return url.split("v=")[-1].split("&")[0]
+
+def cache_keys(spotify_id=None, youtube_id=None, isrc=None):
+    keys = []
+    if isrc:
+        keys.append(f"isrc:{isrc.upper()}")
+    if spotify_id:
+        keys.append(f"spotify:{spotify_id}")
+    if youtube_id:
+        keys.append(f"youtube:{youtube_id}")
+    return keys
+
+class MatchCache:
+    def __init__(self, path=CACHE_FILE, ttl=TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS matches (
+                key TEXT PRIMARY KEY,
+                spotify_id TEXT,
+                youtube_music_id TEXT,
+                negative INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS matches_accessed ON matches (accessed_at)")
+        self.db.commit()
+
+    def lookup(self, keys):
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                row = self.db.execute(
+                    "SELECT spotify_id, youtube_music_id, negative, stored_at FROM matches WHERE key = ?", (key,)
+                ).fetchone()
+                if not row:
+                    continue
+                spotify_id, youtube_music_id, negative, stored_at = row
+                if now - stored_at > (self.negative_ttl if negative else self.ttl):
+                    self.db.execute("DELETE FROM matches WHERE key = ?", (key,))
+                    continue
+                self.db.execute("UPDATE matches SET accessed_at = ? WHERE key = ?", (now, key))
+                self.db.commit()
+                if negative:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return {"spotify_id": spotify_id, "youtube_music_id": youtube_music_id}
+            self.misses += 1
+            self.db.commit()
+            return None
+
+    def store(self, keys, links):
+        now = time.time()
+        negative = not (links.get("spotify_id") and links.get("youtube_music_id"))
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, links.get("spotify_id"), links.get("youtube_music_id"), int(negative), now, now) for key in keys]
+            )
+            overflow = self.db.execute("SELECT COUNT(*) FROM matches").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.db.execute(
+                    "DELETE FROM matches WHERE key IN (SELECT key FROM matches ORDER BY accessed_at LIMIT ?)", (overflow,)
+                )
+                self.evictions += overflow
+            self.db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
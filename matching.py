@@ -0,0 +1,70 @@
+import re
+import unicodedata
+
+# Title/artist comparison for the library's local match index. Both sides
+# are reduced to word tokens with the decoration YouTube uploads add
+# removed, so "Artist - Title (Official Video)" by "Artist - Topic" and
+# Spotify's "Title (feat. Guest)" by "Artist" come out the same.
+
+NOISE_BRACKETS = re.compile(
+    r"[\(\[][^\)\]]*\b(official|video|audio|lyrics?|visuali[sz]er|hd|hq|4k|mv|m/v)\b[^\)\]]*[\)\]]", re.I
+)
+NOISE_SUFFIX = re.compile(r"\s[-|]\s*(official\s+(music\s+)?(video|audio)|(lyrics?|audio)(\s+video)?)\s*$", re.I)
+FEATURING = re.compile(r"\b(feat|ft|featuring)\b\.?[^-\(\)\[\]]*", re.I)
+ARTIST_SUFFIX = re.compile(r"(\s*-\s*topic|vevo|\s+official)\s*$", re.I)
+TOKEN = re.compile(r"\w+")
+MIN_GLUED = 5
+# Tokens that mark a different recording of the same song: a candidate
+# that differs from the query by one of these is never a match
+VERSION_TAGS = {
+    "remix", "live", "acoustic", "instrumental", "karaoke", "cover", "edit", "remaster", "remastered",
+    "slowed", "reverb", "sped", "nightcore", "demo", "extended", "unplugged", "acapella", "mix",
+}
+
+def fold(text):
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().replace("&", " and ")
+
+def clean_title(title):
+    title = NOISE_BRACKETS.sub(" ", title or "")
+    title = NOISE_SUFFIX.sub("", title)
+    return FEATURING.sub(" ", title)
+
+def clean_artist(artist):
+    if not artist or artist == "Unknown":
+        return ""
+    return ARTIST_SUFFIX.sub("", FEATURING.sub(" ", artist))
+
+def tokens(text):
+    return TOKEN.findall(fold(text))
+
+def describe(name, artist):
+    # Title tokens, artist tokens, and the artist's and whole track's
+    # tokens run together, for one track
+    title = tokens(clean_title(name))
+    artist_tokens = tokens(clean_artist(artist))
+    return set(title), set(artist_tokens), "".join(artist_tokens), "".join(title + artist_tokens)
+
+def index_tokens(name, artist):
+    title, artist_tokens, _, _ = describe(name, artist)
+    return title | artist_tokens
+
+def covers(words, other):
+    return len(words & other) / len(words) if words else 0.0
+
+def artist_found(artist, glued, other, other_glued):
+    # Channel names often run the words together ("TheWeekndVEVO"); very
+    # short names would turn up inside unrelated words
+    return bool(artist) and (artist <= other or (len(glued) >= MIN_GLUED and glued in other_glued))
+
+def similarity(query, candidate):
+    # 1.0 when each title is fully found in the other track and one side's
+    # artist appears in the other; 0.0 across versions of a song
+    q_title, q_artist, q_glued, q_all_glued = query
+    c_title, c_artist, c_glued, c_all_glued = candidate
+    q_all, c_all = q_title | q_artist, c_title | c_artist
+    if VERSION_TAGS & (q_all ^ c_all):
+        return 0.0
+    if not (artist_found(q_artist, q_glued, c_all, c_all_glued) or artist_found(c_artist, c_glued, q_all, q_all_glued)):
+        return 0.0
+    return (covers(q_title, c_all) + covers(c_title, q_all)) / 2
@@ -1,11 +1,32 @@
 from rich.console import Console
+from rich.markup import escape
 from rich.prompt import Prompt
 from rich.panel import Panel
 from rich.table import Table
-import subprocess
+import importlib
 
 console = Console()
 
+# Each tool is imported the first time it is picked, so the menu starts
+# without loading spotipy, googleapiclient or cryptography; signed-in
+# clients and the transfer key then stay warm for the rest of the session
+TOOLS = {
+    "1": ("get_playlist", "main"),
+    "2": ("sender_receiver", "main"),
+    "3": ("create", "export_playlist"),
+    "4": ("receiver_daemon", "main"),
+}
+
+def run_tool(module_name, function_name):
+    try:
+        getattr(importlib.import_module(module_name), function_name)()
+    except KeyboardInterrupt:
+        console.print(Panel("[yellow]Cancelled.[/yellow]", border_style="yellow"))
+    except Exception as e:
+        # A failing tool should not take the whole menu down with it
+        console.print(Panel(f"[bold red]{type(e).__name__}: {escape(str(e))}[/bold red]", border_style="red"))
+    input("Press Enter to return to main menu")
+
 def menu():
     while True:
         console.clear()
@@ -14,20 +35,17 @@ def menu():
         menu_table = Table(show_header=False, box=None, pad_edge=False)
         menu_table.add_column(justify="right")
         menu_table.add_column()
-        menu_table.add_row("[cyan]1.[/cyan]", "[white]Import Playlist (YouTube/Spotify → JSON)[/white]")
+        menu_table.add_row("[cyan]1.[/cyan]", "[white]Import Playlist (YouTube/Spotify → Library)[/white]")
         menu_table.add_row("[cyan]2.[/cyan]", "[white]Send/Receive Playlist[/white]")
-        menu_table.add_row("[cyan]3.[/cyan]", "[white]Export Playlist (JSON → YouTube/Spotify)[/white]")
-        menu_table.add_row("[cyan]4.[/cyan]", "[white]Exit[/white]")
+        menu_table.add_row("[cyan]3.[/cyan]", "[white]Export Playlist (Library → YouTube/Spotify)[/white]")
+        menu_table.add_row("[cyan]4.[/cyan]", "[white]Run Receiver Daemon (collect from known peers)[/white]")
+        menu_table.add_row("[cyan]5.[/cyan]", "[white]Exit[/white]")
         console.print(menu_table)
 
         choice = Prompt.ask("\n[bold green]Select an option[/bold green]")
-        if choice == "1":
-            subprocess.run(["python", "get_playlist.py"])
-        elif choice == "2":
-            subprocess.run(["python", "sender_receiver.py"])
-        elif choice == "3":
-            subprocess.run(["python", "create.py"])
-        elif choice == "4":
+        if choice in TOOLS:
+            run_tool(*TOOLS[choice])
+        elif choice == "5":
             console.print(Panel("[bold green]Exiting...[/bold green]\n[bold green]Thank you for using MusiConvert![/bold green]", border_style="green"))
             break
         else:
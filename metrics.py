@@ -0,0 +1,264 @@
+import os
+import re
+import json
+import time
+import pstats
+import cProfile
+import datetime
+import platform
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Per-run instrumentation for imports, exports and transfers. A tool calls
+# start() and finish(); everything in between records into the current
+# run through the module functions, which do nothing while no run is
+# active, so library code and the benchmarks can call them freely.
+
+load_dotenv("credentials.env")
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+# A node exporter textfile collector directory; one .prom file per tool
+TEXTFILE_DIR = os.getenv("METRICS_TEXTFILE_DIR")
+PROFILE = os.getenv("METRICS_PROFILE", "").lower() in ("1", "true", "yes")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "musiconvert"
+
+class Run:
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.apis = {}
+        self.details = {}
+        self.profiles = []
+        self.local = threading.local()
+
+    def api(self, provider):
+        if provider not in self.apis:
+            self.apis[provider] = {"calls": 0, "errors": 0, "throttled": 0, "retries": 0, "waited": 0.0, "latencies": []}
+        return self.apis[provider]
+
+    def summary(self):
+        apis = {}
+        for provider, api in self.apis.items():
+            latencies = sorted(api["latencies"])
+            apis[provider] = {
+                "calls": api["calls"],
+                "errors": api["errors"],
+                "throttled": api["throttled"],
+                "retries": api["retries"],
+                "waited": api["waited"],
+                "latency_sum": sum(latencies),
+                "latency_p50": percentile(latencies, 0.50),
+                "latency_p95": percentile(latencies, 0.95),
+                "latency_p99": percentile(latencies, 0.99),
+                "latency_max": latencies[-1] if latencies else None,
+                "latency_buckets": {str(bound): sum(1 for value in latencies if value <= bound) for bound in LATENCY_BUCKETS},
+            }
+        return {
+            "run": self.name,
+            "started": self.started_at.isoformat(),
+            "elapsed": time.monotonic() - self.started,
+            "python": platform.python_version(),
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "apis": apis,
+            "details": dict(self.details),
+        }
+
+current = None
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def start(name):
+    global current
+    current = Run(name)
+    if PROFILE:
+        enable_profile(current)
+    return current
+
+def enable_profile(run):
+    # cProfile only follows the thread that enabled it, so worker threads
+    # get their own profiler through profiled()
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return None
+    run.local.profile = profile
+    with run.lock:
+        run.profiles.append(profile)
+    return profile
+
+def profiled(fn):
+    # Wraps work handed to a thread pool so it shows up in the profile
+    run = current
+    if run is None or not PROFILE:
+        return fn
+    def call(*args, **kwargs):
+        profile = getattr(run.local, "profile", None) or enable_profile(run)
+        if profile is None:
+            return fn(*args, **kwargs)
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+    return call
+
+@contextmanager
+def stage(name):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        run = current
+        if run is not None:
+            with run.lock:
+                run.stages[name] = run.stages.get(name, 0.0) + time.monotonic() - started
+
+def count(name, amount=1):
+    run = current
+    if run is not None:
+        with run.lock:
+            run.counters[name] = run.counters.get(name, 0) + amount
+
+def record(section, values):
+    run = current
+    if run is not None:
+        with run.lock:
+            run.details[section] = values
+
+def api_call(provider, seconds, status=None, retries=0, throttled=0):
+    # status is the HTTP status of the final attempt, or None when the
+    # request never got an answer
+    run = current
+    if run is None:
+        return
+    with run.lock:
+        api = run.api(provider)
+        api["calls"] += 1
+        api["retries"] += retries
+        api["throttled"] += throttled + (status == 429)
+        if status is None or status >= 400:
+            api["errors"] += 1
+        api["latencies"].append(seconds)
+
+def api_retry(provider, throttled=False):
+    run = current
+    if run is not None:
+        with run.lock:
+            api = run.api(provider)
+            api["retries"] += 1
+            api["throttled"] += int(throttled)
+
+def api_wait(provider, seconds):
+    # Time spent queued behind the provider's rate limiter
+    run = current
+    if run is not None:
+        with run.lock:
+            run.api(provider)["waited"] += seconds
+
+@contextmanager
+def timed_call(provider):
+    # For calls made without the transport helpers, such as batch requests
+    started = time.monotonic()
+    status = 200
+    try:
+        yield
+    except Exception as e:
+        status = getattr(getattr(e, "resp", None), "status", None)
+        raise
+    finally:
+        api_call(provider, time.monotonic() - started, status)
+
+def transfer(stats, role):
+    # Packet counters from a send session (or the receiver's view) plus goodput
+    values = {key: value for key, value in stats.items() if key != "peers"}
+    values["role"] = role
+    if stats.get("elapsed") and stats.get("bytes") is not None:
+        values["goodput"] = stats["bytes"] / stats["elapsed"]
+    if "peers" in stats:
+        values["peers"] = [dict(peer, address=list(peer["address"])) for peer in stats["peers"]]
+    record("transfer", values)
+
+def finish():
+    # Writes the JSON summary (and the Prometheus file and profile when
+    # configured); returns the summary's path
+    global current
+    run, current = current, None
+    if run is None:
+        return None
+    profile = getattr(run.local, "profile", None)
+    if profile is not None:
+        profile.disable()
+    summary = run.summary()
+    path = None
+    stamp = run.started_at.astimezone().strftime("%Y%m%d-%H%M%S")
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{run.name}-{stamp}.json")
+        write_atomic(path, json.dumps(summary, indent=4, default=str))
+        if run.profiles:
+            stats = pstats.Stats(run.profiles[0])
+            for other in run.profiles[1:]:
+                stats.add(other)
+            stats.dump_stats(os.path.join(METRICS_DIR, f"{run.name}-{stamp}.prof"))
+    if TEXTFILE_DIR:
+        write_atomic(os.path.join(TEXTFILE_DIR, f"{PREFIX}_{run.name}.prom"), prometheus(summary))
+    return path
+
+def write_atomic(path, text):
+    # The node exporter may read the file at any moment
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def prometheus(summary):
+    # Every value describes the last run of the tool, so all are gauges
+    run = summary["run"]
+    lines = []
+
+    def gauge(name, help_text, samples):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{value_}"' for key, value_ in [("run", run)] + labels)
+            lines.append(f"{PREFIX}_{name}{{{label_text}}} {float(value):g}")
+
+    gauge("run_duration_seconds", "Wall time of the last run", [([], summary["elapsed"])])
+    gauge("run_timestamp_seconds", "When the last run started", [([], datetime.datetime.fromisoformat(summary["started"]).timestamp())])
+    gauge("stage_seconds", "Wall time per stage of the last run", [([("stage", stage)], seconds) for stage, seconds in summary["stages"].items()])
+    for field in ("calls", "errors", "throttled", "retries"):
+        gauge(f"api_{field}", f"API {field} per provider in the last run", [
+            ([("provider", provider)], api[field]) for provider, api in summary["apis"].items()
+        ])
+    gauge("api_wait_seconds", "Time spent waiting on the rate limiter per provider in the last run", [
+        ([("provider", provider)], api["waited"]) for provider, api in summary["apis"].items()
+    ])
+    lines.append(f"# HELP {PREFIX}_api_latency_seconds API call latency per provider in the last run")
+    lines.append(f"# TYPE {PREFIX}_api_latency_seconds histogram")
+    for provider, api in summary["apis"].items():
+        labels = f'run="{run}",provider="{provider}"'
+        for bound, total in api["latency_buckets"].items():
+            lines.append(f'{PREFIX}_api_latency_seconds_bucket{{{labels},le="{float(bound):g}"}} {total}')
+        lines.append(f'{PREFIX}_api_latency_seconds_bucket{{{labels},le="+Inf"}} {api["calls"]}')
+        lines.append(f"{PREFIX}_api_latency_seconds_sum{{{labels}}} {api['latency_sum']:g}")
+        lines.append(f"{PREFIX}_api_latency_seconds_count{{{labels}}} {api['calls']}")
+    if summary["counters"]:
+        gauge("events", "Counted events in the last run", [([("event", metric_name(name))], value) for name, value in summary["counters"].items()])
+    for section, values in summary["details"].items():
+        numbers = [(key, value) for key, value in values.items() if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        if numbers:
+            gauge(metric_name(section), f"{section} figures from the last run", [([("field", key)], value) for key, value in numbers])
+    return "\n".join(lines) + "\n"
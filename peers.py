@@ -0,0 +1,27 @@
+import os
+from cryptography.fernet import Fernet
+
+PEER_FILE = "peers.txt"
+KEY_FILE = "encryption_key.key"
+
+def load_peers():
+    if not os.path.exists(PEER_FILE):
+        return []
+    with open(PEER_FILE, "r") as f:
+        return [line.strip().split(",") for line in f.readlines() if line.strip()]
+
+def save_peer(name, ip):
+    peers = load_peers()
+    if not any(p[1] == ip for p in peers):
+        with open(PEER_FILE, "a") as f:
+            f.write(f"{name},{ip}\n")
+
+def load_or_generate_key():
+    if not os.path.exists(KEY_FILE):
+        key = Fernet.generate_key()
+        with open(KEY_FILE, "wb") as f:
+            f.write(key)
+    else:
+        with open(KEY_FILE, "rb") as f:
+            key = f.read()
+    return key
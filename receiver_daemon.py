@@ -0,0 +1,285 @@
+import os
+import re
+import time
+import socket
+import asyncio
+import datetime
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from dotenv import load_dotenv
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+from framing import HELLO, FramingError, is_v2, master_key, open_hello, parse_header
+from library import LibraryError, open_library
+from peers import load_or_generate_key, load_peers
+from transfer import ACK_DELAY, DECRYPT_WORKERS, MULTICAST_GROUP, BatchReceiveSession, join_multicast, start_session
+
+load_dotenv("credentials.env")
+console = Console()
+PORT = int(os.getenv("DAEMON_PORT", "50000"))
+RECEIVE_DIR = os.getenv("DAEMON_RECEIVE_DIR", "playlists")
+MAX_SESSIONS = int(os.getenv("DAEMON_MAX_SESSIONS", "64"))
+IDLE_TIMEOUT = float(os.getenv("DAEMON_IDLE_TIMEOUT", "60"))
+SESSION_QUEUE = int(os.getenv("DAEMON_SESSION_QUEUE", "2048"))
+MAX_BUFFERED = int(os.getenv("DAEMON_MAX_BUFFERED", str(64 << 20)))
+DRAIN_BATCH = 64
+SWEEP_INTERVAL = 1.0
+
+@lru_cache(maxsize=1024)
+def host_key(host):
+    # One spelling per sender: IPv4-mapped IPv6 addresses compare equal to
+    # the IPv4 address, and host names from peers.txt are looked up once
+    try:
+        address = ipaddress.ip_address(host.split("%")[0])
+    except ValueError:
+        try:
+            return host_key(socket.gethostbyname(host))
+        except OSError:
+            return host
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return str(address)
+
+class DaemonSession:
+    def __init__(self, session, peer, address, started):
+        self.session = session
+        self.peer = peer
+        self.address = address
+        self.started = started
+        self.last_seen = started
+        self.queue = asyncio.Queue()
+        self.queued = 0
+        self.flush_handle = None
+        self.task = None
+
+class ReceiverDaemon(asyncio.DatagramProtocol):
+    # Serves every known peer at once. Sessions are keyed by the sender's
+    # address, its port and the session id in the packet header, so senders
+    # behind one NAT stay apart; each one gets its own queue, drained
+    # through a shared decrypt pool so a slow session only holds itself
+    # back. Packets are dropped before they are acknowledged when a
+    # session's queue or the daemon's buffer is full, which the senders'
+    # congestion windows treat as loss.
+    def __init__(self, key, peers, library=None, directory=RECEIVE_DIR):
+        self.key = key
+        self.peers = {host_key(ip): name for name, ip in peers}
+        self.library = library
+        self.directory = directory
+        self.sessions = {}
+        self.pool = ThreadPoolExecutor(max_workers=max(1, DECRYPT_WORKERS))
+        self.buffered = 0
+        self.dropped = 0
+        self.loop = None
+        self.loop_thread = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+
+    def reply_to(self, address):
+        # Sessions reply from decrypt threads as well as the loop, and
+        # transports are not thread-safe
+        def reply(packet):
+            if threading.get_ident() == self.loop_thread:
+                self.transport.sendto(packet, address)
+            else:
+                self.loop.call_soon_threadsafe(self.transport.sendto, packet, address)
+        return reply
+
+    def datagram_received(self, data, addr):
+        host = host_key(addr[0])
+        if host not in self.peers or not is_v2(data):
+            return
+        ptype, session_id, _ = parse_header(data)
+        if ptype == HELLO:
+            self.on_hello(data, addr, host)
+            return
+        state = self.sessions.get((host, addr[1], session_id))
+        if state is None:
+            return
+        state.last_seen = time.monotonic()
+        if state.queue.qsize() >= SESSION_QUEUE or self.buffered >= MAX_BUFFERED:
+            self.dropped += 1
+            return
+        if state.session.accept(data):
+            state.queue.put_nowait(data)
+            state.queued += len(data)
+            self.buffered += len(data)
+        self.schedule_flush(state)
+
+    def on_hello(self, data, addr, host):
+        try:
+            hello = open_hello(self.key, data)
+        except FramingError:
+            return
+        key = (host, addr[1], hello[0].session_id)
+        state = self.sessions.get(key)
+        if state is None:
+            if len(self.sessions) >= MAX_SESSIONS:
+                return
+            state = self.start(key, hello, addr)
+        state.last_seen = time.monotonic()
+        self.transport.sendto(state.session.hello_ack(), addr)
+
+    def start(self, key, hello, addr):
+        peer = self.peers[key[0]]
+        # Each peer gets its own folder so batches from different senders
+        # cannot overwrite each other's playlists
+        directory = os.path.join(self.directory, re.sub(r"[^\w.-]", "_", peer) or key[0])
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output_file = os.path.join(directory, f"{stamp}-{key[2]:08x}.json")
+        session = start_session(hello, self.reply_to(addr), output_file, directory, self.library)
+        state = DaemonSession(session, peer, addr, time.monotonic())
+        state.task = self.loop.create_task(self.drain(state))
+        self.sessions[key] = state
+        kind = "batch" if isinstance(session, BatchReceiveSession) else "playlist"
+        console.print(f"[cyan]{peer}[/cyan] ({key[0]}) started sending a {kind} [dim](session {key[2]:08x})[/dim]")
+        return state
+
+    def schedule_flush(self, state):
+        if state.session.pending and state.flush_handle is None:
+            state.flush_handle = self.loop.call_later(ACK_DELAY, self.flush, state)
+
+    def flush(self, state):
+        state.flush_handle = None
+        state.session.flush()
+        self.schedule_flush(state)
+
+    async def drain(self, state):
+        while True:
+            packets = [await state.queue.get()]
+            while not state.queue.empty() and len(packets) < DRAIN_BATCH:
+                packets.append(state.queue.get_nowait())
+            closing = packets[-1] is None
+            if closing:
+                packets.pop()
+            if packets:
+                try:
+                    await self.loop.run_in_executor(self.pool, self.process, state.session, packets)
+                except OSError as e:
+                    # Disk trouble stalls this session until it is evicted
+                    state.session.error = str(e)
+                size = sum(len(packet) for packet in packets)
+                state.queued -= size
+                self.buffered -= size
+                # Chunks are only counted, and SACKed, once they decrypt
+                self.schedule_flush(state)
+            if closing:
+                return
+
+    @staticmethod
+    def process(session, packets):
+        # Runs on the decrypt pool; drain() never has two batches of one
+        # session in flight, so deliver() stays single threaded per session
+        for packet in packets:
+            opened = session.open(packet)
+            if opened is not None:
+                session.deliver(*opened)
+
+    async def retire(self, key, abandon=False):
+        state = self.sessions.pop(key)
+        if state.flush_handle is not None:
+            state.flush_handle.cancel()
+        state.queue.put_nowait(None)
+        await state.task
+        await self.loop.run_in_executor(self.pool, state.session.abandon if abandon else state.session.close)
+        self.report(state)
+        if self.library is not None and state.session.status and not state.session.error:
+            await self.loop.run_in_executor(self.pool, self.store, state)
+
+    def store(self, state):
+        # Saved under the peer's folder name, as in the folder layout
+        session = state.session
+        if isinstance(session, BatchReceiveSession):
+            paths = [os.path.join(session.directory, entry["name"]) for entry in session.plan[0]]
+        else:
+            paths = [session.output_file]
+        folder = os.path.basename(os.path.dirname(paths[0])) if paths else ""
+        for path in paths:
+            name = f"{folder}/{os.path.splitext(os.path.basename(path))[0]}"
+            try:
+                self.library.import_file(path, name, received=True)
+            except (OSError, ValueError, LibraryError) as e:
+                console.print(f"[yellow]{state.peer}: could not add {path} to the library: {e}[/yellow]")
+
+    def report(self, state):
+        session = state.session
+        elapsed = time.monotonic() - state.started
+        if session.error:
+            console.print(f"[red]{state.peer}: {session.error}[/red]")
+        elif session.status is None:
+            console.print(f"[yellow]{state.peer}: session dropped after {elapsed:.0f}s without finishing[/yellow]")
+        elif session.status is False:
+            console.print(f"[red]{state.peer}: checksum mismatch, transfer discarded[/red]")
+        elif isinstance(session, BatchReceiveSession):
+            entries, wanted = session.plan[:2]
+            console.print(
+                f"[green]{state.peer}: {len(wanted)} playlists received, "
+                f"{len(entries) - len(wanted)} already present ({elapsed:.1f}s)[/green]"
+            )
+        else:
+            console.print(f"[green]{state.peer}: saved {session.output_file} ({elapsed:.1f}s)[/green]")
+
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            now = time.monotonic()
+            for key, state in list(self.sessions.items()):
+                if state.session.done():
+                    await self.retire(key, abandon=not state.session.status)
+                elif now - state.last_seen > IDLE_TIMEOUT:
+                    await self.retire(key, abandon=state.session.status is None)
+
+    async def shutdown(self):
+        for key, state in list(self.sessions.items()):
+            await self.retire(key, abandon=state.session.status is None)
+        self.pool.shutdown()
+
+async def serve(daemon, port=PORT):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: daemon, local_addr=("0.0.0.0", port))
+    if MULTICAST_GROUP:
+        try:
+            join_multicast(transport.get_extra_info("socket"), MULTICAST_GROUP)
+        except OSError as e:
+            console.print(f"[yellow]Could not join multicast group {MULTICAST_GROUP}: {e}[/yellow]")
+    try:
+        await daemon.sweep()
+    finally:
+        await daemon.shutdown()
+        transport.close()
+
+def show_peers(peers):
+    table = Table(title="Accepting transfers from", header_style="bold magenta")
+    table.add_column("Name", style="cyan")
+    table.add_column("IP Address", style="green")
+    for name, ip in peers:
+        table.add_row(name, ip)
+    console.print(table)
+
+def main():
+    peers = load_peers()
+    if not peers:
+        console.print(Panel(
+            "[bold red]No known peers. Add each sender as 'name,ip' to peers.txt first.[/bold red]", border_style="red"
+        ))
+        return
+    console.print(Panel(f"[bold cyan]MusiConvert receiver daemon on UDP port {PORT}[/bold cyan]", border_style="blue"))
+    show_peers(peers)
+    daemon = ReceiverDaemon(master_key(load_or_generate_key()), peers, open_library())
+    try:
+        asyncio.run(serve(daemon))
+    except KeyboardInterrupt:
+        pass
+    if daemon.dropped:
+        console.print(f"[dim]{daemon.dropped} packets dropped under backpressure[/dim]")
+    console.print(Panel("[bold green]Receiver daemon stopped.[/bold green]", border_style="green"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv("credentials.env")
+
+MAX_WORKERS = int(os.getenv("RESOLVE_WORKERS", "8"))
+# Items submitted ahead of the one the caller is waiting for
+RESOLVE_WINDOW = int(os.getenv("RESOLVE_WINDOW", str(MAX_WORKERS * 4)))
+MAX_RATE_LIMIT_RETRIES = 5
+
+class RateLimited(Exception):
+    def __init__(self, provider, retry_after=None):
+        super().__init__(f"{provider} rate limited (retry after {retry_after}s)")
+        self.provider = provider
+        self.retry_after = retry_after
+
+class QuotaExceeded(Exception):
+    pass
+
+def parse_retry_after(value, default=1.0):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Retry-After applies to the whole provider, not just the caller that saw it
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+class ProviderLimiter:
+    def __init__(self, name, rate, burst, concurrency):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+
+    @contextmanager
+    def slot(self):
+        started = time.monotonic()
+        with self.semaphore:
+            self.bucket.acquire()
+            metrics.api_wait(self.name, time.monotonic() - started)
+            yield
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            try:
+                with self.slot():
+                    return fn(*args, **kwargs)
+            except RateLimited as e:
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                metrics.api_retry(self.name)
+                self.bucket.pause(e.retry_after if e.retry_after is not None else 2 ** attempt)
+
+def _limiter(name, rate, burst, concurrency):
+    prefix = name.upper()
+    return ProviderLimiter(
+        name,
+        rate=float(os.getenv(f"{prefix}_RATE_LIMIT", rate)),
+        burst=float(os.getenv(f"{prefix}_BURST", burst)),
+        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+    )
+
+LIMITERS = {
+    "odesli": _limiter("odesli", rate=1.0, burst=5, concurrency=4),
+    "youtube": _limiter("youtube", rate=10.0, burst=10, concurrency=8),
+    "spotify": _limiter("spotify", rate=10.0, burst=10, concurrency=4),
+}
+
+def limited(provider, fn, *args, **kwargs):
+    return LIMITERS[provider].call(fn, *args, **kwargs)
+
+class QuotaBudget:
+    # Units a provider allows in total, shared by every thread; None is
+    # unlimited. Calls are charged before they are sent, so a call that
+    # would go over the budget is never made.
+    def __init__(self, provider, units=None):
+        self.provider = provider
+        self.units = units
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def charge(self, units):
+        with self.lock:
+            if self.units is not None and self.used + units > self.units:
+                raise QuotaExceeded(f"{self.provider} quota budget of {self.units} units used up")
+            self.used += units
+        metrics.count(f"{self.provider}_quota_units", units)
+
+    def remaining(self):
+        with self.lock:
+            return None if self.units is None else self.units - self.used
+
+# YouTube Data API units per call; other methods cost 1
+QUOTA_COSTS = {
+    "youtube.search.list": 100,
+    "youtube.playlists.insert": 50,
+    "youtube.playlistItems.insert": 50,
+    "youtube.playlistItems.update": 50,
+    "youtube.playlistItems.delete": 50,
+}
+YOUTUBE_QUOTA_BUDGET = os.getenv("YOUTUBE_QUOTA_BUDGET")
+QUOTAS = {"youtube": QuotaBudget("youtube", int(YOUTUBE_QUOTA_BUDGET) if YOUTUBE_QUOTA_BUDGET else None)}
+
+def charge_quota(provider, method, count=1):
+    if provider in QUOTAS:
+        QUOTAS[provider].charge(QUOTA_COSTS.get(method, 1) * count)
+
+def resolve_stream(items, resolve, progress=None, task=None, max_workers=MAX_WORKERS, window=RESOLVE_WINDOW):
+    # Yields resolve(item) in the order of items, which may be any iterable.
+    # Only window items are in flight at once, so neither the input nor the
+    # results are ever held in full.
+    resolve = metrics.profiled(resolve)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            for item in items:
+                if len(pending) >= max(window, 1):
+                    yield pending.popleft().result()
+                future = pool.submit(resolve, item)
+                if progress is not None:
+                    future.add_done_callback(lambda _: progress.advance(task))
+                pending.append(future)
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Stopped early: drop what has not started yet
+            for future in pending:
+                future.cancel()
@@ -1,38 +1,34 @@
 import os
-import datetime
+import re
 import socket
-import time
-import threading
-import struct
 import sys
+import tempfile
+import time
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
 from rich.table import Table
+from rich.progress import Progress
+from compression import NONE, batch_offers, codec_name, encodings
+from file_chunks import BatchSource, MemorySource, SourceFile
+from framing import FLAG_BATCH, chunk_size_for_mtu, master_key, path_mtu
+from library import LibraryError, choose_playlists, open_library
+import metrics
+from manifest import build_manifest
+from peers import load_or_generate_key, load_peers, save_peer
+from transfer import (
+    MULTICAST_GROUP, MULTICAST_TTL, BatchReceiveSession, FanoutSession, ReceivePipeline, SendSession,
+    TransferFailed, join_multicast, negotiate, send_manifest
+)
 
 load_dotenv("credentials.env")
 console = Console()
-PEER_FILE = "peers.txt"
-KEY_FILE = "encryption_key.key"
-CHUNK_SIZE = 1024
-WINDOW_SIZE = 4
-TIMEOUT = 2
-
-def load_peers():
-    if not os.path.exists(PEER_FILE):
-        return []
-    with open(PEER_FILE, "r") as f:
-        return [line.strip().split(",") for line in f.readlines() if line.strip()]
-
-def save_peer(name, ip):
-    peers = load_peers()
-    if not any(p[1] == ip for p in peers):
-        with open(PEER_FILE, "a") as f:
-            f.write(f"{name},{ip}\n")
+RECEIVE_DIR = "playlists"  # batches land here so held playlists can be skipped
+CHUNK_SIZE = 1024  # legacy Fernet mode; v2 sizes chunks to the path MTU
 
-def choose_receiver():
+def choose_receivers():
     peers = load_peers()
     if peers:
         table = Table(title="Known Receivers", header_style="bold magenta")
@@ -43,199 +39,299 @@ def choose_receiver():
             table.add_row(str(i), name, ip)
         table.add_row("0", "[yellow]New Receiver[/yellow]", "-")
         console.print(table)
-        choice = Prompt.ask("Select a receiver (number)")
-        if choice.isdigit() and 1 <= int(choice) <= len(peers):
-            return peers[int(choice) - 1]
+        choice = Prompt.ask("Select a receiver (number, several separated by commas, or 'all')")
+        if choice.strip().lower() == "all":
+            return peers
+        numbers = [part.strip() for part in choice.split(",") if part.strip()]
+        if numbers and all(n.isdigit() and 1 <= int(n) <= len(peers) for n in numbers):
+            return [peers[int(n) - 1] for n in dict.fromkeys(numbers)]
     name = Prompt.ask("Enter receiver's name")
     ip = Prompt.ask("Enter receiver's IP")
     save_peer(name, ip)
-    return (name, ip)
+    return [(name, ip)]
 
-def load_or_generate_key():
-    if not os.path.exists(KEY_FILE):
-        key = Fernet.generate_key()
-        with open(KEY_FILE, "wb") as f:
-            f.write(key)
-    else:
-        with open(KEY_FILE, "rb") as f:
-            key = f.read()
-    return Fernet(key)
-
-fernet = load_or_generate_key()
-
-def select_json_file(directory="playlists"):
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    files = [f for f in os.listdir(directory) if f.endswith('.json')]
-    if not files:
-        console.print("[red]No playlist JSON files found in the directory.[/red]")
-        return None
-    file_info = []
-    for f in files:
-        path = os.path.join(directory, f)
-        ctime = os.path.getctime(path)
-        dt = datetime.datetime.fromtimestamp(ctime)
-        file_info.append((f, dt.strftime("%H:%M:%S"), dt.strftime("%Y-%m-%d")))
-    table = Table(title="Available Playlists", show_lines=True)
-    table.add_column("No.", justify="right")
-    table.add_column("Name", style="cyan")
-    table.add_column("Time of Creation", style="green")
-    table.add_column("Date of Creation", style="magenta")
-    for idx, (fname, time_str, date_str) in enumerate(file_info, 1):
-        table.add_row(str(idx), fname, time_str, date_str)
-    console.print(table)
-    while True:
-        choice = Prompt.ask("Enter the number of the playlist to send")
-        if choice.isdigit() and 1 <= int(choice) <= len(file_info):
-            selected_file = os.path.join(directory, file_info[int(choice) - 1][0])
-            return selected_file
-        else:
-            console.print("[red]Invalid choice. Try again.[/red]")
+fernet = None
+transfer_key = None
+
+def load_keys():
+    # Read once per process; the menu keeps them across transfers
+    global fernet, transfer_key
+    if fernet is None:
+        key = load_or_generate_key()
+        fernet = Fernet(key)
+        transfer_key = master_key(key)
 
-console.clear()
-console.print(Panel("[bold cyan]Secure Selective Repeat File Transfer (UDP + AES)[/bold cyan]", border_style="blue"))
+def transfer_file_name(name):
+    # Library names may hold a folder ("peer/playlist"); on the wire the
+    # playlist is a single JSON file
+    return re.sub(r"[^\w.-]", "_", name) + ".json"
+
+def add_to_library(paths):
+    # Never replaces a saved playlist: a name already taken gets a number
+    library = open_library()
+    for path in paths:
+        try:
+            name = library.free_name(os.path.splitext(os.path.basename(path))[0])
+            console.print(f"[dim]Added to the library as '{library.import_file(path, name, received=True)}'[/dim]")
+        except (OSError, ValueError, LibraryError) as e:
+            console.print(f"[yellow]Could not add {path} to the library: {e}[/yellow]")
 
-IS_SENDER = Prompt.ask("[bold magenta]Are you the sender? (y/n)[/bold magenta]").lower() == 'y'
+def negotiate_v2(udp_socket, receiver_ip, chunk_size, file_size, encoded=(), flags=0):
+    # Returns the session framer, the receiver's reply framer and the codec
+    # it picked, or (None, None, NONE) when it only speaks the legacy format
+    framer, codecs, replies = negotiate(udp_socket, transfer_key, [receiver_ip], chunk_size, file_size, encoded, flags)
+    if receiver_ip not in codecs:
+        return None, None, NONE
+    return framer, replies[receiver_ip], codecs[receiver_ip]
 
-# [Imports remain unchanged — omitted here for brevity]
+def prepare_batch(udp_socket, receiver_ip, chunk_size, file_paths):
+    # One session for many playlists: agree on a codec, then let the receiver
+    # pick the files it lacks from the manifest
+    framer, reply_framer, codec = negotiate_v2(udp_socket, receiver_ip, chunk_size, 0, batch_offers(), FLAG_BATCH)
+    if framer is None:
+        console.print(Panel("[bold red]Receiver does not support batch transfers. Send playlists one at a time.[/bold red]", border_style="red"))
+        return None, None, None
+    entries, payloads = build_manifest(file_paths, codec)
+    try:
+        wanted = send_manifest(udp_socket, (receiver_ip, 50000), framer, reply_framer, entries, chunk_size)
+    except TransferFailed as e:
+        console.print(Panel(f"[bold red]{e}. Giving up.[/bold red]", border_style="red"))
+        return None, None, None
+    console.print(f"[dim]Receiver needs {len(wanted)} of {len(entries)} playlists ({codec_name(codec)})[/dim]")
+    return BatchSource([payloads[index] for index in wanted]), framer, reply_framer
+
+def send_fanout(udp_socket, receivers, file_path):
+    # One playlist to several receivers in a single session: every receiver
+    # gets the same HELLO and therefore the same key, so each chunk is
+    # sealed once whatever the number of receivers. Their replies each come
+    # under a key of their own.
+    names = {ip: name for name, ip in receivers}
+    chunk_size = min(chunk_size_for_mtu(path_mtu(ip, 50000)) for ip in names)
+    source = SourceFile(file_path)
+    with metrics.stage("negotiate"):
+        encoded = encodings(source.view)
+        framer, codecs, replies = negotiate(udp_socket, transfer_key, list(names), chunk_size, source.size, encoded)
+        if len(set(codecs.values())) > 1:
+            # One payload has to suit everyone; start over without compression
+            framer, codecs, replies = negotiate(udp_socket, transfer_key, list(codecs), chunk_size, source.size)
+    for ip in names:
+        if ip not in codecs:
+            console.print(f"[yellow]{names[ip]} ({ip}) did not answer or only speaks the legacy format; send to it on its own.[/yellow]")
+    if not codecs:
+        source.close()
+        console.print(Panel("[bold red]No receiver joined the transfer.[/bold red]", border_style="red"))
+        return False
+    codec = next(iter(codecs.values()))
+    if codec != NONE:
+        payload = dict(encoded)[codec]
+        console.print(f"[dim]Sending {codec_name(codec)}: {source.size} -> {len(payload)} bytes[/dim]")
+        source.close()
+        source = MemorySource(payload)
+    multicast = None
+    if MULTICAST_GROUP:
+        udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+        multicast = (MULTICAST_GROUP, 50000)
+    addresses = {(socket.gethostbyname(ip), 50000): replies[ip] for ip in codecs}
+    session = FanoutSession(udp_socket, addresses, source, chunk_size, framer, multicast)
+
+    try:
+        with metrics.stage("send"), Progress() as progress:
+            task = progress.add_task(f"[cyan]Sending to {len(addresses)} receivers...", total=session.total)
+            stats = session.run(progress, task)
+    finally:
+        source.close()
+    metrics.transfer(stats, "sender")
+
+    console.print(
+        f"[dim]{stats['packets']} packets, {stats['sent']} datagrams sent, {stats['retransmissions']} retransmitted "
+        f"({stats['fast_retransmissions']} on NACK) in {stats['elapsed']:.2f}s[/dim]"
+    )
+    table = Table(title="Fan-out Results", header_style="bold magenta")
+    table.add_column("Receiver", style="cyan")
+    table.add_column("Retransmitted", justify="right")
+    table.add_column("Status")
+    failed = False
+    for ip, peer in zip(codecs, stats["peers"]):
+        if peer["failed"]:
+            status = f"[red]Dropped: {peer['failed']}[/red]"
+        elif peer["confirmed"]:
+            status = "[green]Confirmed[/green]"
+        elif peer["confirmed"] is False:
+            status = "[red]Checksum mismatch[/red]"
+        else:
+            status = "[yellow]Not confirmed[/yellow]"
+        failed = failed or not peer["confirmed"]
+        table.add_row(names[ip], str(peer["retransmissions"]), status)
+    console.print(table)
+    if failed:
+        return False
+    console.print(Panel("[bold green]Sender finished.[/bold green]", border_style="green"))
+    return True
 
 def sender():
-    receiver_name, receiver_ip = choose_receiver()
-    file_path = select_json_file("playlists")
-    if not file_path:
-        console.print(Panel("[bold red]No playlist file selected. Exiting.[/bold red]", border_style="red"))
-        sys.exit(1)
-    if not os.path.exists(file_path):
-        console.print(Panel("[bold red]File not found. Exiting.[/bold red]", border_style="red"))
-        sys.exit(1)
-
-    with open(file_path, "rb") as f:
-        file_data = f.read()
-    total_packets = (len(file_data) + CHUNK_SIZE - 1) // CHUNK_SIZE
-    base = 0
-    lock = threading.Lock()
-    acknowledged = set()
-    stop_ack_listener = threading.Event()
+    receivers = choose_receivers()
+    library = open_library()
+    names = choose_playlists(library, multiple=True)
+    if not names:
+        console.print(Panel("[bold red]No playlist selected.[/bold red]", border_style="red"))
+        return False
+    if len(receivers) > 1 and len(names) > 1:
+        # Batches are planned per receiver from what it already holds
+        console.print(Panel("[bold red]Send one playlist to several receivers, or several playlists to one.[/bold red]", border_style="red"))
+        return False
+
+    # Playlists travel as the JSON files older versions read, written out
+    # of the library for the length of the transfer
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            file_paths = [library.export_file(name, os.path.join(directory, transfer_file_name(name))) for name in names]
+        except LibraryError as e:
+            console.print(Panel(f"[bold red]{e}[/bold red]", border_style="red"))
+            return False
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            udp_socket.bind(('', 50001))  # sender listens for ACKs here
+        except OSError:
+            console.print("[yellow]Port 50001 already in use. Skipping bind.[/yellow]")
+        # The menu runs this in-process, so the port must be free again however
+        # the transfer ends
+        try:
+            if len(receivers) > 1:
+                return send_fanout(udp_socket, receivers, file_paths[0])
+            return send_one(udp_socket, receivers[0], file_paths)
+        finally:
+            udp_socket.close()
+
+def send_one(udp_socket, receiver, file_paths):
+    receiver_name, receiver_ip = receiver
+    chunk_size = chunk_size_for_mtu(path_mtu(receiver_ip, 50000))
+    if len(file_paths) > 1:
+        with metrics.stage("negotiate"):
+            source, framer, reply_framer = prepare_batch(udp_socket, receiver_ip, chunk_size, file_paths)
+        if source is None:
+            return False
+    else:
+        source = SourceFile(file_paths[0])
+        with metrics.stage("negotiate"):
+            encoded = encodings(source.view)
+            framer, reply_framer, codec = negotiate_v2(udp_socket, receiver_ip, chunk_size, source.size, encoded)
+        if framer is None:
+            console.print("[yellow]Receiver does not support binary framing; falling back to Fernet packets.[/yellow]")
+            chunk_size = CHUNK_SIZE
+        elif codec != NONE:
+            payload = dict(encoded)[codec]
+            console.print(f"[dim]Sending {codec_name(codec)}: {source.size} -> {len(payload)} bytes[/dim]")
+            source.close()
+            source = MemorySource(payload)
+    session = SendSession(udp_socket, (receiver_ip, 50000), source, chunk_size, framer, reply_framer, fernet)
 
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        udp_socket.bind(('', 50001))  # sender listens for ACKs here
-    except OSError:
-        console.print("[yellow]Port 50001 already in use. Skipping bind.[/yellow]")
-
-    def listen_for_acks():
-        nonlocal base
-        while not stop_ack_listener.is_set():
-            try:
-                packet, _ = udp_socket.recvfrom(2048)
-                if packet[:4] == b'ACK!':
-                    seq_num = struct.unpack("!I", packet[4:8])[0]
-                    with lock:
-                        if seq_num not in acknowledged:
-                            console.print(f"[green]ACK RECEIVED:[/green] Packet {seq_num}")
-                            acknowledged.add(seq_num)
-                        while base in acknowledged:
-                            base += 1
-                elif packet[:4] == b'EACK':
-                    console.print(Panel("[bold green]Receiver confirmed completion.[/bold green]", border_style="green"))
-                    stop_ack_listener.set()
-                    break
-            except:
-                break
-
-    ack_thread = threading.Thread(target=listen_for_acks, daemon=True)
-    ack_thread.start()
-    timers = {}
-
-    while base < total_packets:
-        with lock:
-            for seq in range(base, min(base + WINDOW_SIZE, total_packets)):
-                if seq not in acknowledged and (seq not in timers or time.time() - timers[seq] >= TIMEOUT):
-                    chunk = file_data[seq * CHUNK_SIZE:(seq + 1) * CHUNK_SIZE]
-                    encrypted_chunk = fernet.encrypt(chunk)
-                    header = struct.pack("!4sI", b'DATA', seq)
-                    packet = header + encrypted_chunk
-                    udp_socket.sendto(packet, (receiver_ip, 50000))
-                    timers[seq] = time.time()
-                    console.print(f"[cyan]SENT:[/cyan] Packet {seq}")
-        time.sleep(0.1)
-
-    # End transmission
-    end_packet = struct.pack("!4sI", b'END!', 999999999)
-    for _ in range(3):
-        udp_socket.sendto(end_packet, (receiver_ip, 50000))
-
-    console.print(Panel("[yellow]Waiting for receiver to confirm completion...[/yellow]", border_style="yellow"))
-    wait_start = time.time()
-    while time.time() - wait_start < 5:
-        if stop_ack_listener.is_set():
-            break
-        time.sleep(0.5)
-
-    stop_ack_listener.set()
-    udp_socket.close()
-    ack_thread.join()
+        with metrics.stage("send"), Progress() as progress:
+            task = progress.add_task(f"[cyan]Sending to {receiver_name}...", total=session.total)
+            stats = session.run(progress, task)
+    except TransferFailed as e:
+        console.print(Panel(f"[bold red]{e}. Giving up.[/bold red]", border_style="red"))
+        return False
+    finally:
+        source.close()
+    metrics.transfer(stats, "sender")
+
+    console.print(
+        f"[dim]{stats['packets']} packets sent, {stats['retransmissions']} retransmitted "
+        f"({stats['fast_retransmissions']} on NACK) in {stats['elapsed']:.2f}s[/dim]"
+    )
+    if stats["confirmed"]:
+        console.print(Panel("[bold green]Receiver confirmed completion.[/bold green]", border_style="green"))
+    elif stats["confirmed"] is False:
+        console.print(Panel("[bold red]Receiver reported a checksum mismatch.[/bold red]", border_style="red"))
+        return False
+    else:
+        # Without the END acknowledgement nothing says the file arrived whole
+        console.print(Panel("[bold red]Receiver never confirmed completion; the transfer is unconfirmed.[/bold red]", border_style="red"))
+        return False
     console.print(Panel("[bold green]Sender finished.[/bold green]", border_style="green"))
+    return True
 
 def receiver():
     sender_ip = Prompt.ask("[bold magenta]Enter sender IP[/bold magenta]").strip()
-    output_file = Prompt.ask("[bold magenta]Enter output file name[/bold magenta]").strip()
+    output_file = Prompt.ask(f"[bold magenta]Enter output file name (batches are saved into {RECEIVE_DIR}/)[/bold magenta]").strip()
 
     udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         udp_socket.bind(('', 50000))
     except OSError:
         console.print("[yellow]Port 50000 already in use. Skipping bind.[/yellow]")
+    if MULTICAST_GROUP:
+        try:
+            join_multicast(udp_socket, MULTICAST_GROUP)
+        except OSError as e:
+            console.print(f"[yellow]Could not join multicast group {MULTICAST_GROUP}: {e}[/yellow]")
 
-    received = {}
-    end_received = False
-    end_time = None
+    pipeline = ReceivePipeline(
+        udp_socket, (sender_ip, 50001), transfer_key, fernet, output_file, CHUNK_SIZE, RECEIVE_DIR,
+        library=open_library()
+    )
     console.print(Panel(f"[yellow]Waiting for data from {sender_ip}...[/yellow]", border_style="yellow"))
-
-    while True:
+    started = time.monotonic()
+    with metrics.stage("receive"), Progress() as progress:
+        task = progress.add_task(f"[cyan]Receiving from {sender_ip}...", total=None)
         try:
-            udp_socket.settimeout(1.0)  # avoid blocking forever
-            packet, addr = udp_socket.recvfrom(65535)
-        except socket.timeout:
-            # If we've received END and waited long enough, break
-            if end_received and (time.time() - end_time) > 3:
-                break
-            continue
+            pipeline.run(progress, task)
         except KeyboardInterrupt:
-            break
-
-        if addr[0] != sender_ip:
-            continue
-
-        if packet[:4] == b'DATA':
-            seq_num = struct.unpack("!I", packet[4:8])[0]
-            encrypted_data = packet[8:]
-            try:
-                data = fernet.decrypt(encrypted_data)
-                if seq_num not in received:
-                    received[seq_num] = data
-                ack_packet = b'ACK!' + struct.pack("!I", seq_num)
-                udp_socket.sendto(ack_packet, (sender_ip, 50001))
-                console.print(f"[blue]RECEIVED:[/blue] Packet {seq_num}")
-            except Exception as e:
-                console.print(Panel(f"[red]Decryption error for packet {seq_num}: {e}[/red]", border_style="red"))
-
-        elif packet[:4] == b'END!':
-            if not end_received:
-                end_received = True
-                end_time = time.time()
-                ack_packet = b'EACK' + struct.pack("!I", 999999999)
-                udp_socket.sendto(ack_packet, (sender_ip, 50001))
-                console.print("[yellow]Received END! Waiting briefly for any final packets...[/yellow]")
-
-    with open(output_file, "wb") as f:
-        for i in sorted(received):
-            f.write(received[i])
-    udp_socket.close()
-    console.print(Panel("[bold green]\nFile received and saved successfully.[/bold green]", border_style="green"))
-
-# Run the appropriate role
-if IS_SENDER:
-    sender()
-else:
-    receiver()
+            pass
+        finally:
+            udp_socket.close()
+    received = {
+        "elapsed": time.monotonic() - started,
+        "rejected": pipeline.rejected,
+        "status": pipeline.status,
+        "batch": isinstance(pipeline.session, BatchReceiveSession),
+    }
+
+    if pipeline.rejected:
+        console.print(f"[yellow]{pipeline.rejected} packets failed authentication and were dropped.[/yellow]")
+    if pipeline.error:
+        console.print(Panel(f"[bold red]\nCould not decode the received file: {pipeline.error}[/bold red]", border_style="red"))
+        return False
+    if pipeline.session is not None and pipeline.status is False:
+        console.print(Panel("[bold red]\nChecksum mismatch: the received file is corrupt.[/bold red]", border_style="red"))
+        return False
+    if pipeline.session is not None and pipeline.status is None:
+        console.print(Panel("[bold red]\nTransfer incomplete: the sender never finished.[/bold red]", border_style="red"))
+        return False
+    if pipeline.session is None and pipeline.legacy_writer is None:
+        console.print(Panel("[bold yellow]\nNothing was received.[/bold yellow]", border_style="yellow"))
+        return False
+    if isinstance(pipeline.session, BatchReceiveSession):
+        entries, wanted = pipeline.session.plan[:2]
+        console.print(Panel(
+            f"[bold green]\n{len(wanted)} playlists received, {len(entries) - len(wanted)} already present, saved in {RECEIVE_DIR}/.[/bold green]",
+            border_style="green"
+        ))
+        paths = [os.path.join(RECEIVE_DIR, entry["name"]) for entry in entries]
+        # Only the files that came over the wire count towards goodput
+        received["bytes"] = sum(os.path.getsize(paths[index]) for index in wanted)
+        add_to_library(paths)
+    else:
+        console.print(Panel("[bold green]\nFile received and saved successfully.[/bold green]", border_style="green"))
+        received["bytes"] = os.path.getsize(output_file)
+        add_to_library([output_file])
+    metrics.transfer(received, "receiver")
+    return True
+
+def main():
+    load_keys()
+    console.clear()
+    console.print(Panel("[bold cyan]Secure Selective Repeat File Transfer (UDP + AES)[/bold cyan]", border_style="blue"))
+    is_sender = Prompt.ask("[bold magenta]Are you the sender? (y/n)[/bold magenta]").lower() == 'y'
+    # Run the appropriate role
+    metrics.start("send" if is_sender else "receive")
+    try:
+        return sender() if is_sender else receiver()
+    finally:
+        metrics_path = metrics.finish()
+        if metrics_path:
+            console.print(f"[dim]Run metrics written to {metrics_path}[/dim]")
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,34 @@
+import os
+import pytest
+from cryptography.fernet import Fernet
+import transfer_benchmark
+from framing import DATA, HEADER, is_v2, master_key, parse_header
+
+class CorruptingProxy(transfer_benchmark.LossyProxy):
+    # Flips one ciphertext byte in the first copy of one DATA packet, so it
+    # arrives whole but fails authentication
+    target_seq = None
+
+    def schedule(self, out_socket, packet, address):
+        if self.target_seq is not None and is_v2(packet):
+            ptype, _, seq = parse_header(packet)
+            if ptype == DATA and seq == self.target_seq:
+                CorruptingProxy.target_seq = None
+                packet = bytearray(packet)
+                packet[HEADER.size] ^= 0xFF
+                packet = bytes(packet)
+        super().schedule(out_socket, packet, address)
+
+@pytest.mark.parametrize("seq", [15, 16, 47, 63])
+def test_corrupted_chunk_is_resent(seq, tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer_benchmark, "LossyProxy", CorruptingProxy)
+    monkeypatch.setattr(CorruptingProxy, "target_seq", seq)
+    key = master_key(Fernet.generate_key())
+    payload = os.urandom(100 * 1024)
+    record = transfer_benchmark.run_transfer(
+        key, payload, 1024, 32, 0.5, {}, False, str(tmp_path), seed=1
+    )
+    assert CorruptingProxy.target_seq is None
+    assert record["confirmed"] is True
+    assert record["correct"]
+    assert record["retransmissions"] >= 1
@@ -0,0 +1,950 @@
+import os
+import time
+import heapq
+import queue
+import socket
+import struct
+import itertools
+import threading
+from cryptography.fernet import InvalidToken
+from dotenv import load_dotenv
+from compression import NONE, CompressionError, choose, decode_file, decode_offers, encode_offers
+from congestion import CongestionWindow, RttEstimator
+from file_chunks import BatchWriter, Bitmap, ChunkWriter
+from framing import (
+    ACK, DATA, END, END_ACK, FLAG_BATCH, HELLO, HELLO_ACK, MANIFEST, MANIFEST_PART, NACK,
+    NACK_LIMIT, WANT, FramingError, decode_nack, decode_sack, encode_nack, encode_sack, is_v2,
+    hello_ack_packet, hello_packet, new_salt, new_session_id, open_hello, open_hello_ack,
+    parse_header, sack_contains
+)
+from library import LibraryError
+from manifest import ManifestError, apply_batch, dump_manifest, load_manifest, plan_receive
+
+load_dotenv("credentials.env")
+WINDOW_SIZE = 4
+MAX_WINDOW = int(os.getenv("MAX_WINDOW", "1024"))
+TIMEOUT = 2
+MAX_ATTEMPTS = 12
+HELLO_ATTEMPTS = 3
+HELLO_TIMEOUT = 0.5
+ACK_DELAY = 0.005
+ACK_EVERY = 16
+REORDER_THRESHOLD = 3
+END_LINGER = 2.0
+LEGACY_END_WAIT = 5
+LISTEN_INTERVAL = 0.2
+MANIFEST_TIMEOUT = 0.5
+LEGACY_END_LINGER = 3
+RECV_BUFFER = int(os.getenv("RECV_BUFFER", str(8 << 20)))
+DECRYPT_WORKERS = int(os.getenv("DECRYPT_WORKERS", str(os.cpu_count() or 2)))
+QUEUE_SIZE = 4096
+PROGRESS_INTERVAL = 0.1
+# Receivers join this group and fan-out senders send each new chunk to it
+# once; leave unset where the network does not route multicast
+MULTICAST_GROUP = os.getenv("MULTICAST_GROUP")
+MULTICAST_TTL = int(os.getenv("MULTICAST_TTL", "1"))
+
+class TransferFailed(Exception):
+    pass
+
+class SendSession:
+    # Selective repeat sender for one file to one receiver. With a framer,
+    # and the reply framer the receiver's HELLO_ACK set up, it speaks v2
+    # (SACK/NACK, digest-confirmed END); without one it falls back to the
+    # legacy Fernet packets and per-packet ACKs.
+    def __init__(self, udp_socket, address, source, chunk_size, framer=None, reply_framer=None, fernet=None, window_size=WINDOW_SIZE, timeout=TIMEOUT):
+        self.socket = udp_socket
+        self.address = address
+        self.source = source
+        self.chunk_size = chunk_size
+        self.framer = framer
+        self.reply_framer = reply_framer
+        self.fernet = fernet
+        self.total = source.chunk_count(chunk_size)
+        # Everything below is guarded by `state`; the listener notifies it so
+        # the send loop sleeps until an ACK arrives or the next timer is due
+        self.state = threading.Condition()
+        self.base = 0
+        self.next_seq = 0
+        self.acknowledged = set()
+        self.in_flight = {}
+        self.timers = []
+        self.nacked = []
+        self.free_buffers = []
+        self.rtt = RttEstimator(timeout)
+        self.window = CongestionWindow(window_size, MAX_WINDOW)
+        self.sent = 0
+        self.retransmissions = 0
+        self.fast_retransmissions = 0
+        self.confirmed = None
+        self.stopped = threading.Event()
+
+    def build_packet(self, seq):
+        chunk = self.source.chunk(seq, self.chunk_size)
+        if self.framer is None:
+            return struct.pack("!4sI", b'DATA', seq) + self.fernet.encrypt(bytes(chunk))
+        buffer = self.free_buffers.pop() if self.free_buffers else self.framer.packet_buffer(self.chunk_size)
+        return self.framer.seal_into(buffer, DATA, seq, chunk)
+
+    def transmit(self, seq, attempts, packet):
+        self.socket.sendto(packet, self.address)
+        self.sent += 1
+        sent_at = time.monotonic()
+        self.in_flight[seq] = (sent_at, attempts, packet)
+        heapq.heappush(self.timers, (sent_at + self.rtt.rto, seq, attempts))
+
+    def retransmit(self, seq):
+        _, attempts, packet = self.in_flight[seq]
+        if attempts >= MAX_ATTEMPTS:
+            raise TransferFailed(f"Packet {seq} was never acknowledged")
+        self.window.on_loss(self.rtt.srtt or self.rtt.rto)
+        self.retransmissions += 1
+        self.transmit(seq, attempts + 1, packet)
+
+    def on_ack(self, seq):
+        if seq in self.acknowledged or seq not in self.in_flight:
+            return
+        self.acknowledged.add(seq)
+        sent_at, attempts, packet = self.in_flight.pop(seq)
+        if self.framer is not None:
+            self.free_buffers.append(packet.obj)
+        if attempts == 1:
+            # Karn's algorithm: retransmitted packets give ambiguous samples
+            self.rtt.sample(time.monotonic() - sent_at)
+        self.window.on_ack()
+        while self.base in self.acknowledged:
+            self.acknowledged.discard(self.base)
+            self.base += 1
+
+    def on_sack(self, sack):
+        for seq in [seq for seq in self.in_flight if sack_contains(sack, seq)]:
+            self.on_ack(seq)
+
+    def on_nack(self, holes):
+        # Skip holes retransmitted less than a round trip ago: the NACK may
+        # predate that retransmission
+        now = time.monotonic()
+        for seq in holes:
+            if seq in self.in_flight and now - self.in_flight[seq][0] >= (self.rtt.srtt or 0):
+                self.nacked.append(seq)
+
+    def handle(self, packet):
+        if self.framer is not None and is_v2(packet):
+            try:
+                ptype, _, payload = self.reply_framer.open(packet)
+            except FramingError:
+                return
+            if ptype == ACK:
+                self.on_sack(decode_sack(payload))
+            elif ptype == NACK:
+                self.on_nack(decode_nack(payload))
+            elif ptype == END_ACK:
+                self.confirmed = payload[:1] == b"\x01"
+        elif packet[:4] == b'ACK!':
+            self.on_ack(struct.unpack("!I", packet[4:8])[0])
+        elif packet[:4] == b'EACK':
+            self.confirmed = True
+
+    def listen(self):
+        self.socket.settimeout(LISTEN_INTERVAL)
+        while not self.stopped.is_set():
+            try:
+                packet, _ = self.socket.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self.state:
+                self.handle(packet)
+                self.state.notify()
+
+    def send_window(self):
+        while self.next_seq < self.total and self.next_seq < self.base + MAX_WINDOW and len(self.in_flight) < int(self.window):
+            self.transmit(self.next_seq, 1, self.build_packet(self.next_seq))
+            self.next_seq += 1
+        while self.nacked:
+            seq = self.nacked.pop()
+            if seq in self.in_flight:
+                self.fast_retransmissions += 1
+                self.retransmit(seq)
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, seq, attempts = heapq.heappop(self.timers)
+            if seq not in self.in_flight or self.in_flight[seq][1] != attempts:
+                continue
+            if seq == self.base:
+                # Back off once per stalled window, not once per lost packet
+                self.rtt.backoff()
+            self.retransmit(seq)
+        return max(0.0, self.timers[0][0] - now) if self.timers else None
+
+    def finish(self):
+        if self.framer is None:
+            end_packet = struct.pack("!4sI", b'END!', 999999999)
+            for _ in range(3):
+                self.socket.sendto(end_packet, self.address)
+            self.state.wait_for(lambda: self.confirmed is not None, timeout=LEGACY_END_WAIT)
+            return
+        end_packet = self.framer.seal(END, self.total, self.source.digest())
+        for _ in range(MAX_ATTEMPTS):
+            self.socket.sendto(end_packet, self.address)
+            if self.state.wait_for(lambda: self.confirmed is not None, timeout=self.rtt.rto):
+                return
+            self.rtt.backoff()
+
+    def run(self, progress=None, task=None):
+        started = time.monotonic()
+        listener = threading.Thread(target=self.listen, daemon=True)
+        listener.start()
+        try:
+            with self.state:
+                while self.base < self.total:
+                    delay = self.send_window()
+                    if progress is not None:
+                        progress.update(task, completed=self.base)
+                    self.state.wait(timeout=delay)
+                if progress is not None:
+                    progress.update(task, completed=self.total)
+                self.finish()
+        finally:
+            self.stopped.set()
+            listener.join()
+        return {
+            "packets": self.total,
+            "sent": self.sent,
+            "retransmissions": self.retransmissions,
+            "fast_retransmissions": self.fast_retransmissions,
+            "elapsed": time.monotonic() - started,
+            "bytes": self.source.size,
+            "confirmed": self.confirmed,
+        }
+
+class FanoutPeer:
+    def __init__(self, address, reply_framer, unicast):
+        self.address = address
+        self.reply_framer = reply_framer
+        self.unicast = unicast
+        self.reached = False
+        self.base = 0
+        self.acknowledged = set()
+        self.in_flight = {}
+        self.nacked = []
+        self.rtt = RttEstimator(TIMEOUT)
+        self.window = CongestionWindow(WINDOW_SIZE, MAX_WINDOW)
+        self.retransmissions = 0
+        self.confirmed = None
+        self.failed = None
+
+class FanoutSession:
+    # Sends one payload to several receivers that joined the same v2 session.
+    # Each chunk is sealed once and the same packet goes to every receiver,
+    # or once to a multicast group; ACK state, timers and congestion windows
+    # are kept per receiver so a retransmission only reaches the receivers
+    # still missing that chunk. New chunks go out at the pace of the slowest
+    # receiver, and one that stops answering is dropped instead of holding
+    # the others back. receivers maps each address to the reply framer its
+    # HELLO_ACK set up.
+    def __init__(self, udp_socket, receivers, source, chunk_size, framer, multicast=None):
+        self.socket = udp_socket
+        self.source = source
+        self.chunk_size = chunk_size
+        self.framer = framer
+        self.multicast = multicast
+        self.total = source.chunk_count(chunk_size)
+        self.peers = [FanoutPeer(address, reply_framer, multicast is None) for address, reply_framer in receivers.items()]
+        self.by_ip = {peer.address[0]: peer for peer in self.peers}
+        self.state = threading.Condition()
+        self.next_seq = 0
+        # Sealed packets stay cached until every receiver has acknowledged
+        # them; `missing` counts the receivers still waiting for each one
+        self.packets = {}
+        self.missing = {}
+        self.free_buffers = []
+        self.timers = []
+        self.sent = 0
+        self.retransmissions = 0
+        self.fast_retransmissions = 0
+        self.stopped = threading.Event()
+
+    def active(self):
+        return [peer for peer in self.peers if peer.failed is None]
+
+    @property
+    def base(self):
+        return min((peer.base for peer in self.active()), default=self.total)
+
+    def build_packet(self, seq):
+        buffer = self.free_buffers.pop() if self.free_buffers else self.framer.packet_buffer(self.chunk_size)
+        return self.framer.seal_into(buffer, DATA, seq, self.source.chunk(seq, self.chunk_size))
+
+    def track(self, peer, seq, attempts, sent_at):
+        peer.in_flight[seq] = (sent_at, attempts)
+        heapq.heappush(self.timers, (sent_at + peer.rtt.rto, id(peer), seq, attempts))
+
+    def release(self, seq):
+        self.missing[seq] -= 1
+        if not self.missing[seq]:
+            del self.missing[seq]
+            self.free_buffers.append(self.packets.pop(seq).obj)
+
+    def has_room(self, peer):
+        return len(peer.in_flight) < int(peer.window) and self.next_seq < peer.base + MAX_WINDOW
+
+    def send_new(self, active):
+        seq = self.next_seq
+        packet = self.build_packet(seq)
+        self.packets[seq] = packet
+        self.missing[seq] = len(active)
+        if not all(peer.unicast for peer in active):
+            self.socket.sendto(packet, self.multicast)
+            self.sent += 1
+        sent_at = time.monotonic()
+        for peer in active:
+            if peer.unicast:
+                self.socket.sendto(packet, peer.address)
+                self.sent += 1
+            self.track(peer, seq, 1, sent_at)
+        self.next_seq += 1
+
+    def retransmit(self, peer, seq):
+        _, attempts = peer.in_flight[seq]
+        if attempts >= MAX_ATTEMPTS:
+            self.drop(peer, f"packet {seq} was never acknowledged")
+            return
+        if not peer.reached:
+            # Nothing sent to the group has arrived; the multicast route
+            # does not reach this receiver, so address it directly
+            peer.unicast = True
+        peer.window.on_loss(peer.rtt.srtt or peer.rtt.rto)
+        peer.retransmissions += 1
+        self.retransmissions += 1
+        self.socket.sendto(self.packets[seq], peer.address)
+        self.sent += 1
+        self.track(peer, seq, attempts + 1, time.monotonic())
+
+    def drop(self, peer, reason):
+        peer.failed = reason
+        for seq in peer.in_flight:
+            self.release(seq)
+        peer.in_flight.clear()
+        peer.nacked.clear()
+
+    def on_ack(self, peer, seq):
+        if seq in peer.acknowledged or seq not in peer.in_flight:
+            return
+        peer.acknowledged.add(seq)
+        peer.reached = True
+        sent_at, attempts = peer.in_flight.pop(seq)
+        self.release(seq)
+        if attempts == 1:
+            peer.rtt.sample(time.monotonic() - sent_at)
+        peer.window.on_ack()
+        while peer.base in peer.acknowledged:
+            peer.acknowledged.discard(peer.base)
+            peer.base += 1
+
+    def handle(self, packet, addr):
+        peer = self.by_ip.get(addr[0])
+        if peer is None or peer.failed is not None or not is_v2(packet):
+            return
+        try:
+            ptype, _, payload = peer.reply_framer.open(packet)
+        except FramingError:
+            return
+        if ptype == ACK:
+            sack = decode_sack(payload)
+            for seq in [seq for seq in peer.in_flight if sack_contains(sack, seq)]:
+                self.on_ack(peer, seq)
+        elif ptype == NACK:
+            now = time.monotonic()
+            for seq in decode_nack(payload):
+                if seq in peer.in_flight and now - peer.in_flight[seq][0] >= (peer.rtt.srtt or 0):
+                    peer.nacked.append(seq)
+        elif ptype == END_ACK:
+            peer.confirmed = payload[:1] == b"\x01"
+
+    def listen(self):
+        self.socket.settimeout(LISTEN_INTERVAL)
+        while not self.stopped.is_set():
+            try:
+                packet, addr = self.socket.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self.state:
+                self.handle(packet, addr)
+                self.state.notify()
+
+    def send_window(self):
+        active = self.active()
+        while self.next_seq < self.total and active and all(self.has_room(peer) for peer in active):
+            self.send_new(active)
+        for peer in active:
+            while peer.nacked and peer.failed is None:
+                seq = peer.nacked.pop()
+                if seq in peer.in_flight:
+                    self.fast_retransmissions += 1
+                    self.retransmit(peer, seq)
+        peers = {id(peer): peer for peer in self.peers}
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, peer_id, seq, attempts = heapq.heappop(self.timers)
+            peer = peers[peer_id]
+            if peer.failed is not None or seq not in peer.in_flight or peer.in_flight[seq][1] != attempts:
+                continue
+            if seq == peer.base:
+                peer.rtt.backoff()
+            self.retransmit(peer, seq)
+        return max(0.0, self.timers[0][0] - now) if self.timers else None
+
+    def finish(self):
+        end_packet = self.framer.seal(END, self.total, self.source.digest())
+        for _ in range(MAX_ATTEMPTS):
+            waiting = [peer for peer in self.active() if peer.confirmed is None]
+            if not waiting:
+                return
+            for peer in waiting:
+                self.socket.sendto(end_packet, peer.address)
+            rto = max(peer.rtt.rto for peer in waiting)
+            self.state.wait_for(lambda: all(peer.confirmed is not None for peer in waiting), timeout=rto)
+            for peer in waiting:
+                peer.rtt.backoff()
+
+    def run(self, progress=None, task=None):
+        started = time.monotonic()
+        listener = threading.Thread(target=self.listen, daemon=True)
+        listener.start()
+        try:
+            with self.state:
+                while self.base < self.total:
+                    delay = self.send_window()
+                    if progress is not None:
+                        progress.update(task, completed=self.base)
+                    self.state.wait(timeout=delay)
+                if progress is not None:
+                    progress.update(task, completed=self.total)
+                self.finish()
+        finally:
+            self.stopped.set()
+            listener.join()
+        return {
+            "packets": self.total,
+            "sent": self.sent,
+            "retransmissions": self.retransmissions,
+            "fast_retransmissions": self.fast_retransmissions,
+            "elapsed": time.monotonic() - started,
+            "bytes": self.source.size,
+            "peers": [
+                {
+                    "address": peer.address,
+                    "confirmed": peer.confirmed,
+                    "retransmissions": peer.retransmissions,
+                    "failed": peer.failed,
+                }
+                for peer in self.peers
+            ],
+        }
+
+def join_multicast(udp_socket, group):
+    membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0"))
+    udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+def negotiate(udp_socket, key, receiver_ips, chunk_size, file_size, encoded=(), flags=0, port=50000):
+    # Sends the same HELLO to every receiver, so they all share one session
+    # key, and returns the framer with the codec each receiver picked from
+    # our offers and the reply framer for what it sends back. Receivers that
+    # only speak the legacy format never answer.
+    framer, hello = hello_packet(
+        key, new_salt(), new_session_id(), chunk_size, file_size, encode_offers(encoded), flags
+    )
+    # Replies come from addresses, while peers.txt may hold host names
+    targets = {socket.gethostbyname(ip): ip for ip in receiver_ips}
+    codecs = {}
+    replies = {}
+    udp_socket.settimeout(HELLO_TIMEOUT)
+    try:
+        for _ in range(HELLO_ATTEMPTS):
+            for address, ip in targets.items():
+                if ip not in codecs:
+                    udp_socket.sendto(hello, (address, port))
+            try:
+                while len(codecs) < len(targets):
+                    reply, addr = udp_socket.recvfrom(2048)
+                    if addr[0] not in targets or not is_v2(reply) or parse_header(reply)[0] != HELLO_ACK:
+                        continue
+                    try:
+                        reply_framer, codec = open_hello_ack(framer, reply)
+                    except FramingError:
+                        continue
+                    replies[targets[addr[0]]] = reply_framer
+                    codecs[targets[addr[0]]] = codec if codec in dict(encoded) else NONE
+            except socket.timeout:
+                continue
+            if len(codecs) == len(targets):
+                break
+        return framer, codecs, replies
+    finally:
+        udp_socket.settimeout(None)
+
+def send_manifest(udp_socket, address, framer, reply_framer, entries, chunk_size):
+    # Repeats the manifest until the receiver answers with the indices of
+    # the files it still needs
+    data = dump_manifest(entries)
+    step = chunk_size - MANIFEST_PART.size
+    parts = [data[offset:offset + step] for offset in range(0, len(data), step)]
+    if len(parts) > 0xFFFF:
+        raise TransferFailed("Batch manifest is too large")
+    packets = [
+        framer.seal(MANIFEST, index, MANIFEST_PART.pack(len(parts)) + part) for index, part in enumerate(parts)
+    ]
+    udp_socket.settimeout(MANIFEST_TIMEOUT)
+    try:
+        for _ in range(MAX_ATTEMPTS):
+            for packet in packets:
+                udp_socket.sendto(packet, address)
+            try:
+                while True:
+                    reply, _ = udp_socket.recvfrom(65535)
+                    if not is_v2(reply):
+                        continue
+                    try:
+                        ptype, _, payload = reply_framer.open(reply)
+                    except FramingError:
+                        continue
+                    if ptype == WANT:
+                        return [
+                            index for index in range(len(entries))
+                            if index >> 3 < len(payload) and payload[index >> 3] & (1 << (index & 7))
+                        ]
+            except socket.timeout:
+                continue
+    finally:
+        udp_socket.settimeout(None)
+    raise TransferFailed("Receiver never answered the batch manifest")
+
+class ReceiveSession:
+    # Receiver half of a v2 transfer. accept() runs on the socket path and
+    # spots holes and duplicates from the header alone, open() decrypts and
+    # may run on any thread, and deliver() writes the chunk from a single
+    # thread. A chunk only counts as received, and is only SACKed, once it
+    # has authenticated: the sender forgets SACKed chunks, so one that then
+    # failed could never be resent. END is only confirmed once every chunk
+    # is written, the digest matches and finalize (decoding a compressed
+    # payload) succeeds.
+    def __init__(self, framer, writer, reply, codec=NONE, finalize=None):
+        self.framer = framer
+        self.writer = writer
+        self.reply = reply
+        self.codec = codec
+        self.finalize = finalize
+        self.output_file = writer.path if writer is not None else None
+        self.lock = threading.Lock()
+        self.seen = Bitmap(writer.received.size if writer is not None else 0)
+        # Chunks that arrived, verified or still queued for decrypting
+        self.arrived = Bitmap(self.seen.size)
+        # What this receiver sends back is sealed under its own key, so
+        # receivers sharing a fan-out session never share a nonce; HELLO_ACK
+        # takes sequence 0 and carries the salt to the sender
+        self.replies = framer.reply_framer(new_salt())
+        self.control_seq = itertools.count(1)
+        self.highest = -1
+        self.nacked_upto = 0
+        self.pending = 0
+        self.last_ack = 0.0
+        self.rejected = 0
+        self.error = None
+        self.end_digest = None
+        self.status = None
+        self.finished_at = None
+
+    def seal_control(self, ptype, payload):
+        # ACK/NACK payloads differ every time, so each one takes a fresh
+        # sequence number to keep its nonce unique
+        return self.replies.seal(ptype, next(self.control_seq), payload)
+
+    def hello_ack(self):
+        return hello_ack_packet(self.replies, self.codec)
+
+    def accept(self, packet):
+        # Returns whether the packet still needs decrypting
+        ptype, _, seq = parse_header(packet)
+        if ptype == END:
+            return True
+        if ptype != DATA or seq >= self.seen.size:
+            return False
+        with self.lock:
+            if not self.arrived.add(seq):
+                # A duplicate means our last SACK was probably lost
+                self.send_sack()
+                return False
+            if seq > self.highest:
+                self.report_holes(seq)
+                self.highest = seq
+        return True
+
+    def open(self, packet):
+        try:
+            opened = self.framer.open(packet)
+        except FramingError:
+            ptype, _, seq = parse_header(packet)
+            with self.lock:
+                self.rejected += 1
+                if ptype == DATA and seq < self.arrived.size:
+                    # Never SACKed, so the sender still holds it; ask for it
+                    # again now rather than waiting for its timer
+                    self.arrived.discard(seq)
+                    self.nacked_upto = min(self.nacked_upto, seq)
+                    self.reply(self.seal_control(NACK, encode_nack([seq])))
+            return None
+        ptype, seq, _ = opened
+        if ptype == DATA:
+            with self.lock:
+                if self.seen.add(seq):
+                    self.pending += 1
+                    if self.pending >= ACK_EVERY:
+                        self.send_sack()
+        return opened
+
+    def deliver(self, ptype, seq, payload):
+        # Returns whether a new chunk was written
+        if ptype == DATA:
+            written = self.writer.write(seq, payload)
+            if written and self.end_digest is not None and self.writer.complete():
+                self.confirm()
+            return written
+        if ptype == END:
+            self.end_digest = payload
+            if self.writer.complete():
+                self.confirm()
+            else:
+                with self.lock:
+                    self.send_sack()
+        return False
+
+    def report_holes(self, seq):
+        limit = seq - REORDER_THRESHOLD + 1
+        start = max(self.nacked_upto, self.arrived.cumulative())
+        holes = [hole for hole in range(start, limit) if hole not in self.arrived]
+        self.nacked_upto = max(self.nacked_upto, limit)
+        for offset in range(0, len(holes), NACK_LIMIT):
+            self.reply(self.seal_control(NACK, encode_nack(holes[offset:offset + NACK_LIMIT])))
+
+    def send_sack(self):
+        self.reply(self.seal_control(ACK, encode_sack(self.seen)))
+        self.pending = 0
+        self.last_ack = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            if self.pending and time.monotonic() - self.last_ack >= ACK_DELAY:
+                self.send_sack()
+
+    def confirm(self):
+        if self.status is None:
+            self.status = self.writer.digest() == self.end_digest and (self.finalize is None or self.finalize())
+            self.finished_at = time.monotonic()
+        self.reply(self.seal_control(END_ACK, b"\x01" if self.status else b"\x00"))
+
+    def done(self):
+        # Linger after confirming so a lost END_ACK can be answered again
+        return self.finished_at is not None and time.monotonic() - self.finished_at > END_LINGER
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def abandon(self):
+        # Drops whatever an unfinished transfer left behind
+        self.close()
+        if self.writer is not None and os.path.exists(self.writer.path):
+            os.remove(self.writer.path)
+
+class CompressedReceiveSession(ReceiveSession):
+    # The payload lands next to the output and is decoded into it before
+    # END is confirmed
+    def __init__(self, framer, reply, codec, output_file, chunk_size, encoded_size):
+        writer = ChunkWriter(output_file + ".part", chunk_size, encoded_size)
+        super().__init__(framer, writer, reply, codec, self.decode)
+        self.output_file = output_file
+
+    def decode(self):
+        try:
+            decode_file(self.codec, self.writer.path, self.output_file)
+        except (CompressionError, OSError) as e:
+            self.error = str(e)
+            return False
+        return True
+
+    def close(self):
+        super().close()
+        if self.status and os.path.exists(self.writer.path):
+            os.remove(self.writer.path)
+
+class BatchReceiveSession(ReceiveSession):
+    # Manifest first, then the files the receiver still needs over one
+    # shared window. The writer only exists once the manifest is complete;
+    # finished files are moved into the directory before END is confirmed.
+    def __init__(self, framer, reply, codec, directory, chunk_size, library=None):
+        super().__init__(framer, None, reply, codec, self.apply)
+        self.directory = directory
+        self.library = library
+        self.chunk_size = chunk_size
+        self.manifest_parts = {}
+        self.plan = None
+        self.want_packet = None
+
+    def accept(self, packet):
+        if parse_header(packet)[0] == MANIFEST:
+            return True
+        return self.writer is not None and super().accept(packet)
+
+    def deliver(self, ptype, seq, payload):
+        if ptype != MANIFEST:
+            return super().deliver(ptype, seq, payload)
+        if self.want_packet is None:
+            self.on_manifest_part(seq, payload)
+        # Answer repeats too: they mean the sender missed our WANT
+        if self.want_packet is not None:
+            self.reply(self.want_packet)
+        return False
+
+    def on_manifest_part(self, seq, payload):
+        total = MANIFEST_PART.unpack_from(payload)[0]
+        self.manifest_parts[seq] = payload[MANIFEST_PART.size:]
+        if any(index not in self.manifest_parts for index in range(total)):
+            return
+        try:
+            entries = load_manifest(b"".join(self.manifest_parts[index] for index in range(total)))
+        except ManifestError as e:
+            self.error = str(e)
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        wanted, local_copies, batch_copies = plan_receive(entries, self.directory, self.library)
+        self.plan = (entries, wanted, local_copies, batch_copies)
+        writer = BatchWriter(
+            [os.path.join(self.directory, f"{entries[index]['name']}.{self.framer.session_id:08x}.part") for index in wanted],
+            self.chunk_size, [entries[index]["encoded"] for index in wanted]
+        )
+        want = Bitmap(len(entries))
+        for index in wanted:
+            want.add(index)
+        with self.lock:
+            # The reader checks writer before touching seen
+            self.seen = Bitmap(writer.received.size)
+            self.arrived = Bitmap(writer.received.size)
+            self.writer = writer
+        self.want_packet = self.replies.seal(WANT, 0, bytes(want.bits))
+
+    def apply(self):
+        entries, wanted, local_copies, batch_copies = self.plan
+        try:
+            apply_batch(entries, wanted, self.writer.paths, local_copies, batch_copies, self.directory)
+        except (CompressionError, ManifestError, LibraryError, OSError) as e:
+            self.error = str(e)
+            return False
+        return True
+
+    def abandon(self):
+        # BatchWriter removes its staging files on close
+        self.close()
+
+def start_session(hello, reply, output_file, directory, library=None):
+    # Picks the session type for an opened HELLO: a batch into directory,
+    # or a single file into output_file, compressed or not. Batches skip
+    # files whose content is already in library.
+    framer, chunk_size, file_size, flags, offers = hello
+    codec, encoded_size = choose(decode_offers(offers))
+    if flags & FLAG_BATCH:
+        return BatchReceiveSession(framer, reply, codec, directory, chunk_size, library)
+    if codec == NONE:
+        return ReceiveSession(framer, ChunkWriter(output_file, chunk_size, file_size), reply)
+    return CompressedReceiveSession(framer, reply, codec, output_file, chunk_size, encoded_size)
+
+class ReceivePipeline:
+    # Receives from one sender in three stages: this thread drains the socket
+    # and acknowledges straight away, a pool of workers decrypts and verifies,
+    # and a single writer puts chunks in place. A slow decrypt or disk write
+    # then queues up here instead of overflowing the kernel socket buffer.
+    def __init__(self, udp_socket, sender, key, fernet, output_file, legacy_chunk_size, directory, workers=DECRYPT_WORKERS, library=None):
+        self.socket = udp_socket
+        self.sender = sender
+        self.key = key
+        self.fernet = fernet
+        self.output_file = output_file
+        self.directory = directory
+        self.library = library
+        self.legacy_chunk_size = legacy_chunk_size
+        self.workers = max(1, workers)
+        self.decrypt_queue = queue.Queue(QUEUE_SIZE)
+        self.write_queue = queue.Queue(QUEUE_SIZE)
+        self.session = None
+        self.sessions = []
+        self.legacy_writer = None
+        self.legacy_end = None
+        self.legacy_rejected = 0
+        self.progress = None
+        self.task = None
+        self.stopped = threading.Event()
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        except OSError:
+            pass
+
+    @property
+    def status(self):
+        return self.session.status if self.session is not None else None
+
+    @property
+    def error(self):
+        return self.session.error if self.session is not None else None
+
+    @property
+    def rejected(self):
+        return self.legacy_rejected + sum(session.rejected for session in self.sessions)
+
+    def reply(self, packet):
+        self.socket.sendto(packet, self.sender)
+
+    def run(self, progress=None, task=None):
+        self.progress = progress
+        self.task = task
+        workers = [threading.Thread(target=self.decrypt, daemon=True) for _ in range(self.workers)]
+        writer = threading.Thread(target=self.write, daemon=True)
+        for thread in workers + [writer]:
+            thread.start()
+        try:
+            self.read()
+        finally:
+            for _ in workers:
+                self.decrypt_queue.put(None)
+            for thread in workers:
+                thread.join()
+            self.write_queue.put(None)
+            writer.join()
+            # Sessions a renegotiation replaced are gone already; one that
+            # never finished was aborted
+            if self.session is not None:
+                if self.session.status is None:
+                    self.session.abandon()
+                else:
+                    self.session.close()
+            if self.legacy_writer is None and self.legacy_end is not None:
+                self.legacy_writer = ChunkWriter(self.output_file, self.legacy_chunk_size)
+            if self.legacy_writer is not None:
+                self.legacy_writer.close()
+
+    def read(self):
+        while not self.stopped.is_set():
+            session = self.session
+            # Wake up in time to flush a coalesced SACK
+            self.socket.settimeout(ACK_DELAY if session is not None and session.pending else LISTEN_INTERVAL)
+            try:
+                packet, addr = self.socket.recvfrom(65535)
+                if addr[0] == self.sender[0]:
+                    self.dispatch(packet)
+            except socket.timeout:
+                pass
+            if self.session is not None:
+                self.session.flush()
+                if self.session.done():
+                    return
+            if self.legacy_end is not None and time.monotonic() - self.legacy_end > LEGACY_END_LINGER:
+                return
+
+    def dispatch(self, packet):
+        if is_v2(packet):
+            if parse_header(packet)[0] == HELLO:
+                self.on_hello(packet)
+            elif self.session is not None and self.session.accept(packet):
+                self.decrypt_queue.put((self.session, packet))
+        elif packet[:4] == b'DATA':
+            self.decrypt_queue.put((None, packet))
+        elif packet[:4] == b'END!':
+            if self.legacy_end is None:
+                self.legacy_end = time.monotonic()
+            self.reply(b'EACK' + struct.pack("!I", 999999999))
+
+    def on_hello(self, packet):
+        try:
+            hello = open_hello(self.key, packet)
+        except FramingError:
+            self.legacy_rejected += 1
+            return
+        if self.session is None or self.session.framer.session_id != hello[0].session_id:
+            if self.session is not None:
+                self.retire(self.session)
+            session = start_session(hello, self.reply, self.output_file, self.directory, self.library)
+            self.session = session
+            self.sessions.append(session)
+            if self.progress is not None:
+                self.progress.update(self.task, total=session.seen.size, completed=0)
+        self.reply(self.session.hello_ack())
+
+    def retire(self, session):
+        # A sender that renegotiates starts over under a new session id,
+        # possibly into the same files, so what the old session left behind
+        # goes before the new one opens them. The writer does it, after the
+        # old session's last queued chunk.
+        self.session = None
+        retired = threading.Event()
+        self.write_queue.put((session, None, retired, None))
+        retired.wait()
+
+    def decrypt(self):
+        while True:
+            item = self.decrypt_queue.get()
+            if item is None:
+                return
+            session, packet = item
+            if session is not None:
+                opened = session.open(packet)
+                if opened is not None:
+                    self.write_queue.put((session,) + opened)
+                continue
+            seq = struct.unpack("!I", packet[4:8])[0]
+            try:
+                data = self.fernet.decrypt(packet[8:])
+            except InvalidToken:
+                self.legacy_rejected += 1
+                continue
+            # Legacy senders take every ACK as final, so only acknowledge
+            # once the token has been verified
+            self.reply(b'ACK!' + struct.pack("!I", seq))
+            self.write_queue.put((None, DATA, seq, data))
+
+    def write(self):
+        written = 0
+        shown_at = 0.0
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            session, ptype, seq, payload = item
+            if ptype is None:
+                if session.status:
+                    session.close()
+                else:
+                    session.abandon()
+                seq.set()
+                continue
+            if session is None:
+                if self.legacy_writer is None:
+                    # Legacy senders announce no size; chunks are fixed
+                    self.legacy_writer = ChunkWriter(self.output_file, self.legacy_chunk_size)
+                new = self.legacy_writer.write(seq, payload)
+            elif session is self.session:
+                new = session.deliver(ptype, seq, payload)
+            else:
+                continue
+            written += new
+            if self.progress is not None and time.monotonic() - shown_at >= PROGRESS_INTERVAL:
+                self.show_progress(written)
+                shown_at = time.monotonic()
+        if self.progress is not None:
+            self.show_progress(written)
+
+    def show_progress(self, written):
+        # Batch sessions only learn their size once the manifest is in
+        total = self.session.seen.size if self.session is not None else None
+        self.progress.update(self.task, total=total, completed=written)
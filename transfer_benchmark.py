@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import select
+import socket
+import hashlib
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import subprocess
+from cryptography.fernet import Fernet
+from rich.console import Console
+from rich.table import Table
+from compression import NONE, encodings
+from file_chunks import MemorySource
+from framing import master_key
+from transfer import RECV_BUFFER, ReceivePipeline, SendSession, TransferFailed, negotiate
+
+# Runs the transfer protocol against itself over 127.0.0.1 through a proxy
+# that drops, delays, duplicates and reorders datagrams, and writes one JSON
+# record per run so results can be compared across versions.
+
+console = Console()
+REORDER_HOLD = 0.005
+STOP_TIMEOUT = 5
+
+class LossyProxy:
+    # Sits between the sender and the receiver; the sender talks to `front`,
+    # the receiver sees `back` as the sender. Both directions are impaired,
+    # so ACKs get lost as well as data.
+    def __init__(self, target, loss=0.0, delay=0.0, jitter=0.0, duplicate=0.0, reorder=0.0, seed=None):
+        self.target = target
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.front = bound_socket()
+        self.back = bound_socket()
+        self.client = None
+        self.pending = []
+        self.counter = 0
+        self.stats = {"forwarded": 0, "dropped": 0, "duplicated": 0, "reordered": 0}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def address(self):
+        return self.front.getsockname()
+
+    @property
+    def sender_address(self):
+        return self.back.getsockname()
+
+    def schedule(self, out_socket, packet, address):
+        if self.random.random() < self.loss:
+            self.stats["dropped"] += 1
+            return
+        copies = 1
+        if self.random.random() < self.duplicate:
+            self.stats["duplicated"] += 1
+            copies = 2
+        now = time.monotonic()
+        for _ in range(copies):
+            due = now + self.delay + self.random.uniform(0, self.jitter)
+            if self.random.random() < self.reorder:
+                # Held back long enough for the packets behind it to overtake
+                self.stats["reordered"] += 1
+                due += self.jitter + REORDER_HOLD
+            self.counter += 1
+            heapq.heappush(self.pending, (due, self.counter, out_socket, packet, address))
+
+    def run(self):
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            while self.pending and self.pending[0][0] <= now:
+                _, _, out_socket, packet, address = heapq.heappop(self.pending)
+                try:
+                    out_socket.sendto(packet, address)
+                    self.stats["forwarded"] += 1
+                except OSError:
+                    pass
+            timeout = max(0.0, self.pending[0][0] - now) if self.pending else 0.1
+            ready, _, _ = select.select([self.front, self.back], [], [], timeout)
+            for sock in ready:
+                packet, addr = sock.recvfrom(65535)
+                if sock is self.front:
+                    self.client = addr
+                    self.schedule(self.back, packet, self.target)
+                elif self.client is not None:
+                    self.schedule(self.front, packet, self.client)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.front.close()
+        self.back.close()
+
+def bound_socket():
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Loss should come from the emulator, not from a full socket buffer
+    try:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+    except OSError:
+        pass
+    udp_socket.bind(("127.0.0.1", 0))
+    return udp_socket
+
+def sample_playlist(size, seed=None):
+    # Playlist JSON in the layout get_playlist.py writes, grown to `size` bytes
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    tracks = []
+    playlist = {"name": "Benchmark", "tracks": tracks}
+    length = 0
+    while length < size:
+        track = {
+            "name": " ".join(rng.choice(["Love", "Night", "Blue", "Fire", "Road", "Home", "Dream"]) for _ in range(3)),
+            "artist": rng.choice(["The Echoes", "Nova", "Lina Park", "Static Bloom"]),
+            "album": "Unknown",
+            "spotify_id": "https://open.spotify.com/track/" + "".join(rng.choice(alphabet) for _ in range(22)),
+            "youtube_music_id": "https://music.youtube.com/watch?v=" + "".join(rng.choice(alphabet) for _ in range(11)),
+        }
+        tracks.append(track)
+        length += len(json.dumps(track, indent=4)) + 10
+    return json.dumps(playlist, indent=4).encode()
+
+def run_transfer(key, payload, chunk_size, window_size, timeout, network, compress, directory, seed):
+    receiver_socket = bound_socket()
+    output_file = os.path.join(directory, f"out-{chunk_size}-{window_size}-{timeout}-{seed}.json")
+    proxy = LossyProxy(receiver_socket.getsockname(), seed=seed, **network)
+    pipeline = ReceivePipeline(receiver_socket, proxy.sender_address, key, None, output_file, chunk_size, directory)
+    receiving = threading.Thread(target=pipeline.run, daemon=True)
+    sender_socket = bound_socket()
+    proxy.start()
+    receiving.start()
+    record = {
+        "chunk_size": chunk_size,
+        "window_size": window_size,
+        "timeout": timeout,
+        "seed": seed,
+        "bytes": len(payload),
+        "codec": NONE,
+    }
+    started = time.monotonic()
+    try:
+        encoded = encodings(payload) if compress else []
+        proxy_host, proxy_port = proxy.address
+        framer, codecs, replies = negotiate(sender_socket, key, [proxy_host], chunk_size, len(payload), encoded, port=proxy_port)
+        if proxy_host not in codecs:
+            raise TransferFailed("Receiver never answered HELLO")
+        codec = codecs[proxy_host]
+        record["codec"] = codec
+        data = dict(encoded)[codec] if codec != NONE else payload
+        source = MemorySource(data)
+        session = SendSession(sender_socket, proxy.address, source, chunk_size, framer, replies[proxy_host], window_size=window_size, timeout=timeout)
+        stats = session.run()
+        source.close()
+        record.update(
+            packets=stats["packets"],
+            sent=stats["sent"],
+            retransmissions=stats["retransmissions"],
+            fast_retransmissions=stats["fast_retransmissions"],
+            confirmed=stats["confirmed"],
+            error=None,
+        )
+    except TransferFailed as e:
+        record.update(packets=None, sent=None, retransmissions=None, fast_retransmissions=None, confirmed=None, error=str(e))
+    elapsed = time.monotonic() - started
+    pipeline.stopped.set()
+    receiving.join(STOP_TIMEOUT)
+    proxy.stop()
+    sender_socket.close()
+    receiver_socket.close()
+    record["completion_time"] = elapsed
+    record["goodput"] = len(payload) / elapsed if record["confirmed"] else 0.0
+    record["retransmission_ratio"] = record["retransmissions"] / record["packets"] if record["packets"] else 0.0
+    record["correct"] = os.path.exists(output_file) and file_digest(output_file) == hashlib.sha256(payload).hexdigest()
+    record["network"] = proxy.stats
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    return record
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def number_list(kind):
+    return lambda text: [kind(part) for part in text.split(",") if part.strip()]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Loopback benchmark for the playlist transfer protocol")
+    parser.add_argument("--chunk-sizes", type=number_list(int), default=[1024, 8192, 32768])
+    parser.add_argument("--windows", type=number_list(int), default=[4, 32])
+    parser.add_argument("--timeouts", type=number_list(float), default=[0.5, 2.0])
+    parser.add_argument("--size", type=int, default=1 << 20, help="playlist size in bytes")
+    parser.add_argument("--file", help="send this file instead of a generated playlist")
+    parser.add_argument("--loss", type=float, default=0.01)
+    parser.add_argument("--delay", type=float, default=0.002, help="one-way delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.001)
+    parser.add_argument("--duplicate", type=float, default=0.001)
+    parser.add_argument("--reorder", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compress", action="store_true", help="negotiate compression as the sender does")
+    parser.add_argument("--output", default="transfer_benchmark.json")
+    return parser.parse_args(argv)
+
+def show_results(results):
+    table = Table(title="Transfer Benchmark", header_style="bold magenta")
+    for column in ("Chunk", "Window", "Timeout", "Time (s)", "Goodput (KB/s)", "Retransmit %", "Correct"):
+        table.add_column(column, justify="right")
+    for record in results:
+        table.add_row(
+            str(record["chunk_size"]),
+            str(record["window_size"]),
+            f"{record['timeout']:g}",
+            f"{record['completion_time']:.2f}",
+            f"{record['goodput'] / 1024:.0f}",
+            f"{record['retransmission_ratio'] * 100:.1f}",
+            "[green]yes[/green]" if record["correct"] else f"[red]no[/red] {record['error'] or ''}",
+        )
+    console.print(table)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.file:
+        with open(args.file, "rb") as f:
+            payload = f.read()
+    else:
+        payload = sample_playlist(args.size, args.seed)
+    network = {
+        "loss": args.loss,
+        "delay": args.delay,
+        "jitter": args.jitter,
+        "duplicate": args.duplicate,
+        "reorder": args.reorder,
+    }
+    # A throwaway key: the benchmark never talks to a real peer
+    key = master_key(Fernet.generate_key())
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for chunk_size in args.chunk_sizes:
+            for window_size in args.windows:
+                for timeout in args.timeouts:
+                    for run in range(args.repeat):
+                        console.print(f"[dim]chunk {chunk_size}, window {window_size}, timeout {timeout:g}, run {run + 1}[/dim]")
+                        results.append(run_transfer(
+                            key, payload, chunk_size, window_size, timeout, network, args.compress, directory, args.seed + run
+                        ))
+    report = {
+        "benchmark": "transfer",
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "payload_bytes": len(payload),
+        "network": network,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    show_results(results)
+    console.print(f"[green]Results written to {args.output}[/green]")
+    return 0 if all(record["correct"] for record in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
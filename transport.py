@@ -0,0 +1,180 @@
+import os
+import json
+import random
+import socket
+import threading
+import time
+import certifi
+import httplib2
+import requests
+import spotipy
+import google_auth_httplib2
+from dotenv import load_dotenv
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+from resolver import LIMITERS, MAX_WORKERS, RateLimited, charge_quota, parse_retry_after
+
+load_dotenv("credentials.env")
+
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+RETRY_STATUSES = {500, 502, 503, 504}
+# Point the clients at local stand-ins instead of the real APIs
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL")
+YOUTUBE_API_URL = os.getenv("YOUTUBE_API_URL")
+
+_session = None
+_spotify_session = None
+_session_lock = threading.Lock()
+_local = threading.local()
+
+def backoff(attempt):
+    # Full jitter keeps workers that failed together from retrying together
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+def _pooled_session(max_retries=0):
+    pooled = requests.Session()
+    pooled.verify = certifi.where()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS, max_retries=max_retries)
+    pooled.mount("https://", adapter)
+    pooled.mount("http://", adapter)
+    return pooled
+
+def session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _pooled_session()
+        return _session
+
+def request(method, url, provider="http", **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    for attempt in range(MAX_RETRIES + 1):
+        started = time.monotonic()
+        try:
+            response = session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            metrics.api_call(provider, time.monotonic() - started)
+            if attempt == MAX_RETRIES:
+                raise
+        else:
+            metrics.api_call(provider, time.monotonic() - started, response.status_code)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return response
+        metrics.api_retry(provider)
+        time.sleep(backoff(attempt))
+
+def get(url, provider="http", **kwargs):
+    return request("GET", url, provider, **kwargs)
+
+def throttled(error):
+    # YouTube signals rate limits with 429, and with 403 rateLimitExceeded /
+    # userRateLimitExceeded; a 403 quotaExceeded is not worth retrying
+    return error.resp.status == 429 or (error.resp.status == 403 and b"ateLimitExceeded" in (error.content or b""))
+
+def retryable(error):
+    return error.resp.status in RETRY_STATUSES or throttled(error)
+
+def retry_delay(error, attempt, provider):
+    # Honours Retry-After when the API sends one, and holds back every
+    # other caller of the provider for as long
+    delay = parse_retry_after(error.resp.get("retry-after"), backoff(attempt))
+    if provider in LIMITERS:
+        LIMITERS[provider].bucket.pause(delay)
+    return delay
+
+def execute(api_request, provider="youtube"):
+    # Retries server errors itself; a throttled call is raised as
+    # RateLimited for the ProviderLimiter it runs under to pause and retry,
+    # so a 429 is only ever retried in one place
+    for attempt in range(MAX_RETRIES + 1):
+        # Every attempt counts against the daily quota, failed or not
+        charge_quota(provider, getattr(api_request, "methodId", None))
+        started = time.monotonic()
+        try:
+            response = api_request.execute()
+            metrics.api_call(provider, time.monotonic() - started, 200)
+            return response
+        except HttpError as e:
+            metrics.api_call(provider, time.monotonic() - started, e.resp.status)
+            if throttled(e):
+                raise RateLimited(provider, parse_retry_after(e.resp.get("retry-after"), None)) from e
+            if e.resp.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                raise
+        except (httplib2.HttpLib2Error, socket.timeout, ConnectionError):
+            metrics.api_call(provider, time.monotonic() - started)
+            if attempt == MAX_RETRIES:
+                raise
+        metrics.api_retry(provider)
+        time.sleep(backoff(attempt))
+
+def youtube_client(developer_key=None, credentials=None):
+    # httplib2 is not thread-safe, so each worker thread keeps its own client
+    clients = getattr(_local, "youtube_clients", None)
+    if clients is None:
+        clients = _local.youtube_clients = {}
+    cache_key = (developer_key, id(credentials))
+    if cache_key not in clients:
+        http = httplib2.Http(timeout=TIMEOUT)
+        if credentials is not None:
+            http = google_auth_httplib2.AuthorizedHttp(credentials, http=http)
+        if YOUTUBE_API_URL:
+            clients[cache_key] = build_from_document(youtube_discovery(YOUTUBE_API_URL), developerKey=developer_key, http=http)
+        else:
+            clients[cache_key] = build(
+                "youtube", "v3", developerKey=developer_key, http=http,
+                static_discovery=True, cache_discovery=False
+            )
+    return clients[cache_key]
+
+def youtube_discovery(root_url):
+    # api_endpoint alone would leave batch requests going to rootUrl, so
+    # rewrite the bundled discovery document instead
+    document = json.loads(discovery_cache.get_static_doc("youtube", "v3"))
+    root_url = root_url.rstrip("/") + "/"
+    document["rootUrl"] = document["mtlsRootUrl"] = root_url
+    document["baseUrl"] = root_url + document.get("servicePath", "")
+    return document
+
+def spotify_session():
+    # spotipy skips its own retry setup when handed a session, so mount an
+    # equivalent policy that also honours Retry-After on 429
+    global _spotify_session
+    with _session_lock:
+        if _spotify_session is None:
+            _spotify_session = _pooled_session(Retry(
+                total=MAX_RETRIES,
+                status_forcelist=[429] + sorted(RETRY_STATUSES),
+                allowed_methods=False,
+                backoff_factor=BACKOFF_BASE,
+                respect_retry_after_header=True,
+                raise_on_status=False
+            ))
+            _spotify_session.hooks["response"].append(record_spotify_call)
+        return _spotify_session
+
+def record_spotify_call(response, *args, **kwargs):
+    # urllib3 retries inside the adapter, so only the final response gets
+    # here; its retry history tells what happened before
+    history = getattr(getattr(response.raw, "retries", None), "history", None) or ()
+    metrics.api_call(
+        "spotify", response.elapsed.total_seconds(), response.status_code,
+        retries=len(history), throttled=sum(1 for attempt in history if attempt.status == 429)
+    )
+
+def spotify_client(auth_manager=None, auth=None):
+    client = spotipy.Spotify(
+        auth=auth,
+        auth_manager=auth_manager,
+        requests_session=spotify_session(),
+        requests_timeout=TIMEOUT
+    )
+    if SPOTIFY_API_URL:
+        client.prefix = SPOTIFY_API_URL.rstrip("/") + "/"
+    return client